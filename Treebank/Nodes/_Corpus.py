@@ -1,10 +1,50 @@
+import contextlib
+import gc
+import multiprocessing
+import os
+import os.path
 import sys
+import traceback
 
 from _Node import Node
 from _File import File
 from _Sentence import Sentence
+from _FileCache import FileCache
+from _SentenceIndex import SentenceIndex
+from _Visitor import perform, Timings, _FileOperation
+
+
+class FileError(Exception):
+    """
+    An error raised while a worker process was handling a file
+    """
+    def __init__(self, path, details):
+        Exception.__init__(self, path, details)
+        self.path = path
+        self.details = details
+
+    def __str__(self):
+        return 'Error processing %s:\n%s' % (self.path, self.details)
+
 
 class Corpus(Node):
+    # Keyword arguments passed on to fileClass
+    fileOptions = {}
+    # Dispose of each file's trees once iteration moves past it
+    disposeFiles = False
+    # Build trees with weak parent links (see Node.weakParents)
+    weakParents = False
+    # Switch the cyclic garbage collector off while a file is parsed
+    freezeGC = False
+    # Estimated bytes of parsed files to keep in an LRU cache. 0 turns the
+    # cache off
+    cacheBytes = 0
+    # Where the sentence index is kept. None keeps it in memory only
+    sentenceIndexPath = None
+    _fileCache = None
+    _byFilename = None
+    _sentenceIndex = None
+
     def parent(self):
         """
         Raises an error, because the root node has no parent
@@ -20,48 +60,243 @@ class Corpus(Node):
         self._children.append(newChild)
 
         
-    def performOperation(self, operation):
+    def performOperation(self, operation, workers=None):
         """
         Accept a Visitor and call it on each child
         Goofy name/design is legacy from when I didn't know how to code :(
+
+        Files are read as they are visited and not kept, so the corpus is
+        walked once: a visitor that sets moreChanges or queues changed()
+        regions raises ValueError, and should be run on each File instead.
+
+        If workers is set, a readOnly visitor is instead run over each file
+        in a pool of that many processes (see map), and the per-file
+        results are merged with its reduce, which is returned
         """
-        operation.newStructure()
-        operation.actOn(self)
-        for node in self.children():
-            operation.actOn(node)
+        if workers is None:
+            if getattr(operation, 'moreChanges', False):
+                raise ValueError("A corpus is only walked once: run moreChanges visitors "
+                                 "on each file")
+            perform(operation, self, self.children, rewalk=False)
+            return None
+        if not getattr(operation, 'readOnly', False):
+            raise ValueError("Only readOnly visitors can run in worker processes: "
+                             "edits made there would be lost")
+        results = []
+        timings = getattr(operation, 'timings', None)
+        if timings is None:
+            timings = operation.timings = Timings()
+        for result, fileTimings in self.map(_FileOperation(operation), workers=workers):
+            results.append(result)
+            timings.add(fileTimings)
+        return operation.reduce(results)
             
     def child(self, index):
         """
         Read a file by zero-index offset
         """
-        path = self._children[index]
+        return self._cachedFile(self._children[index])
+
+    def fileCache(self):
+        """
+        The corpus' FileCache, or None if cacheBytes is 0
+        """
+        if not self.cacheBytes:
+            return None
+        if self._fileCache is None:
+            self._fileCache = FileCache(self.cacheBytes)
+        self._fileCache.maxBytes = self.cacheBytes
+        return self._fileCache
+
+    def _cachedFile(self, key):
+        cache = self.fileCache()
+        if cache is None:
+            return self._loadFile(key)
+        file_ = cache.get(key)
+        if file_ is None:
+            file_ = self._loadFile(key)
+            cache.put(key, file_)
+        return file_
+
+    def _loadFile(self, path):
+        """
+        Parse a file. Keys are paths here; subclasses may use other keys
+        """
         print >> sys.stderr, path
         try:
-            return self.fileClass(path=path)
+            with self._loadSettings():
+                return self.fileClass(path=path, **self.fileOptions)
         except KeyError:
             print "Parse error!"
             raise
+
+    @contextlib.contextmanager
+    def _loadSettings(self):
+        """
+        Apply the weakParents and freezeGC settings while a file is built
+        """
+        weakParents = Node.weakParents
+        gcEnabled = gc.isenabled()
+        Node.weakParents = weakParents or self.weakParents
+        if self.freezeGC:
+            gc.disable()
+        try:
+            yield
+        finally:
+            Node.weakParents = weakParents
+            if gcEnabled:
+                gc.enable()
      
     
     def children(self):
         """
         Generator to iterate through children
         """
-        for i in xrange(len(self._children)):
-            yield self.child(i)
+        return self._iterFiles(xrange(len(self._children)))
+
+    def _iterFiles(self, indices):
+        """
+        Generate the files at the given indices. If disposeFiles is set, each
+        file is dismantled when the consumer asks for the next one
+        """
+        cache = self.fileCache()
+        for i in indices:
+            file_ = self.child(i)
+            yield file_
+            # Cached files are left alone, as they will be handed out again
+            if self.disposeFiles and not (cache and cache.peek(self._children[i]) is file_):
+                file_.dispose()
     
     def file(self, key):
         """
         Read a file by path
         """
-        return self.fileClass(path=key)
+        return self._cachedFile(key)
             
     def sentence(self, key):
+        """
+        Retrieve a sentence by globalID, which starts with the file's name.
+        If the sentence index is open, it is used to find the sentence
+        """
+        index = self._sentenceIndex
+        if index is not None and key in index:
+            return self._indexedSentence(index.entry(key))
         filename, sentenceKey = key.split('~')
-        file_ = self.file(filename)
+        if self._byFilename is None or len(self._byFilename) != len(self._children):
+            self._byFilename = dict((os.path.basename(child), i)
+                                    for i, child in enumerate(self._children))
+        file_ = self.child(self._byFilename[filename])
         return file_.sentence(key)
 
-    def sentences(self):
-        for child in self.children():
-            for sentence in child.children():
+    def sentences(self, workers=None, chunksize=1):
+        """
+        Generate every sentence. If workers is set, files are parsed in that
+        many processes, and the sentences come back frozen (see map)
+        """
+        if workers is None:
+            for child in self.children():
+                for sentence in child.children():
+                    yield sentence
+            return
+        for sentences in self.map(_frozenSentences, workers=workers, chunksize=chunksize):
+            for sentence in sentences:
                 yield sentence
+
+    def map(self, fn, workers=0, ordered=True, chunksize=1, indices=None):
+        """
+        Generate fn(file) for each file, or for the files at indices, with
+        the files parsed and fn called in a pool of worker processes.
+        workers=0 uses one process per CPU. Results are in file order
+        unless ordered is False, and must be picklable, as must fn: use a
+        module-level function. Errors are raised as FileError, naming the
+        file. The file cache isn't used
+        """
+        if indices is None:
+            indices = xrange(len(self._children))
+        tasks = [(fn, self._children[i]) for i in indices]
+        if workers == 1:
+            for fn, key in tasks:
+                yield _callOn(self, fn, key)
+            return
+        # Workers are forked, so the corpus reaches them without pickling
+        pool = multiprocessing.Pool(workers or None, _initWorker, (self,))
+        try:
+            if ordered:
+                results = pool.imap(_mapFile, tasks, chunksize)
+            else:
+                results = pool.imap_unordered(_mapFile, tasks, chunksize)
+            for result in results:
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def sentenceIndex(self, path=None, verify=False):
+        """
+        Open the corpus' SentenceIndex, stored at path (by default
+        sentenceIndexPath). The index is built on first use, and files that
+        have changed since are reindexed. Keep it outside the corpus'
+        directories, which may be read-only, and whose mtimes the manifest
+        checks
+        """
+        if path is None:
+            path = self.sentenceIndexPath
+        if self._sentenceIndex is None or self._sentenceIndex.path != path or verify:
+            self._sentenceIndex = SentenceIndex.open(self, path, verify=verify)
+        return self._sentenceIndex
+
+    def sample(self, n, seed=None, filter=None):
+        """
+        n sentences drawn at random, from those whose IndexEntry passes
+        filter. Only the sampled sentences are read
+        """
+        entries = self.sentenceIndex().sample(n, seed=seed, filter=filter)
+        return [self._indexedSentence(entry) for entry in entries]
+
+    def _indexedSentence(self, entry):
+        """
+        Build the sentence for an IndexEntry. This reads its whole file;
+        subclasses whose files can be seeked into should do better
+        """
+        return self._cachedFile(entry.fileKey).sentence(entry.key)
+
+    def _indexEntries(self, fileKey):
+        """
+        Generate an IndexEntry for each sentence of a file
+        """
+        raise NotImplementedError
+
+    def _sourcePaths(self, fileKey):
+        """
+        The paths on disk that a file is read from
+        """
+        return [fileKey]
+
+
+# The corpus that a worker process reads from. Set by _initWorker
+_workerCorpus = None
+
+
+def _initWorker(corpus):
+    global _workerCorpus
+    _workerCorpus = corpus
+    # Nodes built in different processes must not share globalIDs. Every
+    # worker starts from the parent's counter, so move each to its own range
+    Node._nextGlobalID += os.getpid() << 32
+
+
+def _mapFile(task):
+    fn, key = task
+    return _callOn(_workerCorpus, fn, key)
+
+
+def _callOn(corpus, fn, key):
+    try:
+        return fn(corpus._loadFile(key))
+    except Exception:
+        raise FileError(key, traceback.format_exc())
+
+
+def _frozenSentences(file_):
+    return [sentence.freeze() for sentence in file_.children()]
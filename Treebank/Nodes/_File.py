@@ -1,4 +1,9 @@
+import sys
+
 from _Node import Node
+from _Node import _indexOf
+from _Node import _bump
+from _Visitor import perform
 
 class File(Node):
     """
@@ -16,14 +21,25 @@ class File(Node):
         # Sentence without complaint
         self._children.append(newChild)
         self._IDDict[newChild.globalID] = newChild
+        _bump(self)
     
     def detachChild(self, node):
         """
         Delete a sentence
         """
-        self._children.remove(node)
+        del self._children[_indexOf(self._children, node)]
         self._IDDict.pop(node.globalID)
+        _bump(self)
     
+    def _release(self):
+        self._IDDict = {}
+        return Node._release(self)
+
+    def nbytes(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.__dict__) + \
+            sys.getsizeof(self._children) + sys.getsizeof(self._IDDict) + \
+            sum(child.nbytes() for child in self._children)
+
     def sentence(self, key):
         """
         Retrieve a sentence by key
@@ -38,21 +54,4 @@ class File(Node):
         Accept a Visitor and call it on each child
         Goofy name/design is legacy from when I didn't know how to code :(
         """
-        operation.newStructure()
-        operation.actOn(self)
-        for node in getattr(self, operation.listType)():
-            try:
-                operation.actOn(node)
-            # Give operations the opportunity to signal
-            # when the work is complete
-            except Break:
-                break
-        while operation.moreChanges:
-            operation.actOn(self)
-            for node in getattr(self, operation.listType)():
-                try:
-                    operation.actOn(node)
-                # Give operations the opportunity to signal
-                # when the work is complete
-                except Break:
-                    break
+        perform(operation, self)
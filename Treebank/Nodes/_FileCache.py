@@ -0,0 +1,72 @@
+import collections
+
+
+class FileCache(object):
+    """
+    Least-recently-used cache of parsed files, bounded by their estimated
+    size in bytes (see Node.nbytes) rather than by a count. Evicted files
+    are only dropped, not disposed, as callers may still hold them
+    """
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self._files = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, key):
+        return key in self._files
+
+    def get(self, key):
+        """
+        The cached file for key, or None. A hit makes the file the most
+        recently used
+        """
+        try:
+            file_, size = self._files.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._files[key] = (file_, size)
+        self.hits += 1
+        return file_
+
+    def peek(self, key):
+        """
+        The cached file for key, or None, without counting a lookup
+        """
+        entry = self._files.get(key)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def put(self, key, file_):
+        """
+        Add a file, evicting the least recently used until it fits. Files
+        larger than the whole budget are not kept
+        """
+        if key in self._files:
+            self.bytes -= self._files.pop(key)[1]
+        size = file_.nbytes()
+        if size > self.maxBytes:
+            return
+        while self._files and self.bytes + size > self.maxBytes:
+            oldKey, (oldFile, oldSize) = self._files.popitem(last=False)
+            self.bytes -= oldSize
+            self.evictions += 1
+        self._files[key] = (file_, size)
+        self.bytes += size
+
+    def clear(self):
+        self._files.clear()
+        self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'files': len(self._files), 'bytes': self.bytes,
+                'hitRate': self.hits / float(lookups) if lookups else 0.0}
@@ -5,6 +5,8 @@ class Leaf(Node):
     A leaf of the parse tree -- ie, a word, punctuation or trace
     Cannot attach or retrieve children
     """
+    __slots__ = ()
+
     def __hash__(self):
         return self.wordID
 
@@ -35,6 +37,9 @@ class Leaf(Node):
     
     def listWords(self):
         return [self]
+
+    def _words(self):
+        return [self]
         
     def lemma(self):
         """
@@ -79,16 +84,17 @@ class Leaf(Node):
         return bool(self.label in punct)
 
     def nextWord(self):
-        words = self.root().listWords()
-        nextID = self.wordID + 1
-        if nextID == len(words):
+        root = self.root()
+        words = root._words()
+        nextPosition = root.wordPosition(self) + 1
+        if nextPosition == len(words):
             return None
         else:
-            assert self is not words[self.wordID+1]
-            return words[self.wordID+1]
+            return words[nextPosition]
 
     def prevWord(self):
-        if self.wordID == 0:
+        root = self.root()
+        position = root.wordPosition(self)
+        if position == 0:
             return None
-        words = self.root().listWords()
-        return words[self.wordID - 1]
+        return root._words()[position - 1]
@@ -0,0 +1,174 @@
+import collections
+import os
+import stat
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# One file of a corpus. path is relative to the corpus root; number,
+# section and split are whatever the corpus derives from the name, with
+# -1 or '' where they don't apply
+ManifestEntry = collections.namedtuple('ManifestEntry', ['key', 'path', 'size', 'mtime',
+                                                         'number', 'section', 'split'])
+
+
+class Manifest(object):
+    """
+    The files of a corpus, with their sizes, mtimes and the numbers the
+    corpus derives from their names, kept on disk so that a corpus can
+    open without listing its directories. The mtime of every directory
+    walked is recorded, and the manifest is rebuilt when any of them
+    changes, as it does when a file is added, removed or renamed. Sizes
+    and mtimes are as of the last build, as editing a file leaves its
+    directory alone.
+
+    Keep the manifest outside the corpus' directories, or saving it
+    would change one of the mtimes it checks. A manifest is only read back
+    for the same root, top directory and describe function, so corpora
+    can't pick up each other's
+    """
+    version = '2'
+
+    def __init__(self, root, path=None, top='', describeID=''):
+        self.root = root
+        self.top = top
+        self.describeID = describeID
+        self.path = path
+        self.entries = []
+        # Directory, relative to root -> mtime
+        self.directories = {}
+        self._byKey = None
+
+    @classmethod
+    def open(cls, root, describe, path=None, top='', describeID=None):
+        """
+        The manifest of the files below root/top. describe(name) gives
+        (key, number, section, split) for a file name, or None to leave it
+        out. If path is given, the manifest is read from there when it is
+        still valid, and saved there when it is rebuilt. describeID names
+        describe in the saved manifest, by default by its module and name
+        """
+        if describeID is None:
+            describeID = '%s.%s' % (describe.__module__, describe.__name__)
+        if path is not None and os.path.exists(path):
+            manifest = cls(root, path, top, describeID)
+            if manifest._read() and manifest.isCurrent():
+                return manifest
+        manifest = cls(root, path, top, describeID)
+        manifest._build(describe, top)
+        if path is not None:
+            manifest.save()
+        return manifest
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        """
+        The distinct keys, in order
+        """
+        seen = set()
+        keys = []
+        for entry in self.entries:
+            if entry.key not in seen:
+                seen.add(entry.key)
+                keys.append(entry.key)
+        return keys
+
+    def entry(self, key):
+        """
+        The first entry for key
+        """
+        if self._byKey is None:
+            self._byKey = {}
+            for entry in self.entries:
+                self._byKey.setdefault(entry.key, entry)
+        return self._byKey[key]
+
+    def isCurrent(self):
+        """
+        Whether every directory walked still has the recorded mtime
+        """
+        for directory, mtime in self.directories.items():
+            try:
+                if os.stat(os.path.join(self.root, directory)).st_mtime != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def _build(self, describe, top):
+        entries = []
+        pending = [top]
+        while pending:
+            directory = pending.pop()
+            self.directories[directory] = os.stat(os.path.join(self.root, directory)).st_mtime
+            for name, isDir, info in _listDirectory(os.path.join(self.root, directory)):
+                if name.startswith('.') or name == 'CVS':
+                    continue
+                relPath = os.path.join(directory, name)
+                if isDir:
+                    pending.append(relPath)
+                    continue
+                description = describe(name)
+                if description is None:
+                    continue
+                key, number, section, split = description
+                if info is None:
+                    info = os.stat(os.path.join(self.root, relPath))
+                entries.append(ManifestEntry(key, relPath, info.st_size, info.st_mtime,
+                                             number, section, split))
+        entries.sort(key=lambda entry: entry.path)
+        self.entries = entries
+
+    def _read(self):
+        lines = open(self.path).read().split('\n')
+        if lines[0] != self._header():
+            return False
+        for line in lines[1:]:
+            if not line:
+                continue
+            fields = line.split('\t')
+            if fields[0] == 'D':
+                self.directories[fields[1]] = float(fields[2])
+            else:
+                key, path, size, mtime, number, section, split = fields[1:]
+                self.entries.append(ManifestEntry(key, path, int(size), float(mtime),
+                                                  int(number), int(section), split))
+        return True
+
+    def _header(self):
+        return '#Manifest\t%s\t%s\t%s\t%s' % (self.version, self.root, self.top,
+                                                  self.describeID)
+
+    def save(self):
+        lines = [self._header()]
+        for directory, mtime in sorted(self.directories.items()):
+            lines.append('D\t%s\t%r' % (directory, mtime))
+        for entry in self.entries:
+            lines.append('E\t%s\t%s\t%d\t%r\t%d\t%d\t%s' % entry)
+        # Write to the side and rename, so that a reader never sees half a file
+        tmpPath = '%s.%d.tmp' % (self.path, os.getpid())
+        open(tmpPath, 'w').write('\n'.join(lines) + '\n')
+        os.rename(tmpPath, self.path)
+
+
+def _listDirectory(path):
+    """
+    Generate (name, isDir, stat or None) for the entries of a directory,
+    with os.scandir where it is available, which saves a stat per
+    subdirectory
+    """
+    if scandir is not None:
+        for entry in scandir(path):
+            isDir = entry.is_dir()
+            yield entry.name, isDir, None if isDir else entry.stat()
+        return
+    for name in os.listdir(path):
+        info = os.stat(os.path.join(path, name))
+        yield name, stat.S_ISDIR(info.st_mode), info
@@ -1,4 +1,7 @@
 import bisect
+import collections
+import sys
+import weakref
 
 class AttachmentError(Exception):
     def __init__(self, value):
@@ -7,12 +10,28 @@ class AttachmentError(Exception):
         return repr(self.value)
 
 class Node(object):
-    globalID = 0
+    # Nodes are created in large numbers, so keep them slotted. Subclasses
+    # that add attributes must declare them in their own __slots__
+    __slots__ = ('globalID', '_children', '_parent', 'label', '_yield', '_yieldVersion',
+                 '_treeIndex', '_edits', '__weakref__')
+    # Class-level counter for globalID
+    _nextGlobalID = 0
+    # If set, new parent links are weak references, so that a tree is freed
+    # by reference counting once its root goes, instead of waiting for the
+    # cyclic collector. Nodes then can't keep their ancestors alive: a
+    # subtree held on its own loses its parent
+    weakParents = False
     def __init__(self, label):
-        self.globalID = Node.globalID
+        self.globalID = Node._nextGlobalID
         self._children = []
         self._parent = None
-        Node.globalID += 1
+        self._yield = None
+        self._yieldVersion = -1
+        self._treeIndex = None
+        # Bumped by every structural edit in the subtree (see _bump). Cached
+        # yields are only valid if they were computed at the current count
+        self._edits = 0
+        Node._nextGlobalID += 1
         self.label = label
         
     def __hash__(self):
@@ -23,11 +42,12 @@ class Node(object):
         Detach from current location and move to a new location
         in the tree
         """
-        depthList = self.depthList()
-        lookup = {}
-        for n in depthList:
-            lookup[n] = True
-        assert not newParent in lookup
+        # The new parent must not be in our subtree. Walking up from it is
+        # O(depth), where a lookup over our descendants would be O(n)
+        node = newParent
+        while node is not None:
+            assert node is not self
+            node = _parentOf(node)
         self._detachFromParent()
     	newParent.attachChild(self, index)
         
@@ -49,25 +69,27 @@ class Node(object):
         else:
             self._children.insert(index, newChild)
         newChild.setParent(self)
+        _bump(self)
         
         
     def _detachFromParent(self):
-        self._parent.detachChild(self)
+        _parentOf(self).detachChild(self)
         self._parent = None
         
     def detachChild(self, node):
         """
         Detach a specific node. Deprecated; use node.prune()
         """
-        self._children.remove(node)
+        del self._children[_indexOf(self._children, node)]
+        _bump(self)
         
         
     def setParent(self, node):
         """
         Set a node as parent. Does not add as child
         """
-        assert not self._parent
-        self._parent = node
+        assert _parentOf(self) is None
+        self._parent = _link(node)
  
         
     def prettyPrint(self):
@@ -81,7 +103,7 @@ class Node(object):
         Returns _parent
         Should be change to property, perhaps
         """
-        return self._parent
+        return _parentOf(self)
         
         
     def child(self, index):
@@ -118,7 +140,7 @@ class Node(object):
         """
         Insert a new node where an old one was
         """
-        index = self._children.index(currentChild)
+        index = _indexOf(self._children, currentChild)
         if replacement.parent():
             replacement.reattach(self, index)
         else:
@@ -130,6 +152,88 @@ class Node(object):
         Detach node from parent
         """
         self._detachFromParent()
+
+    def dispose(self):
+        """
+        Break every link in the subtree below and including self, so that it
+        is freed by reference counting instead of by the cyclic garbage
+        collector. The nodes can't be used afterwards
+        """
+        if _parentOf(self) is not None:
+            self._detachFromParent()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            stack.extend(node._release())
+
+    def nbytes(self):
+        """
+        Rough estimate of the memory held by the subtree, in bytes. Only
+        the nodes and their child lists are counted
+        """
+        total = sys.getsizeof(self) + sys.getsizeof(self._children)
+        for node in self.depthFirst():
+            total += sys.getsizeof(node) + sys.getsizeof(node._children)
+        return total
+
+    def _release(self):
+        """
+        Drop this node's references to other nodes, returning the children
+        that still need releasing. Subclasses that keep more references
+        should extend this
+        """
+        children = self._children
+        self._children = []
+        self._parent = None
+        self._yield = None
+        self._treeIndex = None
+        return children
+
+    def sweep(self, predicate=None, nodes=None, splice=False):
+        """
+        Remove every descendant that matches predicate, or is in nodes, in
+        one bottom-up pass, and return the removed nodes. Without splice a
+        match is pruned along with its subtree; with splice its surviving
+        children take its place, as in delete().
+
+        The predicate sees each node after its own children have been
+        swept, so lambda n: not n.isLeaf() and not n.length() removes whole
+        chains of empty constituents. Deleting k of n nodes costs O(n),
+        rather than O(k*n) for k separate prune() calls. Give either
+        predicate or nodes, not both
+        """
+        if (predicate is None) == (nodes is None):
+            raise ValueError("sweep needs either a predicate or nodes, not both")
+        if nodes is not None:
+            ids = set(id(n) for n in nodes)
+            predicate = lambda n: id(n) in ids
+        removed = []
+        # Internal nodes in post-order, so children are swept before parents
+        internal = [n for n in self.postOrder() if n._children]
+        internal.append(self)
+        for node in internal:
+            kept = []
+            changed = False
+            for child in node._children:
+                if not predicate(child):
+                    kept.append(child)
+                    continue
+                changed = True
+                removed.append(child)
+                child._parent = None
+                if splice:
+                    for grandChild in child._children:
+                        grandChild._parent = _link(node)
+                        kept.append(grandChild)
+                    child._children = []
+                    # Already unlinked, so this only counts on child
+                    _bump(child)
+            if changed:
+                node._children = kept
+                # Bump per change, so that predicates looking at yields see
+                # the tree as swept so far
+                _bump(node)
+        return removed
         
     def sortChildren(self):
         """
@@ -138,47 +242,150 @@ class Node(object):
         decorated = [(c.getWordID(0), c) for c in self._children]
         decorated.sort()
         self._children = [d[1] for d in decorated]
+        _bump(self)
         
     def depthList(self):
         """
         Depth-first node list
         """
-        # Avoid recursion, for speed
-        queue = list(self.children())
-        # Can't use enumerate because changing list in place
-        # Must stay 1 ahead of the current index
-        i = 0
-        for node in queue:
-            i += 1
-            if not node.isLeaf():
-                for j, child in enumerate(node.children()):
-                    queue.insert(i+j, child)
-        return queue
+        return list(self.depthFirst())
         
     def breadthList(self):
         """
         Breadth-first node list
         """
-        children = [child for child in self.children()]
-        for child in children:
-            for subChild in child.children():
-                children.append(subChild)
-        return children
+        return list(self.breadthFirst())
+
+    # Traversal generators. None of them include self. The mode decides
+    # what happens if the tree is edited while a walk is in progress:
+    #   'lazy':      walk the live tree; an edit raises RuntimeError
+    #   'snapshot':  collect the nodes before yielding any of them
+    #   'tombstone': walk the live tree, skipping nodes (and their subtrees)
+    #                that were detached from their parent after being queued
+
+    def depthFirst(self, mode='lazy'):
+        """
+        Generate descendants in pre-order
+        """
+        _checkMode(mode)
+        if mode == 'snapshot':
+            return iter(list(self._preOrder('lazy', False)))
+        return self._preOrder(mode, False)
+
+    def leaves(self, mode='lazy'):
+        """
+        Generate the leaves below the node, in order
+        """
+        _checkMode(mode)
+        if mode == 'snapshot':
+            return iter(list(self._preOrder('lazy', True)))
+        return self._preOrder(mode, True)
+
+    def postOrder(self, mode='lazy'):
+        """
+        Generate descendants in post-order, children before parents
+        """
+        _checkMode(mode)
+        if mode == 'snapshot':
+            return iter(list(self._postOrder('lazy')))
+        return self._postOrder(mode)
+
+    def breadthFirst(self, mode='lazy'):
+        """
+        Generate descendants level by level
+        """
+        _checkMode(mode)
+        if mode == 'snapshot':
+            return iter(list(self._breadthFirst('lazy')))
+        return self._breadthFirst(mode)
+
+    def _preOrder(self, mode, leavesOnly):
+        tombstone = mode == 'tombstone'
+        edits = self._edits
+        # The direct children of Files have no parent link, so edits to
+        # them aren't counted on self. Each is checked while it is walked
+        top = None
+        topEdits = 0
+        # Stack of (node, parent it was queued under). The direct children
+        # of Files have no parent link, hence None
+        parent = _queuedParent(self)
+        stack = [(child, parent) for child in reversed(self._children)]
+        while stack:
+            node, parent = stack.pop()
+            if tombstone:
+                if parent is not None and _parentOf(node) is not parent:
+                    continue
+            elif self._edits != edits or (top is not None and top._edits != topEdits):
+                raise RuntimeError('Tree edited during a lazy walk')
+            if parent is None:
+                top = node
+                topEdits = node._edits
+            if not leavesOnly or node.isLeaf():
+                yield node
+                if tombstone and parent is not None and _parentOf(node) is not parent:
+                    continue
+            stack.extend([(child, node) for child in reversed(node._children)])
+
+    def _postOrder(self, mode):
+        tombstone = mode == 'tombstone'
+        edits = self._edits
+        # As in _preOrder, each top is walked in full before the next
+        top = None
+        topEdits = 0
+        # Entries are (node, parent, expanded)
+        parent = _queuedParent(self)
+        stack = [(child, parent, False) for child in reversed(self._children)]
+        while stack:
+            node, parent, expanded = stack.pop()
+            if tombstone:
+                if parent is not None and _parentOf(node) is not parent:
+                    continue
+            elif self._edits != edits or (top is not None and top._edits != topEdits):
+                raise RuntimeError('Tree edited during a lazy walk')
+            if parent is None:
+                top = node
+                topEdits = node._edits
+            if expanded or not node._children:
+                yield node
+            else:
+                stack.append((node, parent, True))
+                stack.extend([(child, node, False) for child in reversed(node._children)])
+
+    def _breadthFirst(self, mode):
+        tombstone = mode == 'tombstone'
+        edits = self._edits
+        # Levels mix the tops, so each entry carries the top it is under,
+        # and the tops' counts are kept from when they were first reached
+        topEdits = {}
+        # Entries are (node, parent, top)
+        parent = _queuedParent(self)
+        queue = collections.deque((child, parent, child) for child in self._children)
+        while queue:
+            node, parent, top = queue.popleft()
+            if tombstone:
+                if parent is not None and _parentOf(node) is not parent:
+                    continue
+            elif self._edits != edits or topEdits.setdefault(top, top._edits) != top._edits:
+                raise RuntimeError('Tree edited during a lazy walk')
+            yield node
+            if tombstone and parent is not None and _parentOf(node) is not parent:
+                continue
+            queue.extend([(child, node, top) for child in node._children])
         
     def getWordID(self, index):
         """
         Word ID at index. Generally 0 or -1
         """
-        wordIDList = [word.wordID for word in self.listWords()]
-        if not wordIDList:
+        wordList = self._words()
+        if not wordList:
             return 0
-        return wordIDList[index]
+        return wordList[index].wordID
         
     def getWord(self, index):
         """
         Word ID at index. Generally 0 or -1
         """
-        wordList = self.listWords()
+        wordList = self._words()
         if not wordList:
             return None
         return wordList[index]
@@ -187,7 +394,17 @@ class Node(object):
         """
         List the word yield of the node
         """
-        return [n for n in self.depthList() if n.isLeaf()]
+        return list(self._words())
+
+    def _words(self):
+        """
+        The cached word yield. It is rebuilt if the tree has been edited
+        since it was computed. Callers must not modify the list
+        """
+        if self._yieldVersion != self._edits:
+            self._yield = list(self.leaves())
+            self._yieldVersion = self._edits
+        return self._yield
         
     def length(self, constraint = None):
         """
@@ -225,6 +442,37 @@ class Node(object):
         else:
             return False
 
+    def treeIndex(self):
+        """
+        The pre/post-order index of the tree this node is in
+        """
+        from _TreeIndex import TreeIndex
+        return TreeIndex.get(self.root())
+
+    def dominates(self, other):
+        """
+        True if other is a proper descendant of self
+        """
+        return self.treeIndex().dominates(self, other)
+
+    def isAncestor(self, other):
+        """
+        Alias for dominates
+        """
+        return self.dominates(other)
+
+    def commonAncestor(self, other):
+        """
+        The lowest node dominating, or equal to, both self and other
+        """
+        return self.treeIndex().commonAncestor(self, other)
+
+    def isUnder(self, label):
+        """
+        True if some ancestor of self has the given label
+        """
+        return self.treeIndex().isUnder(self, label)
+
     def ancestors(self):
         """
         Generate parents
@@ -281,3 +529,59 @@ class Node(object):
         
     def __str__(self):
         return self.prettyPrint()
+
+
+def _link(node):
+    """
+    The value to store as a parent link to node
+    """
+    if Node.weakParents:
+        return weakref.ref(node)
+    return node
+
+
+def _parentOf(node):
+    """
+    Follow a parent link, which may be weak
+    """
+    parent = node._parent
+    if type(parent) is weakref.ref:
+        return parent()
+    return parent
+
+
+def _bump(node):
+    """
+    Count an edit to node's subtree, on node and each of its ancestors.
+    Edits to one tree leave the counts, and so the caches, of every other
+    tree alone
+    """
+    while node is not None:
+        node._edits += 1
+        node = _parentOf(node)
+
+
+def _queuedParent(node):
+    """
+    The parent to queue node's children under in a walk: node, unless the
+    children don't link back to it, as a File's sentences don't
+    """
+    if node._children and _parentOf(node._children[0]) is node:
+        return node
+    return None
+
+
+def _indexOf(children, node):
+    """
+    Find a child by identity. list.index would call __eq__ on every
+    sibling before it
+    """
+    for i, child in enumerate(children):
+        if child is node:
+            return i
+    raise ValueError("Node is not a child")
+
+
+def _checkMode(mode):
+    if mode not in ('lazy', 'snapshot', 'tombstone'):
+        raise ValueError("Unknown traversal mode: %s" % mode)
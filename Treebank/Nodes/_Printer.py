@@ -1,4 +1,5 @@
 import Treebank.Nodes
+from _Visitor import Break
 
 class Printer(object):
     """
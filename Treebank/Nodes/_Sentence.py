@@ -2,9 +2,11 @@ import nltk.corpus
 
 from _Node import Node
 from _Printer import Printer
+from _Visitor import perform
 
 
 class Sentence(Node):
+    __slots__ = ()
     _printer = Printer()
     def __str__(self):
         return self._printer(self)
@@ -20,27 +22,23 @@ class Sentence(Node):
         Accept a Visitor and call it on each child
         Goofy name/design is legacy from when I didn't know how to code :(
         """
-        operation.newStructure()
-        operation.actOn(self)
-        for node in self.depthList():
-            try:
-                operation.actOn(node)
-            # Give operations the opportunity to signal
-            # when the work is complete
-            except Break:
-                break
-        while operation.moreChanges:
-            operation.actOn(self)
-            for node in getattr(self, operation.listType)():
-                try:
-                    operation.actOn(node)
-                # Give operations the opportunity to signal
-                # when the work is complete
-                except Break:
-                    break
+        perform(operation, self)
 
     def isRoot(self):
         return True
+
+    def wordPosition(self, word):
+        """
+        Index of a word in the sentence's yield
+        """
+        return self._words().index(word)
+
+    def window(self, word, size):
+        """
+        The word with up to size words either side of it
+        """
+        position = self.wordPosition(word)
+        return self._words()[max(0, position - size):position + size + 1]
     
     def addSenses(self):
         for word in self.listWords():
@@ -0,0 +1,140 @@
+import collections
+import hashlib
+import os
+import random
+
+# One sentence of the index. offset and length locate the sentence's text
+# in its file, if the format allows seeking to it; otherwise offset is -1
+IndexEntry = collections.namedtuple('IndexEntry', ['key', 'fileKey', 'localID', 'offset',
+                                                   'length', 'nWords', 'speaker', 'edited'])
+
+
+class SentenceIndex(object):
+    """
+    On-disk index of every sentence in a corpus, with cheap metadata for
+    filtering. The index is kept as a tab-separated file, with a signature
+    (size and mtime) and an MD5 digest of each corpus file's sources, so
+    that stale entries are found and rebuilt on open.
+
+    The corpus supplies the entries for one file through _indexEntries, and
+    the paths a file is read from through _sourcePaths
+    """
+    version = '3'
+
+    def __init__(self, corpus, path):
+        self.corpus = corpus
+        self.path = path
+        self.entries = []
+        self._byKey = {}
+        # fileKey -> (signature, digest), and fileKey -> entries
+        self._files = {}
+        self._fileEntries = {}
+
+    @classmethod
+    def open(cls, corpus, path, verify=False):
+        """
+        Load the index at path, reindexing any files that have changed,
+        been added or been removed since it was written. If verify is set,
+        file contents are checked against their digests as well. Without a
+        path, the index is built and kept in memory only
+        """
+        index = cls(corpus, path)
+        if path is not None and os.path.exists(path):
+            index._read()
+        byFile = index._fileEntries
+        changed = False
+        for fileKey in corpus._children:
+            known = index._files.get(fileKey)
+            if known is None or index._isStale(fileKey, known, verify):
+                byFile[fileKey] = index._indexFile(fileKey)
+                changed = True
+        current = set(corpus._children)
+        for fileKey in byFile.keys():
+            if fileKey not in current:
+                del byFile[fileKey]
+                index._files.pop(fileKey)
+                changed = True
+        for fileKey in corpus._children:
+            index.entries.extend(byFile[fileKey])
+        index._byKey = dict((entry.key, entry) for entry in index.entries)
+        if changed and path is not None:
+            index.save()
+        return index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self._byKey
+
+    def entry(self, key):
+        return self._byKey[key]
+
+    def sample(self, n, seed=None, filter=None):
+        """
+        n entries drawn at random without replacement, from those that pass
+        filter. The same seed gives the same sample
+        """
+        entries = self.entries
+        if filter is not None:
+            entries = [entry for entry in entries if filter(entry)]
+        return random.Random(seed).sample(entries, min(n, len(entries)))
+
+    def _signature(self, fileKey):
+        stats = [os.stat(path) for path in self.corpus._sourcePaths(fileKey)]
+        # Whole mtimes miss a rewrite of the same size within a second
+        return ';'.join('%d:%r' % (s.st_size, s.st_mtime) for s in stats)
+
+    def _digest(self, fileKey):
+        md5 = hashlib.md5()
+        for path in self.corpus._sourcePaths(fileKey):
+            md5.update(open(path, 'rb').read())
+        return md5.hexdigest()
+
+    def _isStale(self, fileKey, known, verify):
+        signature, digest = known
+        try:
+            if self._signature(fileKey) != signature:
+                return True
+        except OSError:
+            return True
+        return verify and self._digest(fileKey) != digest
+
+    def _indexFile(self, fileKey):
+        self._files[fileKey] = (self._signature(fileKey), self._digest(fileKey))
+        return list(self.corpus._indexEntries(fileKey))
+
+    def _read(self):
+        byFile = self._fileEntries
+        lines = open(self.path).read().split('\n')
+        if lines[0] != '#SentenceIndex\t%s' % self.version:
+            return
+        entries = None
+        for line in lines[1:]:
+            if not line:
+                continue
+            fields = line.split('\t')
+            if fields[0] == 'F':
+                fileKey, signature, digest = fields[1:]
+                self._files[fileKey] = (signature, digest)
+                entries = byFile[fileKey] = []
+            else:
+                key, localID, offset, length, nWords, speaker, edited = fields[1:]
+                entries.append(IndexEntry(key, fileKey, int(localID), int(offset),
+                                          int(length), int(nWords),
+                                          speaker if speaker != '-' else None,
+                                          edited == '1'))
+
+    def save(self):
+        lines = ['#SentenceIndex\t%s' % self.version]
+        for fileKey in self.corpus._children:
+            signature, digest = self._files[fileKey]
+            lines.append('F\t%s\t%s\t%s' % (fileKey, signature, digest))
+            for entry in self._fileEntries[fileKey]:
+                lines.append('S\t%s\t%d\t%d\t%d\t%d\t%s\t%d' % (
+                    entry.key, entry.localID, entry.offset, entry.length, entry.nWords,
+                    entry.speaker or '-', entry.edited))
+        # Write to the side and rename, so that a reader never sees half a file
+        tmpPath = '%s.%d.tmp' % (self.path, os.getpid())
+        open(tmpPath, 'w').write('\n'.join(lines) + '\n')
+        os.rename(tmpPath, self.path)
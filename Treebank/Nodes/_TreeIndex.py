@@ -0,0 +1,154 @@
+class TreeIndex(object):
+    """
+    Pre/post-order numbering of a tree, for constant-time dominance and
+    lowest-common-ancestor queries. An index describes the tree as it was
+    when it was built; use TreeIndex.get to fetch one that is current
+    """
+    def __init__(self, root):
+        self.root = root
+        self.version = root._edits
+        # Pre-order node list, and per-node numbers keyed by id(node). The
+        # list keeps the nodes alive, so the ids stay valid
+        self.nodes = [root]
+        self.nodes.extend(root.depthFirst())
+        self._pre = {}
+        self._post = {}
+        self._depths = []
+        self._ends = []
+        # Euler tour, as pre-order numbers, for the LCA queries
+        self._tour = []
+        self._firstVisit = []
+        self._sparse = None
+        self._labelled = {}
+        self._number()
+
+    @staticmethod
+    def get(root):
+        """
+        The index for a root, rebuilt if the tree has been edited since.
+        The index is kept on the root
+        """
+        index = getattr(root, '_treeIndex', None)
+        if index is None or index.version != root._edits:
+            index = TreeIndex(root)
+            root._treeIndex = index
+        return index
+
+    def _number(self):
+        pre = self._pre
+        for i, node in enumerate(self.nodes):
+            pre[id(node)] = i
+        n = len(self.nodes)
+        depths = self._depths = [0] * n
+        ends = self._ends = [0] * n
+        self._firstVisit = [0] * n
+        tour = self._tour
+        post = 0
+        # The highest pre-order number visited so far. When a node is
+        # closed, this is its last descendant
+        lastSeen = 0
+        # Stack of (pre-order number, child iterator)
+        stack = [(0, iter(self.nodes[0]._children))]
+        tour.append(0)
+        while stack:
+            i, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                self._post[id(self.nodes[i])] = post
+                post += 1
+                ends[i] = lastSeen + 1
+                if stack:
+                    tour.append(stack[-1][0])
+                continue
+            j = pre[id(child)]
+            depths[j] = depths[i] + 1
+            self._firstVisit[j] = len(tour)
+            lastSeen = j
+            tour.append(j)
+            stack.append((j, iter(child._children)))
+
+    def numbers(self, node):
+        """
+        The (pre, post) numbers of a node
+        """
+        key = id(node)
+        return self._pre[key], self._post[key]
+
+    def depth(self, node):
+        return self._depths[self._pre[id(node)]]
+
+    def dominates(self, node, other):
+        """
+        True if node is a proper ancestor of other. Nodes outside the tree
+        are dominated by nothing in it
+        """
+        a = id(node)
+        b = id(other)
+        if b not in self._pre:
+            return False
+        return self._pre[a] < self._pre[b] and self._post[b] < self._post[a]
+
+    def commonAncestor(self, node, other):
+        """
+        The lowest node dominating (or equal to) both nodes
+        """
+        if self._sparse is None:
+            self._buildSparse()
+        l = self._firstVisit[self._pre[id(node)]]
+        r = self._firstVisit[self._pre[id(other)]]
+        if l > r:
+            l, r = r, l
+        k = (r - l + 1).bit_length() - 1
+        table = self._sparse[k]
+        a = table[l]
+        b = table[r - (1 << k) + 1]
+        if self._depths[a] <= self._depths[b]:
+            return self.nodes[a]
+        return self.nodes[b]
+
+    def _buildSparse(self):
+        # Range-minimum table over depths along the Euler tour. Row k holds
+        # the shallowest node in each window of 2**k tour entries
+        depths = self._depths
+        m = len(self._tour)
+        self._sparse = [list(self._tour)]
+        width = 2
+        while width <= m:
+            prev = self._sparse[-1]
+            half = width // 2
+            row = []
+            for i in xrange(m - width + 1):
+                a = prev[i]
+                b = prev[i + half]
+                row.append(a if depths[a] <= depths[b] else b)
+            self._sparse.append(row)
+            width *= 2
+
+    def isUnder(self, node, label):
+        """
+        True if node has a proper ancestor with the given label. The first
+        query for a label marks every node under it in one pass
+        """
+        marks = self._labelled.get(label)
+        if marks is None:
+            marks = self._markLabel(label)
+        return bool(marks[self._pre[id(node)]])
+
+    def _markLabel(self, label):
+        n = len(self.nodes)
+        # Difference array over pre-order numbers: +1 where a labelled
+        # subtree's descendants start, -1 where they end
+        diff = [0] * (n + 1)
+        for i, node in enumerate(self.nodes):
+            if node.label == label:
+                diff[i + 1] += 1
+                diff[self._ends[i]] -= 1
+        marks = bytearray(n)
+        running = 0
+        for i in xrange(n):
+            running += diff[i]
+            if running:
+                marks[i] = 1
+        self._labelled[label] = marks
+        return marks
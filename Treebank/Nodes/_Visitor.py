@@ -0,0 +1,172 @@
+import copy
+import time
+
+from _Node import _parentOf
+
+
+class Break(Exception):
+    """
+    Raised by a visitor's actOn to end the current walk early
+    """
+
+
+class Timings(object):
+    """
+    Counters for the walks one visitor has made
+    """
+    def __init__(self):
+        # Runs of performOperation, full walks, worklist regions walked,
+        # calls to actOn and seconds spent
+        self.runs = 0
+        self.walks = 0
+        self.regions = 0
+        self.nodes = 0
+        self.seconds = 0.0
+
+    def add(self, other):
+        self.runs += other.runs
+        self.walks += other.walks
+        self.regions += other.regions
+        self.nodes += other.nodes
+        self.seconds += other.seconds
+
+    def __repr__(self):
+        return 'Timings(runs=%d, walks=%d, regions=%d, nodes=%d, seconds=%.3f)' % (
+            self.runs, self.walks, self.regions, self.nodes, self.seconds)
+
+
+class Visitor(object):
+    """
+    Base for operations passed to performOperation. actOn is called on the
+    node performOperation was called on, then on each node of
+    getattr(node, listType)(); raising Break ends the walk.
+
+    A visitor that edits the tree passes each node whose subtree needs
+    another look to changed(), and only those subtrees are walked again.
+    Setting moreChanges instead walks the whole tree again.
+
+    A readOnly visitor can be fanned out over a corpus' files in worker
+    processes (see Corpus.performOperation). Each file is visited by its
+    own copy of the visitor; result() gives the copy's result, and reduce()
+    merges the results of every file
+    """
+    listType = 'depthList'
+    moreChanges = False
+    readOnly = False
+
+    def __init__(self):
+        self.worklist = []
+        self.timings = Timings()
+
+    def newStructure(self):
+        pass
+
+    def actOn(self, node):
+        raise NotImplementedError
+
+    def changed(self, node):
+        """
+        Queue node's subtree to be walked again
+        """
+        self.worklist.append(node)
+
+    def result(self):
+        return None
+
+    def reduce(self, results):
+        return results
+
+
+def perform(operation, top, nodes=None, rewalk=True):
+    """
+    Run operation over top: actOn(top), then actOn each node from nodes(),
+    which defaults to top's listType method. Then walk the subtrees queued
+    on the worklist, or walk everything again while moreChanges is set,
+    until neither asks for more. Without rewalk, asking for more raises
+    ValueError
+    """
+    timings = getattr(operation, 'timings', None)
+    if timings is None:
+        # Visitors that don't derive from Visitor still get counters
+        timings = operation.timings = Timings()
+    if nodes is None:
+        nodes = getattr(top, operation.listType)
+    worklist = getattr(operation, 'worklist', None)
+    start = time.time()
+    try:
+        operation.newStructure()
+        timings.nodes += _walk(operation, top, nodes())
+        timings.walks += 1
+        if not rewalk and (worklist or operation.moreChanges):
+            if worklist:
+                del worklist[:]
+            raise ValueError("%s can only be walked once, but the visitor asked for "
+                             "more changes" % top.label)
+        while True:
+            if worklist:
+                regions = list(worklist)
+                del worklist[:]
+                seen = set()
+                for region in regions:
+                    if region in seen or not _attached(region, top):
+                        continue
+                    regionNodes = getattr(region, operation.listType)()
+                    timings.nodes += _walk(operation, region, regionNodes, seen)
+                    timings.regions += 1
+            elif operation.moreChanges:
+                timings.nodes += _walk(operation, top, nodes())
+                timings.walks += 1
+            else:
+                break
+    finally:
+        timings.runs += 1
+        timings.seconds += time.time() - start
+
+
+def _walk(operation, top, nodes, seen=None):
+    """
+    Call actOn for top and nodes. Returns the number of calls
+    """
+    calls = 1
+    try:
+        operation.actOn(top)
+        if seen is not None:
+            seen.add(top)
+        for node in nodes:
+            calls += 1
+            operation.actOn(node)
+            if seen is not None:
+                seen.add(node)
+    # Give operations the opportunity to signal
+    # when the work is complete
+    except Break:
+        pass
+    return calls
+
+
+def _attached(node, top):
+    """
+    Whether node is still in the tree below top. The direct children of
+    Files have no parent link
+    """
+    while node is not top:
+        parent = _parentOf(node)
+        if parent is None:
+            return node in top._children
+        node = parent
+    return True
+
+
+class _FileOperation(object):
+    """
+    Visit one file with a fresh copy of a read-only visitor, for
+    Corpus.map. Returns the copy's result and timings
+    """
+    def __init__(self, operation):
+        self.operation = operation
+
+    def __call__(self, file_):
+        operation = copy.deepcopy(self.operation)
+        operation.timings = Timings()
+        file_.performOperation(operation)
+        return operation.result(), operation.timings
@@ -1,6 +1,16 @@
 from _Corpus import Corpus
+from _Corpus import FileError
 from _File import File
 from _Sentence import Sentence
 from _Node import Node
 from _Leaf import Leaf
 from _PropbankPrinter import PropbankPrinter
+from _TreeIndex import TreeIndex
+from _FileCache import FileCache
+from _SentenceIndex import SentenceIndex
+from _SentenceIndex import IndexEntry
+from _Visitor import Visitor
+from _Visitor import Break
+from _Visitor import Timings
+from _Manifest import Manifest
+from _Manifest import ManifestEntry
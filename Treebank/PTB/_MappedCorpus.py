@@ -0,0 +1,274 @@
+import array
+import mmap
+import os
+import struct
+import sys
+
+from Treebank.Nodes import Corpus
+from Treebank.Nodes import File
+from _PTBNode import PTBNode
+from _SentenceStore import SentenceStore, FrozenSentence, LazyTextStore, StringTable, strings
+
+MAGIC = 'TBCOLS01'
+
+# Columns of the file, in order, with their array typecodes. Node columns
+# hold one entry per node of every sentence, word columns one per word;
+# the values are relative to their sentence, as in a SentenceStore
+NODE_COLUMNS = (('labels', 'i'), ('functions', 'i'), ('identifiers', 'i'),
+                ('identified', 'i'), ('flags', 'B'), ('parents', 'i'), ('firstChild', 'i'),
+                ('nextSibling', 'i'), ('ends', 'i'), ('firstWord', 'i'), ('lastWord', 'i'),
+                ('texts', 'i'), ('startTimes', 'd'), ('endTimes', 'd'))
+WORD_COLUMNS = (('words', 'i'), ('wordIDs', 'i'))
+# Sentence columns. The node and word starts have one extra entry, the
+# end of the last sentence
+SENTENCE_COLUMNS = (('nodeStarts', 'i'), ('wordStarts', 'i'), ('globalIDs', 'i'),
+                    ('localIDs', 'i'), ('speakers', 'i'), ('turnIDs', 'i'))
+FILE_COLUMNS = (('sentenceStarts', 'i'), ('fileKeys', 'i'), ('fileNames', 'i'))
+STRING_COLUMNS = (('stringStarts', 'i'), ('stringData', 'c'))
+COLUMNS = NODE_COLUMNS + WORD_COLUMNS + SENTENCE_COLUMNS + FILE_COLUMNS + STRING_COLUMNS
+# Columns holding string ids, which are remapped to this process's table
+STRING_IDS = ('labels', 'functions', 'identifiers', 'identified', 'texts', 'globalIDs',
+              'speakers', 'turnIDs', 'fileKeys', 'fileNames')
+
+# After the magic, the header gives each column's offset and length
+_header = struct.Struct('=' + 'QQ' * len(COLUMNS))
+
+
+class Column(object):
+    """
+    Read-only sequence view of values packed in a buffer, such as an mmap.
+    Values are unpacked on access, so nothing is copied up front
+    """
+    __slots__ = ('_buffer', '_offset', '_length', '_unpack', '_size')
+
+    def __init__(self, buffer_, offset, length, typecode):
+        format_ = struct.Struct('=' + typecode)
+        self._buffer = buffer_
+        self._offset = offset
+        self._length = length
+        self._unpack = format_.unpack_from
+        self._size = format_.size
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        return self._unpack(self._buffer, self._offset + index * self._size)[0]
+
+    def __iter__(self):
+        unpack = self._unpack
+        buffer_ = self._buffer
+        for offset in xrange(self._offset, self._offset + self._length * self._size,
+                             self._size):
+            yield unpack(buffer_, offset)[0]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def tostring(self):
+        return self._buffer[self._offset:self._offset + self._length * self._size]
+
+    def view(self, start, end):
+        """
+        A Column over values [start, end) of this one
+        """
+        column = Column.__new__(Column)
+        column._buffer = self._buffer
+        column._offset = self._offset + start * self._size
+        column._length = end - start
+        column._unpack = self._unpack
+        column._size = self._size
+        return column
+
+
+class StringIdColumn(Column):
+    """
+    A Column of string ids from a file's table, read as ids in the
+    process-wide table
+    """
+    __slots__ = ('_remap',)
+
+    def __init__(self, column, remap):
+        for name in Column.__slots__:
+            setattr(self, name, getattr(column, name))
+        self._remap = remap
+
+    def __getitem__(self, index):
+        return self._remap[Column.__getitem__(self, index)]
+
+    def __iter__(self):
+        remap = self._remap
+        for id_ in Column.__iter__(self):
+            yield remap[id_]
+
+    def tostring(self):
+        return array.array('i', list(self)).tostring()
+
+    def view(self, start, end):
+        return StringIdColumn(Column.view(self, start, end), self._remap)
+
+
+class MappedStore(SentenceStore):
+    """
+    A SentenceStore whose arrays are Column views into a mapped file
+    """
+    def __init__(self, columns, nodeStart, nodeEnd, wordStart, wordEnd):
+        for name, typecode in NODE_COLUMNS:
+            setattr(self, name, columns[name].view(nodeStart, nodeEnd))
+        for name, typecode in WORD_COLUMNS:
+            setattr(self, name, columns[name].view(wordStart, wordEnd))
+
+    def nbytes(self):
+        # The data lives in the shared mapping
+        return sys.getsizeof(self) + sys.getsizeof(self.__dict__)
+
+    def copy(self):
+        """
+        A SentenceStore with the same values, in ordinary arrays
+        """
+        store = SentenceStore()
+        for name, typecode in NODE_COLUMNS + WORD_COLUMNS:
+            getattr(store, name).extend(getattr(self, name))
+        return store
+
+    def __reduce__(self):
+        # Unpickles as an ordinary SentenceStore
+        return (SentenceStore, (), self.copy().__getstate__())
+
+
+class MappedFile(File, PTBNode):
+    """
+    A file of a MappedCorpus. Its sentences are FrozenSentences over views
+    of the corpus' columns
+    """
+    def __init__(self, corpus, fileIndex):
+        columns = corpus._columns
+        name = strings.string(columns['fileNames'][fileIndex])
+        self.path = strings.string(columns['fileKeys'][fileIndex])
+        self.filename = name
+        self.ID = name
+        self.frozen = True
+        self._IDDict = {}
+        PTBNode.__init__(self, label='File')
+        string = strings.string
+        nodeStarts = columns['nodeStarts']
+        wordStarts = columns['wordStarts']
+        for i in xrange(columns['sentenceStarts'][fileIndex],
+                        columns['sentenceStarts'][fileIndex + 1]):
+            store = MappedStore(columns, nodeStarts[i], nodeStarts[i + 1], wordStarts[i],
+                                wordStarts[i + 1])
+            self.attachChild(FrozenSentence(store, globalID=string(columns['globalIDs'][i]),
+                                            localID=columns['localIDs'][i],
+                                            speaker=string(columns['speakers'][i]),
+                                            turnID=string(columns['turnIDs'][i])))
+
+
+class MappedCorpus(PTBNode, Corpus):
+    """
+    A corpus read from one columnar file, written by MappedCorpus.write.
+    The file is memory-mapped, so processes reading the same file share
+    its pages, and opening it parses nothing. Sentences are read-only
+    FrozenSentences
+    """
+    def __init__(self, path, dispose=False, cacheBytes=0, **kwargs):
+        self.path = path
+        self.disposeFiles = dispose
+        self.cacheBytes = cacheBytes
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a columnar corpus file" % path)
+        spans = _header.unpack_from(self._map, len(MAGIC))
+        columns = {}
+        for i, (name, typecode) in enumerate(COLUMNS):
+            columns[name] = Column(self._map, spans[2 * i], spans[2 * i + 1], typecode)
+        # Bring the file's strings into the process-wide table. The extra
+        # entry at the end maps -1 to itself
+        starts = columns['stringStarts']
+        remap = [strings.id(self._map[spans[-2] + starts[i]:spans[-2] + starts[i + 1]])
+                 for i in xrange(len(starts) - 1)]
+        remap.append(-1)
+        for name in STRING_IDS:
+            columns[name] = StringIdColumn(columns[name], remap)
+        self._columns = columns
+        self._byKey = {}
+        PTBNode.__init__(self, label='Corpus', **kwargs)
+        for i, key in enumerate(columns['fileKeys']):
+            key = strings.string(key)
+            self._byKey[key] = i
+            self.attachChild(key)
+
+    def _loadFile(self, key):
+        return MappedFile(self, self._byKey[key])
+
+    @staticmethod
+    def write(corpus, path):
+        """
+        Write every sentence of a corpus to a columnar file at path
+        """
+        table = StringTable()
+        data = dict((name, array.array(typecode)) for name, typecode in COLUMNS)
+        # Process string ids -> ids in the file's table
+        local = {-1: -1}
+        def localID(id_):
+            try:
+                return local[id_]
+            except KeyError:
+                local[id_] = table.id(strings.string(id_))
+                return local[id_]
+        for key in corpus._children:
+            # Read around the file cache, so each file can be disposed of
+            file_ = corpus._loadFile(key)
+            data['sentenceStarts'].append(len(data['globalIDs']))
+            data['fileKeys'].append(table.id(key))
+            data['fileNames'].append(table.id(file_.filename))
+            for sentence in file_.children():
+                sentence = sentence.freeze()
+                store = sentence._store
+                if isinstance(store, LazyTextStore):
+                    store = store.copy()
+                occurrence = sentence._occurrence
+                data['nodeStarts'].append(len(data['labels']))
+                data['wordStarts'].append(len(data['words']))
+                data['globalIDs'].append(table.id(sentence.globalID))
+                data['localIDs'].append(sentence.localID)
+                data['speakers'].append(table.id(sentence.speaker))
+                data['turnIDs'].append(table.id(sentence.turnID))
+                for name, typecode in NODE_COLUMNS + WORD_COLUMNS:
+                    if name in SentenceStore.occurrence:
+                        values = getattr(occurrence, name)
+                    else:
+                        values = getattr(store, name)
+                    if name in STRING_IDS:
+                        values = [localID(id_) for id_ in values]
+                    data[name].extend(values)
+            file_.dispose()
+        data['nodeStarts'].append(len(data['labels']))
+        data['wordStarts'].append(len(data['words']))
+        data['sentenceStarts'].append(len(data['globalIDs']))
+        for i in xrange(len(table)):
+            data['stringStarts'].append(len(data['stringData']))
+            data['stringData'].fromstring(table.string(i))
+        data['stringStarts'].append(len(data['stringData']))
+        # Columns are laid out after the header, each aligned to 8 bytes
+        spans = []
+        offset = len(MAGIC) + _header.size
+        for name, typecode in COLUMNS:
+            offset += -offset % 8
+            spans.extend((offset, len(data[name])))
+            offset += len(data[name]) * data[name].itemsize
+        out = open(path + '.tmp', 'wb')
+        out.write(MAGIC)
+        out.write(_header.pack(*spans))
+        for i, (name, typecode) in enumerate(COLUMNS):
+            out.write('\0' * (spans[2 * i] - out.tell()))
+            data[name].tofile(out)
+        out.close()
+        os.rename(path + '.tmp', path)
@@ -1,22 +1,42 @@
 from Treebank.Nodes import File
+from Treebank.Nodes._Node import _bump
 from _PTBNode import PTBNode
 from _PTBSentence import PTBSentence
-from _PTBLeaf import PTBLeaf
+from _SentenceStore import SentenceStore, FrozenSentence, LazyTextStore
+from _TerminalTable import TerminalTable
 
+import cStringIO
+import mmap
+import os
 import os.path
+import re
+from multiprocessing.pool import ThreadPool
 from xml.etree import cElementTree as etree
 
 
 class PTBFile(File, PTBNode):
     """
-    A Penn Treebank file
+    A Penn Treebank file. If frozen is set, sentences are built as
+    read-only FrozenSentence objects. If shared is set, they are also
+    hash-consed, so that identical sentences share one store. If lazyText
+    is set, sentences are frozen and their words' text is left in a
+    read-only mapping of the file until it is read (see LazyTextStore).
+    If a ParseCache is given, the parse is loaded from it when it is
+    current
     """
     def __init__(self, **kwargs):
         path = kwargs.pop('path')
+        self.shared = kwargs.pop('shared', False)
+        self.lazyText = kwargs.pop('lazyText', False)
+        if self.shared and self.lazyText:
+            raise ValueError("Shared sentences can't keep their text in the file")
+        self.frozen = kwargs.pop('frozen', False) or self.shared or self.lazyText
+        parseCache = kwargs.pop('parseCache', None)
         if 'string' in kwargs:
             text = kwargs.pop('string')
+            parseCache = None
         else:
-            text = open(path).read()
+            text = None
         # Sometimes sentences start (( instead of ( (. This is an error, correct it
         filename = path.split('/')[-1]
         self.path = path
@@ -27,83 +47,264 @@ class PTBFile(File, PTBNode):
         if self.filename.endswith('xml'):
             root_dir = os.path.dirname(os.path.dirname(path))
             self._parseNXT(root_dir, filename.split('.')[0])
+            return
+        cached = None
+        if parseCache is not None:
+            cached = parseCache.load([path], frozen=self.frozen, shared=self.shared)
+        if cached is not None:
+            for sentence in cached:
+                self.attachChild(sentence)
+            return
+        if text is None and self.lazyText:
+            self._parseMapped(path)
+        elif text is None:
+            stream = open(path)
+            try:
+                for offset, sentText in readSentences(stream):
+                    self._addSentence(sentText)
+            finally:
+                stream.close()
         else:
             self._parseFile(text)
+        if parseCache is not None:
+            parseCache.save([path], self._children)
 
     def _parseFile(self, text):
-        currentSentence = []
-        for line in text.strip().split('\n'):
-            # Detect the start of sentences by line starting with (
-            # This is messy, but it keeps bracket parsing at the sentence level
-            if line.startswith('(') and currentSentence:
-                self._addSentence(currentSentence)
-                currentSentence = []
-            currentSentence.append(line)
-        self._addSentence(currentSentence)
-
-    def _addSentence(self, lines):
-        sentStr = '\n'.join(lines)[1:-1]
+        for start, end in sentenceSpans(text):
+            self._addSentence(text[start:end])
+
+    def _parseMapped(self, path):
+        source = open(path, 'rb')
+        try:
+            if not os.fstat(source.fileno()).st_size:
+                return
+            mapping = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            source.close()
+        for start, end in sentenceSpans(mapping):
+            sentID = '%s~%s' % (self.filename, str(len(self) + 1).zfill(4))
+            # Inside the outer brackets, as in buildSentence
+            store = LazyTextStore.fromBuffer(mapping, start + 1, end - 1)
+            self.attachChild(FrozenSentence(store, globalID=sentID, localID=self.length()))
+
+    def _addSentence(self, text):
         nSents = len(self)+1
         sentID = '%s~%s' % (self.filename, str(nSents).zfill(4))
-        self.attachChild(PTBSentence(string=sentStr, globalID=sentID, localID=self.length()))
+        self.attachChild(buildSentence(text, sentID, self.length(), frozen=self.frozen,
+                                       shared=self.shared))
+
+
+def sentenceSpans(text):
+    """
+    Generate the (start, end) offsets of each sentence's bracketing in the
+    text of a .mrg file
+    """
+    return _bracketings([text], spans=True)
+
+
+def readSentences(stream, chunkSize=1 << 16):
+    """
+    Generate (offset, text) for each sentence's bracketing in a stream of
+    .mrg text, such as an open file or several files concatenated. The
+    stream is read a chunk at a time, so only one sentence is held
+    """
+    return _bracketings(iter(lambda: stream.read(chunkSize), ''))
+
+
+def iterSentences(stream, filename='-', frozen=False, shared=False):
+    """
+    Generate the sentences of a stream of .mrg text as they are read. IDs
+    are numbered from the start of the stream, as in a file called filename
+    """
+    for i, (offset, text) in enumerate(readSentences(stream)):
+        yield buildSentence(text, '%s~%s' % (filename, str(i + 1).zfill(4)), i,
+                            frozen=frozen, shared=shared)
+
+
+_bracketRE = re.compile(r'[()\n]')
+
+
+def _bracketings(chunks, spans=False):
+    """
+    Generate (offset, text) for each top-level bracketing in a sequence of
+    chunks of text, tracking bracket depth. A sentence is an open bracket
+    at depth 0 that starts a line, or follows another sentence, through
+    its matching close. Anything else between sentences, such as the *x*
+    header of the Switchboard files, is skipped. If spans is set, (start,
+    end) offsets are generated instead, and no text is copied. A sentence
+    still open at the end of the text raises ValueError
+    """
+    depth = 0
+    # Whether only whitespace has been seen at depth 0 since the last line
+    # or sentence ended
+    clear = True
+    pieces = []
+    start = 0
+    base = 0
+    for chunk in chunks:
+        # Offset in chunk of the current sentence's text, if one is open
+        pieceStart = 0 if depth else None
+        last = 0
+        for match in _bracketRE.finditer(chunk):
+            char = match.group()
+            pos = match.start()
+            if depth:
+                if char == '(':
+                    depth += 1
+                elif char == ')':
+                    depth -= 1
+                    if not depth:
+                        if spans:
+                            yield start, base + pos + 1
+                        else:
+                            pieces.append(chunk[pieceStart:pos + 1])
+                            yield start, ''.join(pieces)
+                            pieces = []
+                        pieceStart = None
+                        clear = True
+                last = pos + 1
+                continue
+            if chunk[last:pos].strip():
+                clear = False
+            last = pos + 1
+            if char == '\n':
+                clear = True
+            elif char == '(' and clear:
+                depth = 1
+                start = base + pos
+                pieceStart = pos
+        if depth and not spans:
+            pieces.append(chunk[pieceStart:])
+        elif chunk[last:].strip():
+            clear = False
+        base += len(chunk)
+    if depth:
+        raise ValueError("Unterminated sentence at offset %d: %d bracket(s) still open at "
+                         "the end of the text" % (start, depth))
+
+
+def buildSentence(text, globalID, localID, frozen=False, shared=False):
+    """
+    Build a sentence from its bracketing, including the outer brackets
+    """
+    sentStr = text[1:-1]
+    if shared:
+        return FrozenSentence.shared(SentenceStore.fromString(sentStr),
+                                     globalID=globalID, localID=localID)
+    elif frozen:
+        return FrozenSentence(SentenceStore.fromString(sentStr), globalID=globalID,
+                              localID=localID)
+    return PTBSentence(string=sentStr, globalID=globalID, localID=localID)
 
 
 class NXTFile(File, PTBNode):
     def __init__(self, **kwargs):
         self.path = kwargs.pop('path')
         self.filename = kwargs.pop('filename')
+        self.shared = kwargs.pop('shared', False)
+        self.frozen = kwargs.pop('frozen', False) or self.shared
+        self.verifyOrder = kwargs.pop('verifyOrder', False)
+        fetchThreads = kwargs.pop('fetchThreads', 0)
+        parsePool = kwargs.pop('parsePool', None)
+        parseCache = kwargs.pop('parseCache', None)
         self.ID = self.filename
         self._IDDict = {}
         PTBNode.__init__(self, label='File', **kwargs)
         self.xml_idx = {}
-        self._parseNXT(self.path, self.filename)
-        self._addTurns(self.path, self.filename)
+        sources = NXTFile.sourcePaths(self.path, self.filename)
+        cached = None
+        if parseCache is not None:
+            cached = parseCache.load(sources, frozen=self.frozen, shared=self.shared)
+        if cached is not None:
+            for sentence in cached:
+                self.attachChild(sentence)
+            return
+        openSource = self._fetch(sources, fetchThreads, parsePool)
+        self._parseNXT(self.path, self.filename, openSource, parsePool)
+        self._addTurns(self.path, self.filename, openSource)
+        if parseCache is not None:
+            parseCache.save(sources, self._children)
 
-    def _parseNXT(self, nxt_root_dir, file_id):
-        terminals = {}
-        ns = '{http://nite.sourceforge.net/}'
+    @staticmethod
+    def sourcePaths(path, filename):
+        """
+        The XML files that a conversation is read from
+        """
+        return [os.path.join(path, 'xml', kind, '%s.%s.%s.xml' % (filename, speaker, kind))
+                for kind in ('terminals', 'syntax', 'turns') for speaker in 'AB']
+
+    def _release(self):
+        self.xml_idx = {}
+        return File._release(self)
+
+    def _fetch(self, sources, fetchThreads, parsePool):
+        """
+        With fetchThreads, start reading the conversation's files on a
+        thread pool, so that their round trips to storage overlap. Returns
+        a function that opens a file, waiting for its read if one was
+        started. Terminals files are left to the parsePool where there is
+        one
+        """
+        if not fetchThreads:
+            return open
+        if parsePool is not None:
+            sources = [path for path in sources if not path.endswith('.terminals.xml')]
+        pool = ThreadPool(min(fetchThreads, len(sources)))
+        pending = dict((path, pool.apply_async(_readSource, (path,))) for path in sources)
+        pool.close()
+        def openSource(path):
+            result = pending.pop(path, None)
+            if result is None:
+                return open(path)
+            return cStringIO.StringIO(result.get())
+        return openSource
+
+    def _readTerminals(self, nxt_root_dir, file_id, openSource, parsePool):
+        """
+        Both speakers' terminals, in one table. With a parsePool, the two
+        files are read and parsed in its processes at once
+        """
+        if parsePool is None:
+            return TerminalTable.read(nxt_root_dir, file_id, openSource)
+        pending = [parsePool.apply_async(_parseTerminals, (
+            os.path.join(nxt_root_dir, 'xml', 'terminals',
+                         '%s.%s.terminals.xml' % (file_id, speaker)), speaker))
+            for speaker in 'AB']
+        terminals = pending[0].get()
+        terminals.extend(pending[1].get())
+        return terminals
+
+    def _parseNXT(self, nxt_root_dir, file_id, openSource=open, parsePool=None):
+        # Sentences are ordered by their first word ID, as sortChildren
+        # would, from keys taken as each is built
+        keys = []
+        # Trees are only built once both speakers' terminals are in
+        terminals = self._readTerminals(nxt_root_dir, file_id, openSource, parsePool)
         for speaker in ['A', 'B']:
-            # Get terminals
-            terminals_loc = os.path.join(nxt_root_dir, 'xml', 'terminals',
-                                        '%s.%s.terminals.xml' % (file_id, speaker))
-            leaves_tree = etree.parse(open(terminals_loc))
-            for w_xml in leaves_tree.iter('word'):
-                wordID = int(w_xml.get(ns+'id').split('_')[1]) - 1
-                w_node = PTBLeaf(label=w_xml.get('pos'), start_time=w_xml.get(ns+'start'),
-                                 end_time=w_xml.get(ns+'end'), text=w_xml.get('orth'),
-                                 wordID=wordID)
-                terminals[w_xml.get(ns+'id')] = w_node
-            for p_xml in leaves_tree.iter('punc'):
-                wordID = int(p_xml.get(ns+'id').split('_')[1]) - 1
-                terminals[p_xml.get(ns+'id')] = PTBLeaf(label=p_xml.text,
-                                                     text=p_xml.text,
-                                                     wordID=wordID)
-            for t_xml in leaves_tree.iter('trace'):
-                wordID = int(t_xml.get(ns+'id').split('_')[1]) - 1
-                terminals[t_xml.get(ns+'id')] = PTBLeaf(label='-NONE-', text='-NONE-',
-                                                     wordID=wordID)
-            for s_xml in leaves_tree.iter('sil'):
-                wordID = int(s_xml.get(ns+'id').split('_')[1]) - 1
-                terminals[s_xml.get(ns+'id')] = PTBLeaf(label='-NONE-', text='-SIL-',
-                                                        wordID=wordID)
-                
             syntax_loc = os.path.join(nxt_root_dir, 'xml', 'syntax',
                                       '%s.%s.syntax.xml' % (file_id, speaker))
-            syntax_tree = etree.parse(open(syntax_loc))
-            for s_xml in syntax_tree.iter('parse'):
-                localID = int(s_xml.get(ns+'id')[1:])
-                globalID = '%s~%s' % (file_id, str(localID).zfill(4))
-                ptb_sent = PTBSentence(xml_node=s_xml, terminals=terminals,
-                                       globalID=globalID, localID=localID)
-                self.xml_idx[(speaker, localID)] = ptb_sent
+            for ptb_sent in nxtSentences(openSource(syntax_loc), file_id, terminals,
+                                         verifyOrder=self.verifyOrder):
+                firstWord = next(ptb_sent.leaves(), None)
+                keys.append(firstWord.wordID if firstWord is not None else 0)
+                if self.frozen:
+                    ptb_sent = ptb_sent.freeze(shared=self.shared)
+                self.xml_idx[(speaker, ptb_sent.localID)] = ptb_sent
                 self.attachChild(ptb_sent)
-        self.sortChildren()
+        if self.verifyOrder:
+            expected = [sentence.getWordID(0) for sentence in self._children]
+            if keys != expected:
+                raise ValueError("%s: sentence keys %s differ from the old build's %s"
+                                 % (file_id, keys, expected))
+        order = sorted(xrange(len(keys)), key=keys.__getitem__)
+        self._children = [self._children[i] for i in order]
+        _bump(self)
 
-    def _addTurns(self, path, filename):
+    def _addTurns(self, path, filename, openSource=open):
         ns = '{http://nite.sourceforge.net/}'
         for speaker in ['A', 'B']:
             turns_loc = os.path.join(path, 'xml', 'turns', '%s.%s.turns.xml' % (filename, speaker))
-            turns_tree = etree.parse(open(turns_loc))
+            turns_tree = etree.parse(openSource(turns_loc))
             for turn_xml in turns_tree.iter('turn'):
                 child = turn_xml.getchildren()[0]
                 sent_ids = child.get('href').split('#')[1]
@@ -118,3 +319,35 @@ class NXTFile(File, PTBNode):
                 for sent_idx in range(first_id, last_id):
                     sent = self.xml_idx[(speaker, sent_idx)]
                     self.xml_idx[(speaker, sent_idx)].addTurn(speaker, turnID)
+
+
+_ns = '{http://nite.sourceforge.net/}'
+
+
+def _readSource(path):
+    with open(path, 'rb') as file_:
+        return file_.read()
+
+
+def _parseTerminals(path, speaker):
+    terminals = TerminalTable()
+    terminals.readFile(path, speaker)
+    return terminals
+
+
+def nxtSentences(path, file_id, terminals, verifyOrder=False):
+    """
+    Generate the sentences of an NXT syntax file, with their terminals from
+    a TerminalTable, each as soon as its parse element closes. The element
+    is cleared once the sentence is taken. verifyOrder checks each tree's
+    order against the old build's
+    """
+    idKey = _ns + 'id'
+    for event, elem in etree.iterparse(path):
+        if elem.tag != 'parse':
+            continue
+        localID = int(elem.get(idKey)[1:])
+        globalID = '%s~%s' % (file_id, str(localID).zfill(4))
+        yield PTBSentence(xml_node=elem, terminals=terminals, globalID=globalID,
+                          localID=localID, verifyOrder=verifyOrder)
+        elem.clear()
@@ -1,27 +1,56 @@
 from Treebank.Nodes import Leaf
 from _PTBNode import PTBNode
 
+# Process-wide table of normalised POS tags, keyed by the raw tag
+_normalisedTags = {}
+
+
 class PTBLeaf(Leaf, PTBNode):
+    __slots__ = ('wordID', 'text', 'synsets', 'supersenses', 'lemma')
+
+    @staticmethod
+    def normaliseTag(tag):
+        """
+        Take the first tag from a ^-separated set, e.g. ^NN^VB -> NN
+        """
+        try:
+            return _normalisedTags[tag]
+        except KeyError:
+            normalised = tag[1:] if tag.startswith('^') else tag
+            normalised = intern(normalised.split('^')[0])
+            _normalisedTags[intern(tag)] = normalised
+            return normalised
+
+    # Traces that are coindexed with the node they stand for, as in *T*-1
+    traceTypes = ('*ICH*', '*T*', '*EXP*')
+
+    @staticmethod
+    def traceIndex(text):
+        """
+        The index that a trace leaf's text points to, e.g. *T*-1 -> 1, or
+        None if the text isn't a coindexed trace
+        """
+        if not text.startswith('*'):
+            return None
+        traceType, dash, index = text.partition('-')
+        if dash and traceType in PTBLeaf.traceTypes:
+            return intern(index.split('-')[0])
+        return None
+
     def __init__(self, **kwargs):
         self.wordID = kwargs.pop('wordID')
         self.text = kwargs.pop('text')
-        if self.text.startswith('*ICH*'):
-            kwargs['identified'] = self.text.split('-')[1]
+        identified = PTBLeaf.traceIndex(self.text)
+        if identified is not None:
+            kwargs['identified'] = identified
         self.synsets = []
         self.supersenses = []
         self.lemma = self.text
-        if kwargs['label'].startswith('^'):
-            kwargs['label'] = kwargs['label'][1:]
-        kwargs['label'] = kwargs['label'].split('^')[0]
+        kwargs['label'] = PTBLeaf.normaliseTag(kwargs['label'])
         PTBNode.__init__(self, **kwargs)
 
     def isEdited(self):
-        node = self.parent()
-        while not node.isRoot():
-            if node.label == 'EDITED':
-                return True
-            node = node.parent()
-        return False
+        return self.isUnder('EDITED')
 
     def isPartial(self):
         if not self.isPunct() and self.text.endswith('-') or self.label == 'XX':
@@ -4,11 +4,44 @@ import bisect
 from Treebank.Nodes import Node
 
 
+# Process-wide table of parsed bracket labels, keyed by the raw label string
+_parsedLabels = {}
+
+
+def _intern(string):
+    if string is None:
+        return None
+    return intern(string)
+
+
 class PTBNode(Node):
     """
     A node in a parse tree
     """
+    __slots__ = ('start_time', 'end_time', 'functionLabel', 'identifier', 'identified',
+                 'unf', 'traced')
     _labelRE = re.compile(r'([^-=]+)(?:-([^-=\d]+))?(-UNF)?(?:-(\d+))?(?:=(\d+))?')
+
+    @staticmethod
+    def parseLabel(string):
+        """
+        Split a bracket label into (label, functionLabel, unf, identifier,
+        identified). Results are interned, so each distinct label is only
+        matched once per process
+        """
+        try:
+            return _parsedLabels[string]
+        except KeyError:
+            pass
+        label, functionLabel, unf, identifier, identified = PTBNode._labelRE.match(string).groups()
+        if functionLabel == 'UNF':
+            functionLabel = None
+            unf = True
+        parsed = (_intern(label), _intern(functionLabel), bool(unf), _intern(identifier),
+                  _intern(identified))
+        _parsedLabels[intern(string)] = parsed
+        return parsed
+
     def __init__(self, **kwargs):
         def parse_time(time_str):
             if time_str is None or time_str == 'n/a':
@@ -19,9 +52,8 @@ class PTBNode(Node):
                 return float(time_str)
 
         string = kwargs.pop('string', None)
-        if string is not None:        
-            pieces = PTBNode._labelRE.match(string).groups()
-            label, functionLabel, unf, identifier, identified = pieces
+        if string is not None:
+            label, functionLabel, unf, identifier, identified = PTBNode.parseLabel(string)
             start_time = None
             end_time = None
         else:
@@ -47,6 +79,10 @@ class PTBNode(Node):
         self.traced = None
         Node.__init__(self, label)
 
+    def _release(self):
+        self.traced = None
+        return Node._release(self)
+
     def duration(self):
         if self.start_time is None or self.end_time is None:
             return None
@@ -57,8 +93,9 @@ class PTBNode(Node):
     def gapAfter(self):
         if self.end_time < 0:
             return None
-        words = self.root().listWords()
-        idx = words.index(self.getWord(-1))
+        root = self.root()
+        words = root._words()
+        idx = root.wordPosition(self.getWord(-1))
         if idx == len(words) - 1:
             return None
         else:
@@ -1,8 +1,14 @@
+import operator
 import re
 
 from Treebank.Nodes import Sentence
 from _PTBNode import PTBNode
 from _PTBLeaf import PTBLeaf
+from _TraceTable import TraceTable
+
+# Sorts the children of an NXT node, by the lowest word ID below them
+_sortKey = operator.itemgetter(0)
+
 
 class PTBSentence(PTBNode, Sentence):
     """
@@ -10,96 +16,266 @@ class PTBSentence(PTBNode, Sentence):
     
     Has no parent, and one or more children
     """
+    __slots__ = ('speaker', 'turnID', 'localID', '_positions', '_positionsVersion',
+                 '_traces', '_tracesVersion')
+
+    # Default labels for wordFeatures. 'UNF' matches nodes with the -UNF
+    # flag rather than a UNF label
+    featureLabels = ('EDITED', 'PRN', 'INTJ', 'UNF')
+    # Leaf flag bits for wordFeatures
+    IS_TRACE = 1
+    IS_PUNCT = 2
+    IS_PARTIAL = 4
+
     def __init__(self, **kwargs):
+        # Filled in by _parseString, or built on first use
+        self._traces = None
+        self._tracesVersion = -1
         if 'string' in kwargs:
             node = self._parseString(kwargs.pop('string'))
         elif 'node' in kwargs:
             node = kwargs.pop('node')
         elif 'xml_node' in kwargs:
-            node = self._parseNXT(kwargs.pop('xml_node'), kwargs.pop('terminals'))
+            node = self._parseNXT(kwargs.pop('xml_node'), kwargs.pop('terminals'),
+                                  kwargs.pop('verifyOrder', False))
         globalID = kwargs.pop('globalID')
         localID = kwargs.pop('localID')
         self.speaker = None
         self.turnID = None
+        self._positions = None
+        self._positionsVersion = -1
         PTBNode.__init__(self, label='S', **kwargs)
         self.globalID = globalID
         self.localID = localID
         self.attachChild(node)
+        if self._traces is not None:
+            self._tracesVersion = self._edits
 
     bracketsRE = re.compile(r'(\()([^\s\)\(]+)|([^\s\)\(]+)?(\))')
     def _parseString(self, sent_text):
+        """
+        Build the tree in one pass over the brackets. Nodes are built as
+        their brackets close, so children come first, as they always have
+        """
+        # Stack of (raw label, children, pre-order position) per open bracket
         openBrackets = []
-        parentage = {}
-        nodes = {}
+        position = 0
         nWords = 0
-        
-        # Get the nodes and record their parents
+        top = None
+        # identifier -> (pre-order position, node), registered as each node
+        # is built. Where an identifier is repeated, the last in pre-order
+        # is the one traced to
+        identifiers = {}
+        # Traces and gapped nodes, resolved once the sentence is closed
+        tracing = []
         for match in self.bracketsRE.finditer(sent_text):
             open_, label, text, close = match.groups()
             if open_:
-                assert not close
-                assert label
-                openBrackets.append((label, match.start()))
+                if not openBrackets and top is not None:
+                    # Only the last top-level constituent is kept, so the
+                    # earlier ones neither trace nor are traced to
+                    identifiers = {}
+                    tracing = []
+                openBrackets.append((label, [], position))
+                position += 1
+                continue
+            label, children, start = openBrackets.pop()
+            if text:
+                newNode = PTBLeaf(label=label, text=text, wordID=nWords)
+                nWords += 1
+            else:
+                newNode = PTBNode(string=label)
+            for child in children:
+                newNode._children.append(child)
+                child.setParent(newNode)
+            if newNode.identifier:
+                known = identifiers.get(newNode.identifier)
+                if known is None or known[0] < start:
+                    identifiers[newNode.identifier] = (start, newNode)
+            if newNode.identified:
+                tracing.append(newNode)
+            if openBrackets:
+                openBrackets[-1][1].append(newNode)
             else:
-                assert close
-                label, start = openBrackets.pop()
-                if text:
-                    newNode = PTBLeaf(label=label, text=text, wordID=nWords)
-                    nWords += 1
-                else:
-                    newNode = PTBNode(string=label)
-                if openBrackets:
-                    # Store parent start position
-                    parentStart = openBrackets[-1][1]
-                    parentage[start] = parentStart
-                else:
-                    top = newNode
-                # Organise nodes by start
-                nodes[start] = newNode
-        try:
-            self._connectNodes(nodes, parentage)
-        except:
-            print sent_text
-            raise
-        by_identifier = dict((n.identifier, n) for n in top.depthList() if n.identifier)
-        for node in top.depthList():
-            if node.identified:
-                node.traced = by_identifier.get(node.identified)
+                top = newNode
+        # The top node is outside its own subtree, so it neither traces nor
+        # is traced to
+        if top.identifier and identifiers[top.identifier][1] is top:
+            del identifiers[top.identifier]
+        table = TraceTable()
+        for node in tracing:
+            if node is not top:
+                node.traced = identifiers.get(node.identified, (None, None))[1]
+                if node.traced is not None:
+                    table.add(node, node.traced)
+        self._traces = table
         return top
         
-    def _parseNXT(self, root, terminals):
-        nodes = {}
-        parentage = {}
+    def _parseNXT(self, root, terminals, verifyOrder=False):
+        """
+        Build the tree from an NXT parse element, with its terminals from a
+        TerminalTable. Children are attached in order of the lowest word ID
+        below them, as they are built, so the tree needs no sorting
+        afterwards. With verifyOrder, the order is checked against the one
+        the old sort-based build gave, and a ValueError is raised where
+        they differ
+        """
         ns = '{http://nite.sourceforge.net/}'
-        parse_id = root.get(ns+'id')
-        for xml_node in root.iter('nt'):
-            id_ = xml_node.get(ns+'id')
-            node = PTBNode(label=xml_node.get('cat'), start_time=xml_node.get(ns+'start'),
-                           end_time=xml_node.get(ns+'end'))
-            nodes[id_] = node
-            for child in xml_node.getchildren():
-                if child.tag != 'nt':
-                    continue
-                child_id = child.get(ns+'id')
-                parentage[child_id] = id_
-            for leaf_link in xml_node.getchildren():
-                if leaf_link.tag != ns+'child':
-                    continue
-                xml_id = leaf_link.get('href').split('id')[1][1:-1]
-                node = terminals.get(xml_id)
-                if node is not None and node.text != '-SIL-':
-                    nodes[xml_id] = node
-                    parentage[xml_id] = id_
-        self._connectNodes(nodes, parentage)
         for xml_node in root.getchildren():
             if xml_node.tag == 'nt':
-                top = nodes[xml_node.get(ns+'id')]
+                top = self._buildNXT(xml_node, terminals, ns, verifyOrder)[0]
                 break
-        top.sortChildren()
-        for node in top.depthList():
-            node.sortChildren()
         return top
 
+    def _buildNXT(self, xml_node, terminals, ns, verifyOrder):
+        """
+        Build the node for an nt element and its subtree. Returns the node,
+        the lowest word ID below it and, with verifyOrder, the word ID the
+        old build sorted it by: that of its first word with children in
+        nite:id order. Both are None for a node with no words
+        """
+        node = PTBNode(label=xml_node.get('cat'), start_time=xml_node.get(ns+'start'),
+                       end_time=xml_node.get(ns+'end'))
+        # (sort key, lowest word ID, old sort key, node, nite:id or table
+        # row). Nodes with no words sort as 0, as getWordID gives them
+        children = []
+        append = children.append
+        childTag = ns+'child'
+        for child in xml_node.getchildren():
+            tag = child.tag
+            if tag == 'nt':
+                childNode, low, first = self._buildNXT(child, terminals, ns, verifyOrder)
+                append((low or 0, low, first, childNode, child.get(ns+'id')))
+            elif tag == childTag:
+                row = terminals.row(child.get('href'))
+                if row is not None and not terminals.isSilence(row):
+                    wordID = terminals.wordIDs[row]
+                    append((wordID, wordID, wordID, terminals.leaf(row), row))
+        def xmlID(child):
+            if isinstance(child[4], int):
+                return terminals.xmlID(child[4])
+            return child[4]
+        if len(children) > 1:
+            children.sort(key=_sortKey)
+            if len(set(map(_sortKey, children))) < len(children):
+                # Ties fall back to nite:id order, as the old build
+                # attached by id
+                children.sort(key=lambda child: (child[0], xmlID(child)))
+        low = None
+        for child in children:
+            node._children.append(child[3])
+            child[3].setParent(node)
+            if low is None:
+                low = child[1]
+        first = None
+        if verifyOrder:
+            byID = sorted(children, key=xmlID)
+            for child in byID:
+                if child[2] is not None:
+                    first = child[2]
+                    break
+            expected = sorted(byID, key=lambda child: child[2] or 0)
+            if [child[3] for child in expected] != node._children:
+                raise ValueError("Children of %s are in a different order from the old build: "
+                                 "%s, not %s" % (xml_node.get(ns+'id'),
+                                                 [xmlID(child) for child in children],
+                                                 [xmlID(child) for child in expected]))
+        return node, low, first
+
     def addTurn(self, speaker, turnID):
         self.speaker = speaker
         self.turnID = turnID
+
+    def wordFeatures(self, labels=None):
+        """
+        Per-word features, in listWords order, from a single walk of the
+        tree. Each word gets a (labelMask, depth, leafFlags) tuple: bit i
+        of labelMask is set if some ancestor has labels[i], depth counts
+        the word's ancestors, and leafFlags combines IS_TRACE, IS_PUNCT
+        and IS_PARTIAL
+        """
+        if labels is None:
+            labels = self.featureLabels
+        bits = dict((label, 1 << i) for i, label in enumerate(labels))
+        unfBit = bits.get('UNF', 0)
+        features = []
+        # Stack of (node, mask of the node's ancestors, depth)
+        stack = [(self, 0, 0)]
+        while stack:
+            node, mask, depth = stack.pop()
+            if node.isLeaf():
+                flags = 0
+                if node.isTrace():
+                    flags |= PTBSentence.IS_TRACE
+                if node.isPunct():
+                    flags |= PTBSentence.IS_PUNCT
+                if node.isPartial():
+                    flags |= PTBSentence.IS_PARTIAL
+                features.append((mask, depth, flags))
+                continue
+            mask |= bits.get(node.label, 0)
+            if node.unf:
+                mask |= unfBit
+            for child in reversed(node._children):
+                stack.append((child, mask, depth + 1))
+        return features
+
+    def traces(self):
+        """
+        The sentence's TraceTable. A parsed sentence gets the table built
+        while it was parsed; otherwise, or after the tree is edited, it is
+        built from the nodes' traced links
+        """
+        if self._tracesVersion != self._edits:
+            self._traces = TraceTable.fromTree(self)
+            self._tracesVersion = self._edits
+        return self._traces
+
+    def wordPosition(self, word):
+        """
+        Index of a word in the yield. Positions are kept in a table that is
+        rebuilt after structural edits, so lookups are O(1)
+        """
+        if self._positionsVersion != self._edits:
+            self._positions = dict((id(w), i) for i, w in enumerate(self._words()))
+            self._positionsVersion = self._edits
+        return self._positions[id(word)]
+
+    def gaps(self):
+        """
+        The gap between each word and the next, as given by gapAfter
+        """
+        words = self._words()
+        gaps = []
+        for i, word in enumerate(words):
+            if i + 1 == len(words) or not _aligned(word.end_time):
+                gaps.append(None)
+            elif not _aligned(words[i + 1].start_time):
+                gaps.append(None)
+            else:
+                gaps.append(words[i + 1].start_time - word.end_time)
+        return gaps
+
+    def pauses(self):
+        """
+        Like gaps, but a gap next to an unaligned word counts as no pause
+        (0.0), as in bin/add_swbd_timings.py. The last word still gets None
+        """
+        pauses = [0.0 if gap is None else gap for gap in self.gaps()]
+        if pauses:
+            pauses[-1] = None
+        return pauses
+
+    def freeze(self, shared=False):
+        """
+        Return a read-only, array-backed copy of the sentence. If shared is
+        set, the copy's store is shared with identical sentences
+        """
+        from _SentenceStore import SentenceStore, FrozenSentence
+        build = FrozenSentence.shared if shared else FrozenSentence
+        return build(SentenceStore.fromNode(self), globalID=self.globalID,
+                     localID=self.localID, speaker=self.speaker, turnID=self.turnID)
+
+
+def _aligned(time):
+    return time is not None and time >= 0
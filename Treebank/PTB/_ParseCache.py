@@ -0,0 +1,93 @@
+import cPickle
+import hashlib
+import os
+
+from _SentenceStore import SentenceStore, FrozenSentence
+
+
+class ParseCache(object):
+    """
+    A directory of parsed files, pickled as their sentences' stores. An
+    entry is keyed on the path, size and mtime of every source the file was
+    read from, and on parserVersion, so it is replaced as soon as any of
+    them changes
+    """
+    # Bump whenever a change to parsing changes the trees built
+    parserVersion = 3
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.hits = 0
+        self.misses = 0
+
+    def _entryPath(self, sources):
+        name = hashlib.md5('\n'.join(sources)).hexdigest()
+        return os.path.join(self.directory, name + '.parse')
+
+    def _key(self, sources):
+        key = [self.parserVersion]
+        for path in sources:
+            stat = os.stat(path)
+            key.append((path, stat.st_size, stat.st_mtime))
+        return key
+
+    def load(self, sources, frozen=False, shared=False):
+        """
+        The cached sentences of the file read from sources, or None
+        """
+        path = self._entryPath(sources)
+        try:
+            entry = open(path, 'rb')
+        except IOError:
+            self.misses += 1
+            return None
+        try:
+            if cPickle.load(entry) != self._key(sources):
+                self.misses += 1
+                return None
+            sentences = cPickle.load(entry)
+        finally:
+            entry.close()
+        self.hits += 1
+        return [_unpack(packed, frozen, shared) for packed in sentences]
+
+    def save(self, sources, sentences):
+        """
+        Store the sentences of the file read from sources
+        """
+        path = self._entryPath(sources)
+        # Write to the side and rename, so that a reader never sees half an
+        # entry, even with several processes sharing the directory
+        tmpPath = '%s.%d.tmp' % (path, os.getpid())
+        entry = open(tmpPath, 'wb')
+        cPickle.dump(self._key(sources), entry, cPickle.HIGHEST_PROTOCOL)
+        cPickle.dump([_pack(sentence) for sentence in sentences], entry,
+                     cPickle.HIGHEST_PROTOCOL)
+        entry.close()
+        os.rename(tmpPath, path)
+
+
+def _pack(sentence):
+    if not isinstance(sentence, FrozenSentence):
+        sentence = sentence.freeze()
+    store = sentence._store
+    occurrence = sentence._occurrence
+    return (store, occurrence if occurrence is not store else None, sentence.globalID,
+            sentence.localID, sentence.speaker, sentence.turnID)
+
+
+def _unpack(packed, frozen, shared):
+    store, occurrence, globalID, localID, speaker, turnID = packed
+    if shared:
+        sentence = FrozenSentence.shared(store, globalID=globalID, localID=localID,
+                                         speaker=speaker, turnID=turnID)
+        if occurrence is not None:
+            sentence._occurrence = occurrence
+        return sentence
+    sentence = FrozenSentence(store, globalID=globalID, localID=localID, speaker=speaker,
+                              turnID=turnID, occurrence=occurrence)
+    if frozen:
+        return sentence
+    return sentence.thaw()
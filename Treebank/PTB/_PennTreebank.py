@@ -1,120 +1,208 @@
 from Treebank.Nodes import Corpus
+from Treebank.Nodes import IndexEntry
+from Treebank.Nodes import Manifest
 from _PTBNode import PTBNode
 from _PTBFile import PTBFile
 from _PTBFile import NXTFile
+from _PTBFile import readSentences
+from _PTBFile import buildSentence
+from _SentenceStore import SentenceStore
+from _SentenceStore import strings
+from _ParseCache import ParseCache
 
 import os
+import re
 import sys
 from os.path import join as pjoin
 
+_numberRE = re.compile(r'\d+')
+
+# Speaker turns are marked in .mrg files by sentences like
+# (CODE (SYM SpeakerA1) (. .))
+_speakerRE = re.compile(r'\(CODE \(SYM Speaker([A-Za-z]+?)\d*\)')
+
 class PennTreebank(PTBNode, Corpus):
     """
     The Penn Treebank, specifically the WSJ
     Children are built just-in-time
     """
     fileClass = PTBFile
-    def __init__(self, path=None, **kwargs):
+    def __init__(self, path=None, frozen=False, shared=False, dispose=False,
+                 weakParents=False, freezeGC=False, cacheBytes=0, parseCacheDir=None,
+                 lazyText=False, manifestPath=None, sentenceIndexPath=None, **kwargs):
         self.path = path
+        self.sentenceIndexPath = sentenceIndexPath
+        self.fileOptions = {'frozen': frozen, 'shared': shared}
+        if lazyText:
+            self.fileOptions['lazyText'] = True
+        if parseCacheDir is not None:
+            self.fileOptions['parseCache'] = ParseCache(parseCacheDir)
+        self.disposeFiles = dispose
+        self.weakParents = weakParents
+        self.freezeGC = freezeGC
+        self.cacheBytes = cacheBytes
         PTBNode.__init__(self, label='Corpus', **kwargs)
-        for fileLoc in self._getFileList(self.path):
-            self.attachChild(fileLoc)
+        self.manifest = Manifest.open(self.path, self._describe, path=manifestPath,
+                                      describeID='%s._describe' % type(self).__name__)
+        for entry in self.manifest.entries:
+            self.attachChild(pjoin(self.path, entry.path))
                             
     def section(self, sec):
-        for i, fileLoc in enumerate(self._children):
-            path, fileName = os.path.split(fileLoc)
-            if int(fileName[4:6]) == sec:
-                yield self.child(i)
+        return self._iterFiles([i for i, entry in enumerate(self.manifest.entries)
+                                if entry.section == sec])
 
     def section00(self):
-        for i in xrange(99):
-            yield self.child(i)
+        return self._iterFiles(xrange(99))
 
     def twoTo21(self):
-        for i in xrange(199, 2074):
-            yield self.child(i)
+        return self._iterFiles(xrange(199, 2074))
 
     def section23(self):
-        for i in xrange(2157, 2257):
-            yield self.child(i)
+        return self._iterFiles(xrange(2157, 2257))
 
     def section24(self):
-        for i in xrange(2257, self.length()):
-            yield self.child(i)
+        return self._iterFiles(xrange(2257, self.length()))
+
+    @staticmethod
+    def _describe(name):
+        """
+        The manifest fields of a file: the number in its name, and its
+        section, from the digits after the prefix, as in wsj_0012.mrg
+        """
+        if not (name.endswith('.mrg') or name.endswith('.auto')):
+            return None
+        match = _numberRE.search(name)
+        number = int(match.group()) if match else -1
+        section = int(name[4:6]) if name[4:6].isdigit() else -1
+        return name, number, section, ''
+
+    def _indexEntries(self, path):
+        stream = open(path)
+        filename = path.split('/')[-1]
+        noneID = strings.id('-NONE-')
+        editedID = strings.id('EDITED')
+        # Sentences take the speaker of the last speaker code before them
+        speaker = None
+        for i, (start, sentText) in enumerate(readSentences(stream)):
+            match = _speakerRE.search(sentText)
+            if match:
+                speaker = match.group(1)
+            store = SentenceStore.fromString(sentText[1:-1])
+            nWords = len([w for w in store.words if store.labels[w] != noneID])
+            yield IndexEntry('%s~%s' % (filename, str(i + 1).zfill(4)), path, i, start,
+                             len(sentText), nWords, speaker, editedID in store.labels)
+        stream.close()
 
-    def _getFileList(self, location):
+    def _indexedSentence(self, entry):
         """
-        Get all files below location
+        Seek to the sentence and parse just its bracketing, unless its file
+        is already in the cache
         """
-        paths = []
-        for path in [pjoin(location, f) for f in os.listdir(location)]:
-            if path.endswith('CVS'):
-                continue
-            elif path.startswith('.'):
-                continue
-            if os.path.isdir(path):
-                paths.extend(self._getFileList(path))
-            elif path.endswith('.mrg') or path.endswith('.auto'):
-                paths.append(path)
-        paths.sort()
-        return paths
+        cache = self.fileCache()
+        if cache is not None and cache.peek(entry.fileKey) is not None:
+            return cache.peek(entry.fileKey).sentence(entry.key)
+        file_ = open(entry.fileKey)
+        file_.seek(entry.offset)
+        text = file_.read(entry.length)
+        file_.close()
+        return buildSentence(text, entry.key, entry.localID,
+                             frozen=self.fileOptions.get('frozen', False),
+                             shared=self.fileOptions.get('shared', False))
 
 
 class NXTSwitchboard(PTBNode, Corpus):
     """The Nite XML-toolkite formatted Switchboard spoken language treebank"""
     fileClass = NXTFile
-    def __init__(self, path=None, **kwargs):
+    def __init__(self, path=None, frozen=False, shared=False, dispose=False,
+                 weakParents=False, freezeGC=False, cacheBytes=0, parseCacheDir=None,
+                 manifestPath=None, verifyOrder=False, fetchThreads=0, parsePool=None,
+                 sentenceIndexPath=None, **kwargs):
         self.path = path
+        self.sentenceIndexPath = sentenceIndexPath
+        self.fileOptions = {'frozen': frozen, 'shared': shared}
+        if verifyOrder:
+            self.fileOptions['verifyOrder'] = True
+        if fetchThreads:
+            self.fileOptions['fetchThreads'] = fetchThreads
+        # A process pool only works from the process that made it, so
+        # files loaded in map's workers go without
+        self.parsePool = parsePool
+        self._poolPID = os.getpid()
+        if parseCacheDir is not None:
+            self.fileOptions['parseCache'] = ParseCache(parseCacheDir)
+        self.disposeFiles = dispose
+        self.weakParents = weakParents
+        self.freezeGC = freezeGC
+        self.cacheBytes = cacheBytes
         PTBNode.__init__(self, label='Corpus', **kwargs)
-        for filename in self._getFileList(self.path):
+        self.manifest = Manifest.open(self.path, self._describe, path=manifestPath,
+                                      top=pjoin('xml', 'syntax'),
+                                      describeID='%s._describe' % type(self).__name__)
+        for filename in self.manifest.keys():
             self.attachChild(filename)
 
     def attachChild(self, filename):
         self._children.append(filename)
             
-    def child(self, index):
+    def _loadFile(self, filename):
         """
-        Read a file by zero-index offset
+        Read a file by its name, such as sw2005
         """
-        filename = self._children[index]
         print >> sys.stderr, filename
-        return self.fileClass(path=self.path, filename=filename)
+        options = self.fileOptions
+        if self.parsePool is not None and os.getpid() == self._poolPID:
+            options = dict(options, parsePool=self.parsePool)
+        with self._loadSettings():
+            return self.fileClass(path=self.path, filename=filename, **options)
  
-    def _getFileList(self, location):
-        location = pjoin(location, 'xml', 'syntax')
-        files = set() 
-        for path in [f for f in os.listdir(location)]:
-            if path.startswith('.'):
-                continue
-            elif path.startswith('CVS'):
-                continue
-            assert path.endswith('xml'), path
-            filename = path.split('/')[-1]
-            fileID = filename.split('.')[0]
-            files.add(fileID)
-        files = list(files)
-        files.sort()
-        return files
+    @staticmethod
+    def _describe(name):
+        """
+        The manifest fields of a syntax file, such as sw2005.A.syntax.xml:
+        its conversation, the conversation's number and its split
+        """
+        assert name.endswith('xml'), name
+        fileID = name.split('.')[0]
+        number = int(fileID[2:]) if fileID[2:].isdigit() else -1
+        if fileID.startswith('sw2') or fileID.startswith('sw3'):
+            split = 'train'
+        elif 4500 < number <= 4936:
+            split = 'dev'
+        elif 4154 < number < 4500:
+            split = 'dev2'
+        elif 4000 < number <= 4154:
+            split = 'eval'
+        else:
+            split = ''
+        return fileID, number, -1, split
+
+    def _split(self, split):
+        manifest = self.manifest
+        return self._iterFiles([i for i, f in enumerate(self._children)
+                                if manifest.entry(f).split == split])
+
+    def _sourcePaths(self, filename):
+        return NXTFile.sourcePaths(self.path, filename)
+
+    def _indexEntries(self, filename):
+        # The sentences are spread over several XML files, so the entries
+        # can't give an offset to seek to
+        file_ = self.fileClass(path=self.path, filename=filename, frozen=True)
+        for sent in file_.children():
+            nWords = len([w for w in sent.listWords() if w.label != '-NONE-'])
+            edited = any(node.label == 'EDITED' for node in sent.depthList())
+            yield IndexEntry(sent.globalID, filename, sent.localID, -1, 0, nWords,
+                             sent.speaker, edited)
+        file_.dispose()
 
     def train_files(self):
-        for i, f in enumerate(self._children):
-            if f.startswith('sw2') or f.startswith('sw3'):
-                yield self.child(i)
+        return self._split('train')
 
     def dev_files(self):
-        for i, f in enumerate(self._children):
-            filenum = int(f[2:])
-            if 4500 < filenum <= 4936:
-                yield self.child(i)
+        return self._split('dev')
  
     def dev2_files(self):
-        for i, f in enumerate(self._children):
-            filenum = int(f[2:])
-            if 4154 < filenum < 4500:
-                yield self.child(i)
+        return self._split('dev2')
 
     def eval_files(self):
-        for i, f in enumerate(self._children):
-            filenum = int(f[2:])
-            if 4000 < filenum <= 4154:
-                yield self.child(i)
-
+        return self._split('eval')
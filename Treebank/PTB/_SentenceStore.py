@@ -0,0 +1,747 @@
+import array
+import math
+import re
+import sys
+
+from Treebank.Nodes import Leaf
+from Treebank.Nodes import Node
+from _PTBNode import PTBNode
+from _PTBLeaf import PTBLeaf
+from _PTBSentence import PTBSentence
+
+# Flag bits for SentenceStore.flags
+LEAF = 1
+UNF = 2
+
+NAN = float('nan')
+
+
+class StringTable(object):
+    """
+    Map strings to integer ids and back. The id -1 stands for None
+    """
+    def __init__(self):
+        self._ids = {}
+        # Kept with None at the end, so that it can be indexed by any id,
+        # including -1
+        self._strings = [None]
+
+    def id(self, string):
+        if string is None:
+            return -1
+        try:
+            return self._ids[string]
+        except KeyError:
+            id_ = len(self._strings) - 1
+            self._ids[string] = id_
+            self._strings.insert(id_, string)
+            return id_
+
+    def string(self, id_):
+        return self._strings[id_]
+
+    def __len__(self):
+        return len(self._strings) - 1
+
+# Process-wide table shared by every store, so that ids are comparable
+# between sentences
+strings = StringTable()
+
+
+def _time(value):
+    if value is None:
+        return NAN
+    return value
+
+
+def _untime(value):
+    if math.isnan(value):
+        return None
+    return value
+
+
+class SentenceStore(object):
+    """
+    A read-only sentence held as parallel arrays, one entry per node in
+    pre-order. Node 0 is the sentence root. Words are numbered by their
+    position in the yield; `words` maps positions back to node indices.
+    """
+    def __init__(self):
+        self.labels = array.array('i')
+        self.functions = array.array('i')
+        self.identifiers = array.array('i')
+        self.identified = array.array('i')
+        self.flags = array.array('B')
+        self.parents = array.array('i')
+        self.firstChild = array.array('i')
+        self.nextSibling = array.array('i')
+        # Pre-order index one past the node's last descendant
+        self.ends = array.array('i')
+        # Word span, as [firstWord, lastWord)
+        self.firstWord = array.array('i')
+        self.lastWord = array.array('i')
+        self.texts = array.array('i')
+        self.startTimes = array.array('d')
+        self.endTimes = array.array('d')
+        self.words = array.array('i')
+        self.wordIDs = array.array('i')
+
+    def __len__(self):
+        return len(self.labels)
+
+    # Arrays in pickling order. String ids are only meaningful within one
+    # process's table, so a pickle carries the strings the store uses, and
+    # its string arrays are renumbered to index that list
+    arrays = ('labels', 'functions', 'identifiers', 'identified', 'texts', 'flags',
+              'parents', 'firstChild', 'nextSibling', 'ends', 'firstWord', 'lastWord',
+              'startTimes', 'endTimes', 'words', 'wordIDs')
+    stringArrays = arrays[:5]
+    # Arrays indexed by word position rather than by node
+    wordArrays = ('words', 'wordIDs')
+
+    def __getstate__(self):
+        # Local number 0 stands for None
+        used = [None]
+        local = {-1: 0}
+        data = []
+        for name in self.arrays:
+            values = getattr(self, name)
+            if name in self.stringArrays:
+                numbers = []
+                for id_ in values:
+                    if id_ not in local:
+                        local[id_] = len(used)
+                        used.append(strings.string(id_))
+                    numbers.append(local[id_])
+                values = array.array('i', numbers)
+            data.append(values.tostring())
+        return used, data
+
+    def __setstate__(self, state):
+        used, data = state
+        remap = [strings.id(string) for string in used].__getitem__
+        self.__init__()
+        for name, bytes_ in zip(self.arrays, data):
+            values = getattr(self, name)
+            values.fromstring(bytes_)
+            if name in self.stringArrays:
+                setattr(self, name, array.array('i', map(remap, values)))
+
+    def _addNode(self, parent, label, functionLabel=None, unf=False, identifier=None,
+                 identified=None, start_time=None, end_time=None):
+        index = len(self.labels)
+        self.labels.append(strings.id(label))
+        self.functions.append(strings.id(functionLabel))
+        self.identifiers.append(strings.id(identifier))
+        self.identified.append(strings.id(identified))
+        self.flags.append(UNF if unf else 0)
+        self.parents.append(parent)
+        self.firstChild.append(-1)
+        self.nextSibling.append(-1)
+        self.ends.append(index + 1)
+        self.firstWord.append(len(self.words))
+        self.lastWord.append(len(self.words))
+        self.texts.append(-1)
+        self.startTimes.append(_time(start_time))
+        self.endTimes.append(_time(end_time))
+        return index
+
+    def _linkChild(self, parent, child, lastChild):
+        if lastChild == -1:
+            self.firstChild[parent] = child
+        else:
+            self.nextSibling[lastChild] = child
+
+    def _closeNode(self, index):
+        self.ends[index] = len(self.labels)
+        self.lastWord[index] = len(self.words)
+
+    def _addWord(self, index, text, wordID):
+        self.flags[index] |= LEAF
+        self.texts[index] = strings.id(text)
+        self.words.append(index)
+        self.wordIDs.append(wordID)
+
+    @classmethod
+    def fromNode(cls, sentence):
+        """
+        Copy an existing tree, rooted at a Sentence
+        """
+        store = cls()
+        store._addNode(-1, sentence.label, start_time=sentence.start_time,
+                       end_time=sentence.end_time)
+        return store._fillFrom(sentence)
+
+    def _fillFrom(self, sentence):
+        # Depth-first copy. Each stack entry is (node, parent index); a None
+        # node closes the span of the given index
+        stack = [(child, 0) for child in reversed(sentence._children)]
+        stack.insert(0, (None, 0))
+        lastChild = {0: -1}
+        while stack:
+            node, parent = stack.pop()
+            if node is None:
+                self._closeNode(parent)
+                continue
+            index = self._addNode(parent, node.label, node.functionLabel, node.unf,
+                                  node.identifier, node.identified,
+                                  node.start_time, node.end_time)
+            self._linkChild(parent, index, lastChild[parent])
+            lastChild[parent] = index
+            if node.isLeaf():
+                self._addWord(index, node.text, node.wordID)
+                self._closeNode(index)
+            else:
+                lastChild[index] = -1
+                stack.append((None, index))
+                for child in reversed(node._children):
+                    stack.append((child, index))
+        return self
+
+    @classmethod
+    def fromString(cls, sent_text):
+        """
+        Build a store straight from a bracketed sentence, without creating
+        node objects
+        """
+        store = cls()
+        store._parse(sent_text, 0, len(sent_text))
+        return store
+
+    def _parse(self, source, start, end):
+        """
+        Fill the store from the bracketing in source[start:end]
+        """
+        self._addNode(-1, 'S')
+        # Stack of [store index, last child index, raw label]. Labels are
+        # only parsed on close, once it is known whether the node is a leaf
+        openNodes = [[0, -1, None]]
+        nWords = 0
+        for match in PTBSentence.bracketsRE.finditer(source, start, end):
+            label = match.group(2)
+            if label is not None:
+                parent = openNodes[-1]
+                if parent[1] != -1 and parent[0] == 0:
+                    # Only the last top-level constituent is kept, as in
+                    # PTBSentence._parseString. Its words keep their
+                    # numbers from the whole bracketing
+                    self._truncate(parent[1])
+                    parent[1] = -1
+                index = self._addNode(parent[0], None)
+                self._linkChild(parent[0], index, parent[1])
+                parent[1] = index
+                openNodes.append([index, -1, label])
+            else:
+                index, lastChild, label = openNodes.pop()
+                textStart = match.start(3)
+                if textStart != -1:
+                    self._addLeaf(index, label, source, textStart, match.end(3), nWords)
+                    nWords += 1
+                else:
+                    self._setLabel(index, *PTBNode.parseLabel(label))
+                self._closeNode(index)
+        self._closeNode(0)
+
+    def _truncate(self, index):
+        """
+        Drop the node at index and every node after it, with their words
+        """
+        nWords = self.firstWord[index]
+        for name in self.arrays:
+            if name not in self.wordArrays:
+                del getattr(self, name)[index:]
+        for name in self.wordArrays:
+            del getattr(self, name)[nWords:]
+
+    def _addLeaf(self, index, label, source, start, end, wordID):
+        text = source[start:end]
+        self._setLabel(index, PTBLeaf.normaliseTag(label), identified=PTBLeaf.traceIndex(text))
+        self._addWord(index, text, wordID)
+
+    def text(self, index):
+        """
+        The text of the word at a leaf's index
+        """
+        return strings.string(self.texts[index])
+
+    def _setLabel(self, index, label, functionLabel=None, unf=False, identifier=None,
+                  identified=None):
+        self.labels[index] = strings.id(label)
+        self.functions[index] = strings.id(functionLabel)
+        self.identifiers[index] = strings.id(identifier)
+        self.identified[index] = strings.id(identified)
+        if unf:
+            self.flags[index] |= UNF
+
+    def label(self, index):
+        return strings.string(self.labels[index])
+
+    def isLeaf(self, index):
+        return bool(self.flags[index] & LEAF)
+
+    def childIndices(self, index):
+        child = self.firstChild[index]
+        while child != -1:
+            yield child
+            child = self.nextSibling[child]
+
+    # Arrays that describe the tree itself. The word IDs and times belong to
+    # a particular occurrence of the sentence
+    structure = ('labels', 'functions', 'identifiers', 'identified', 'flags', 'parents',
+                 'firstChild', 'nextSibling', 'ends', 'firstWord', 'lastWord',
+                 'texts', 'words')
+    occurrence = ('wordIDs', 'startTimes', 'endTimes')
+
+    def sameStructure(self, other):
+        for name in self.structure:
+            if getattr(self, name) != getattr(other, name):
+                return False
+        return True
+
+    def structureHash(self):
+        return hash(tuple(getattr(self, name).tostring() for name in self.structure))
+
+    def nbytes(self):
+        """
+        Approximate memory held by the store and its arrays
+        """
+        return sys.getsizeof(self) + sys.getsizeof(self.__dict__) + \
+            sum(sys.getsizeof(a) for a in self.__dict__.values())
+
+
+class LazyTextStore(SentenceStore):
+    """
+    A SentenceStore that keeps each word's text in its source buffer,
+    usually an mmap of the file, and only copies it out when it is read.
+    For leaves, texts holds the offset of the text in source rather than a
+    string id; the text is the token there, up to the next space or
+    bracket as in PTBSentence.bracketsRE. Its texts can't be compared, so
+    it is never shared; a copy with ordinary texts is shared or pickled in
+    its place
+    """
+    textRE = re.compile(r'[^\s\)\(]+')
+
+    def __init__(self, source=None):
+        SentenceStore.__init__(self)
+        self.source = source
+
+    @classmethod
+    def fromBuffer(cls, source, start, end):
+        """
+        Build a store from the bracketing in source[start:end]
+        """
+        store = cls(source)
+        store._parse(source, start, end)
+        return store
+
+    def _addLeaf(self, index, label, source, start, end, wordID):
+        # Only traces need their text looked at while parsing
+        identified = PTBLeaf.traceIndex(source[start:end]) if source[start] == '*' else None
+        self._setLabel(index, PTBLeaf.normaliseTag(label), identified=identified)
+        self.flags[index] |= LEAF
+        self.texts[index] = start
+        self.words.append(index)
+        self.wordIDs.append(wordID)
+
+    def text(self, index):
+        return self.textRE.match(self.source, self.texts[index]).group()
+
+    def copy(self):
+        """
+        A SentenceStore with the same values, and interned texts
+        """
+        store = SentenceStore()
+        for name in SentenceStore.arrays:
+            getattr(store, name).extend(getattr(self, name))
+        for index in self.words:
+            store.texts[index] = strings.id(self.text(index))
+        return store
+
+    def __reduce__(self):
+        # Unpickles as an ordinary SentenceStore
+        return (SentenceStore, (), self.copy().__getstate__())
+
+
+class Occurrence(object):
+    """
+    The word IDs and times of one occurrence of a shared store
+    """
+    __slots__ = SentenceStore.occurrence
+
+    def __init__(self, store):
+        self.wordIDs = store.wordIDs
+        self.startTimes = store.startTimes
+        self.endTimes = store.endTimes
+
+
+class StoreTable(object):
+    """
+    Hash-consing table for sentence stores. Structurally identical sentences
+    are mapped to one shared store; what differs between occurrences is
+    kept in an Occurrence. The table holds every distinct store it has
+    seen until it is cleared
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._buckets = {}
+        self.lookups = 0
+        self.hits = 0
+        self.bytesSaved = 0
+
+    def intern(self, store):
+        """
+        Return (shared store, occurrence) for a store
+        """
+        if isinstance(store, LazyTextStore):
+            store = store.copy()
+        self.lookups += 1
+        bucket = self._buckets.setdefault(store.structureHash(), [])
+        for shared in bucket:
+            if shared.sameStructure(store):
+                break
+        else:
+            bucket.append(store)
+            return store, store
+        self.hits += 1
+        saved = store.nbytes()
+        # Occurrences that match the shared store's word IDs and times,
+        # such as most PTB sentences, need nothing of their own. Times are
+        # compared as bytes, as NaN != NaN
+        if all(getattr(store, name).tostring() == getattr(shared, name).tostring()
+               for name in SentenceStore.occurrence):
+            occurrence = shared
+        else:
+            occurrence = Occurrence(store)
+            saved -= sys.getsizeof(occurrence) + \
+                sum(sys.getsizeof(getattr(store, name)) for name in SentenceStore.occurrence)
+        self.bytesSaved += saved
+        return shared, occurrence
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    def ratio(self):
+        """
+        Sentences looked up per distinct store
+        """
+        if not self.lookups:
+            return 1.0
+        return self.lookups / float(len(self))
+
+# Process-wide table used by the shared load mode
+sharedStores = StoreTable()
+
+
+class _Frozen(object):
+    """
+    Node interface over one entry of a SentenceStore. Facades are created
+    on demand by the FrozenSentence, which keeps one per index so that
+    identity comparisons keep working
+    """
+    __slots__ = ()
+    # Frozen trees are never edited, so their cached tables never go stale
+    _edits = 0
+    # Parents are kept in the store, not as links on the facades
+    _parent = None
+
+    def _readOnly(self, *args, **kwargs):
+        raise AttributeError, "Cannot modify a frozen tree! Attempted on:\n\n%s" % self.prettyPrint()
+
+    attachChild = detachChild = setParent = _detachFromParent = _readOnly
+    reattach = insert = delete = replace = prune = sweep = sortChildren = _readOnly
+
+    def _release(self):
+        # Facades hold no links of their own. The sentence drops its facade
+        # table and its link to itself, which tie it into cycles
+        if self._sentence is self:
+            self._facades = []
+            self._byIdentifier = None
+            self._sentence = None
+        return []
+
+    @property
+    def label(self):
+        return self._store.label(self._index)
+
+    @property
+    def functionLabel(self):
+        return strings.string(self._store.functions[self._index])
+
+    @property
+    def unf(self):
+        return bool(self._store.flags[self._index] & UNF)
+
+    @property
+    def identifier(self):
+        return strings.string(self._store.identifiers[self._index])
+
+    @property
+    def identified(self):
+        return strings.string(self._store.identified[self._index])
+
+    @property
+    def start_time(self):
+        return _untime(self._sentence._occurrence.startTimes[self._index])
+
+    @property
+    def end_time(self):
+        return _untime(self._sentence._occurrence.endTimes[self._index])
+
+    @property
+    def traced(self):
+        identified = self._store.identified[self._index]
+        if identified == -1:
+            return None
+        return self._sentence._identifiers().get(identified)
+
+    @property
+    def _children(self):
+        node = self._sentence._node
+        return [node(i) for i in self._store.childIndices(self._index)]
+
+    def parent(self):
+        return self._sentence._node(self._store.parents[self._index])
+
+    def root(self):
+        return self._sentence
+
+    def children(self):
+        node = self._sentence._node
+        for i in self._store.childIndices(self._index):
+            yield node(i)
+
+    def length(self, constraint=None):
+        if constraint is None:
+            return len(list(self._store.childIndices(self._index)))
+        return len([c for c in self.children() if constraint(c)])
+
+    def depthList(self):
+        node = self._sentence._node
+        return [node(i) for i in xrange(self._index + 1, self._store.ends[self._index])]
+
+    # Frozen trees can't be edited, so every traversal mode is a plain walk.
+    # Pre-order walks are ranges of the store
+    def _preOrder(self, mode, leavesOnly):
+        store = self._store
+        node = self._sentence._node
+        if leavesOnly:
+            for p in xrange(store.firstWord[self._index], store.lastWord[self._index]):
+                yield node(store.words[p])
+        else:
+            for i in xrange(self._index + 1, store.ends[self._index]):
+                yield node(i)
+
+    def dominates(self, other):
+        # Pre-order numbering makes every subtree a contiguous range
+        return (getattr(other, '_sentence', None) is self._sentence and
+                self._index < other._index < self._store.ends[self._index])
+
+    def _postOrder(self, mode):
+        return PTBNode._postOrder(self, 'lazy' if mode == 'tombstone' else mode)
+
+    def _breadthFirst(self, mode):
+        return PTBNode._breadthFirst(self, 'lazy' if mode == 'tombstone' else mode)
+
+    def listWords(self):
+        store = self._store
+        node = self._sentence._node
+        return [node(store.words[p]) for p in
+                xrange(store.firstWord[self._index], store.lastWord[self._index])]
+
+    _words = listWords
+
+    def getWordID(self, index):
+        store = self._store
+        positions = xrange(store.firstWord[self._index], store.lastWord[self._index])
+        if not positions:
+            return 0
+        return self._sentence._occurrence.wordIDs[positions[index]]
+
+    def getWord(self, index):
+        store = self._store
+        positions = xrange(store.firstWord[self._index], store.lastWord[self._index])
+        if not positions:
+            return None
+        return self._sentence._node(store.words[positions[index]])
+
+
+class FrozenNode(_Frozen, PTBNode):
+    __slots__ = ('_sentence', '_store', '_index')
+
+    def __init__(self, sentence, index):
+        self._sentence = sentence
+        self._store = sentence._store
+        self._index = index
+
+    @property
+    def globalID(self):
+        return (self._sentence.globalID, self._index)
+
+
+class FrozenLeaf(_Frozen, PTBLeaf):
+    __slots__ = ('_sentence', '_store', '_index', '_position')
+
+    def __init__(self, sentence, index):
+        self._sentence = sentence
+        self._store = sentence._store
+        self._index = index
+        self._position = sentence._store.firstWord[index]
+
+    @property
+    def globalID(self):
+        return (self._sentence.globalID, self._index)
+
+    @property
+    def wordID(self):
+        return self._sentence._occurrence.wordIDs[self._position]
+
+    @property
+    def text(self):
+        return self._store.text(self._index)
+
+    @property
+    def lemma(self):
+        return self.text
+
+    # Read-only, so no sense information can be added
+    synsets = ()
+    supersenses = ()
+
+    listWords = Leaf.listWords
+    _words = Leaf._words
+    length = Leaf.length
+    child = Leaf.child
+
+    def children(self):
+        return iter(())
+
+
+class FrozenSentence(_Frozen, PTBSentence):
+    """
+    A read-only sentence backed by a SentenceStore. Node objects for the
+    constituents and words are only built when they are visited. The store
+    may be shared with other sentences (see StoreTable), in which case the
+    word IDs and times are read from occurrence
+    """
+    __slots__ = ('_sentence', '_store', '_occurrence', '_index', '_facades', '_byIdentifier')
+
+    def __init__(self, store, globalID=None, localID=None, speaker=None, turnID=None,
+                 occurrence=None):
+        self._sentence = self
+        self._store = store
+        self._occurrence = store if occurrence is None else occurrence
+        self._index = 0
+        self._facades = [None] * len(store)
+        self._facades[0] = self
+        self._byIdentifier = None
+        self._traces = None
+        self._tracesVersion = -1
+        self.globalID = globalID
+        self.localID = localID
+        self.speaker = speaker
+        self.turnID = turnID
+
+    # The root has no parent
+    parent = PTBSentence.parent
+    addTurn = PTBSentence.addTurn
+
+    def __reduce__(self):
+        return (FrozenSentence, (self._store, self.globalID, self.localID, self.speaker,
+                                 self.turnID, self._occurrence))
+
+    def freeze(self, shared=False):
+        # Already frozen. A sentence whose times are kept apart from its
+        # store is already shared
+        if shared and self._occurrence is self._store:
+            return FrozenSentence.shared(self._store, globalID=self.globalID,
+                                         localID=self.localID, speaker=self.speaker,
+                                         turnID=self.turnID)
+        return self
+
+    def thaw(self):
+        """
+        Return an editable PTBSentence copy, built from node objects
+        """
+        store = self._store
+        occurrence = self._occurrence
+        names = strings._strings
+        text = store.text
+        startTimes = occurrence.startTimes
+        endTimes = occurrence.endTimes
+        nodes = [None] * len(store)
+        # The values are already parsed, so the nodes are filled in directly
+        # rather than through their constructors, which parse their
+        # arguments. This must set everything PTBNode and PTBLeaf set
+        for i in xrange(1, len(store)):
+            if store.flags[i] & LEAF:
+                node = PTBLeaf.__new__(PTBLeaf)
+                node.wordID = occurrence.wordIDs[store.firstWord[i]]
+                node.text = node.lemma = text(i)
+                node.synsets = []
+                node.supersenses = []
+            else:
+                node = PTBNode.__new__(PTBNode)
+            Node.__init__(node, names[store.labels[i]])
+            node.functionLabel = names[store.functions[i]]
+            node.identifier = names[store.identifiers[i]]
+            node.identified = names[store.identified[i]]
+            node.unf = bool(store.flags[i] & UNF)
+            # NaN, the only value not equal to itself, stands for None
+            time = startTimes[i]
+            node.start_time = time if time == time else None
+            time = endTimes[i]
+            node.end_time = time if time == time else None
+            node.traced = None
+            nodes[i] = node
+            parent = store.parents[i]
+            if parent > 0:
+                nodes[parent]._children.append(node)
+                node.setParent(nodes[parent])
+        for i, node in enumerate(nodes):
+            if node is not None and node.identified:
+                traced = self._identifiers().get(store.identified[i])
+                if traced is not None:
+                    node.traced = nodes[traced._index]
+        top = nodes[store.firstChild[0]]
+        sentence = PTBSentence(node=top, globalID=self.globalID, localID=self.localID)
+        sentence.speaker = self.speaker
+        sentence.turnID = self.turnID
+        return sentence
+
+    def _node(self, index):
+        facade = self._facades[index]
+        if facade is None:
+            if self._store.isLeaf(index):
+                facade = FrozenLeaf(self, index)
+            else:
+                facade = FrozenNode(self, index)
+            self._facades[index] = facade
+        return facade
+
+    @classmethod
+    def shared(cls, store, **kwargs):
+        """
+        Build a sentence over the shared copy of store, from sharedStores
+        """
+        store, occurrence = sharedStores.intern(store)
+        return cls(store, occurrence=occurrence, **kwargs)
+
+    def wordPosition(self, word):
+        return word._position
+
+    def nbytes(self):
+        # A shared store is counted in full by each sentence using it
+        return sys.getsizeof(self) + sys.getsizeof(self._facades) + self._store.nbytes()
+
+    def _identifiers(self):
+        if self._byIdentifier is None:
+            self._byIdentifier = {}
+            # The top node is outside its own subtree, so, as in
+            # PTBSentence._parseString, it isn't traced to
+            top = self._store.firstChild[0]
+            for i, identifier in enumerate(self._store.identifiers):
+                if identifier != -1 and i != top:
+                    self._byIdentifier[identifier] = self._node(i)
+        return self._byIdentifier
@@ -0,0 +1,231 @@
+import array
+import os.path
+from xml.etree import cElementTree as etree
+
+from Treebank.Nodes import Node
+from _PTBLeaf import PTBLeaf
+from _SentenceStore import strings, NAN, _untime
+
+_ns = '{http://nite.sourceforge.net/}'
+
+# Terminal kinds, by the tag of their element
+WORD, PUNC, TRACE, SIL = range(4)
+_kinds = {'word': WORD, 'punc': PUNC, 'trace': TRACE, 'sil': SIL}
+
+
+def _parseTime(value):
+    """
+    A time attribute as a float: NaN where there is none, -1 where the
+    word isn't aligned, as PTBNode reads them
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        if value == 'non-aligned' or value == '?':
+            return -1.0
+        return NAN
+
+
+class TerminalTable(object):
+    """
+    The terminals of an NXT conversation, in columns: the kind of each,
+    its speaker, the sentence and word numbers from its nite:id, its tag
+    and text as ids in the process-wide string table, and its times, with
+    NaN for none. hrefs maps the href that the syntax files link each
+    terminal by to its row, so the table is read once, and terminals are
+    then found without parsing their ids. With keepTimeStrings, the time
+    attributes are also kept as written, in startStrings and endStrings,
+    for tools that copy them out unchanged
+    """
+    arrays = ('kinds', 'speakers', 'sentenceIDs', 'wordIDs', 'labels', 'texts',
+              'startTimes', 'endTimes')
+    # Arrays of ids in the process-wide string table, which are pickled as
+    # strings
+    stringArrays = ('labels', 'texts')
+
+    def __init__(self, keepTimeStrings=False):
+        self.kinds = array.array('B')
+        self.speakers = array.array('c')
+        self.sentenceIDs = array.array('i')
+        # Zero-based, as in PTBLeaf
+        self.wordIDs = array.array('i')
+        self.labels = array.array('i')
+        self.texts = array.array('i')
+        self.startTimes = array.array('d')
+        self.endTimes = array.array('d')
+        self.hrefs = {}
+        # None where an element has no time attribute
+        self.startStrings = [] if keepTimeStrings else None
+        self.endStrings = [] if keepTimeStrings else None
+
+    @classmethod
+    def read(cls, nxt_root_dir, file_id, openSource=open, keepTimeStrings=False):
+        """
+        The terminals of both speakers of a conversation, such as sw2005.
+        openSource opens each file
+        """
+        table = cls(keepTimeStrings)
+        for speaker in 'AB':
+            path = os.path.join(nxt_root_dir, 'xml', 'terminals',
+                                '%s.%s.terminals.xml' % (file_id, speaker))
+            table.readFile(openSource(path), speaker, os.path.basename(path))
+        return table
+
+    def readFile(self, source, speaker, document=None):
+        """
+        Add the terminals of one terminals file, in a single streaming
+        pass. document is the file name that hrefs give, by default the
+        base name of source
+        """
+        if document is None:
+            document = os.path.basename(source)
+        idKey = _ns + 'id'
+        startKey = _ns + 'start'
+        endKey = _ns + 'end'
+        stringID = strings.id
+        noneID = stringID('-NONE-')
+        texts = {TRACE: noneID, SIL: stringID('-SIL-')}
+        hrefs = self.hrefs
+        hrefFormat = document + '#id(%s)'
+        kinds = _kinds
+        appendKind = self.kinds.append
+        appendSpeaker = self.speakers.append
+        appendSentenceID = self.sentenceIDs.append
+        appendWordID = self.wordIDs.append
+        appendLabel = self.labels.append
+        appendText = self.texts.append
+        appendStart = self.startTimes.append
+        appendEnd = self.endTimes.append
+        keepStrings = self.startStrings is not None
+        if keepStrings:
+            appendStartString = self.startStrings.append
+            appendEndString = self.endStrings.append
+        row = len(self.kinds)
+        for event, elem in etree.iterparse(source):
+            kind = kinds.get(elem.tag)
+            if kind is None:
+                continue
+            xml_id = elem.get(idKey)
+            sentenceID, wordID = xml_id[1:].split('_')
+            if kind == WORD:
+                appendLabel(stringID(elem.get('pos')))
+                appendText(stringID(elem.get('orth')))
+                appendStart(_parseTime(elem.get(startKey)))
+                appendEnd(_parseTime(elem.get(endKey)))
+            else:
+                if kind == PUNC:
+                    label = text = stringID(elem.text)
+                else:
+                    label = noneID
+                    text = texts[kind]
+                appendLabel(label)
+                appendText(text)
+                appendStart(NAN)
+                appendEnd(NAN)
+            if keepStrings:
+                appendStartString(elem.get(startKey))
+                appendEndString(elem.get(endKey))
+            hrefs[hrefFormat % xml_id] = row
+            row += 1
+            appendKind(kind)
+            appendSpeaker(speaker)
+            appendSentenceID(int(sentenceID))
+            appendWordID(int(wordID) - 1)
+            elem.clear()
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def extend(self, other):
+        """
+        Add the rows of another table, such as the other speaker's
+        """
+        offset = len(self.kinds)
+        for name in self.arrays:
+            getattr(self, name).extend(getattr(other, name))
+        for href, row in other.hrefs.iteritems():
+            self.hrefs[href] = row + offset
+        if self.startStrings is not None:
+            self.startStrings.extend(other.startStrings)
+            self.endStrings.extend(other.endStrings)
+
+    def __getstate__(self):
+        used = []
+        local = {}
+        data = []
+        for name in self.arrays:
+            values = getattr(self, name)
+            if name in self.stringArrays:
+                numbers = []
+                for id_ in values:
+                    if id_ not in local:
+                        local[id_] = len(used)
+                        used.append(strings.string(id_))
+                    numbers.append(local[id_])
+                values = array.array('i', numbers)
+            data.append(values.tostring())
+        return used, data, self.hrefs, self.startStrings, self.endStrings
+
+    def __setstate__(self, state):
+        used, data, hrefs, startStrings, endStrings = state
+        remap = [strings.id(string) for string in used].__getitem__
+        self.__init__()
+        self.startStrings = startStrings
+        self.endStrings = endStrings
+        for name, bytes_ in zip(self.arrays, data):
+            values = getattr(self, name)
+            values.fromstring(bytes_)
+            if name in self.stringArrays:
+                setattr(self, name, array.array('i', map(remap, values)))
+        self.hrefs = hrefs
+
+    def row(self, href):
+        """
+        The row of the terminal an href links to, or None
+        """
+        try:
+            return self.hrefs[href]
+        except KeyError:
+            # Not spelled as the table keys it, e.g. with a directory
+            document, hash_, target = href.partition('#')
+            return self.hrefs.get('%s#%s' % (os.path.basename(document), target))
+
+    def xmlID(self, row):
+        """
+        The nite:id of a row, such as s23_5
+        """
+        return 's%d_%d' % (self.sentenceIDs[row], self.wordIDs[row] + 1)
+
+    def label(self, row):
+        return strings.string(self.labels[row])
+
+    def text(self, row):
+        return strings.string(self.texts[row])
+
+    def isWord(self, row):
+        return self.kinds[row] == WORD
+
+    def isSilence(self, row):
+        return self.kinds[row] == SIL
+
+    def leaf(self, row):
+        """
+        A new PTBLeaf for a row. Its slots are filled in directly, as the
+        table has already parsed what PTBLeaf.__init__ would
+        """
+        text = strings.string(self.texts[row])
+        leaf = PTBLeaf.__new__(PTBLeaf)
+        Node.__init__(leaf, PTBLeaf.normaliseTag(strings.string(self.labels[row])))
+        leaf.wordID = self.wordIDs[row]
+        leaf.text = text
+        leaf.lemma = text
+        leaf.synsets = []
+        leaf.supersenses = []
+        leaf.start_time = _untime(self.startTimes[row])
+        leaf.end_time = _untime(self.endTimes[row])
+        leaf.functionLabel = None
+        leaf.identifier = None
+        leaf.identified = PTBLeaf.traceIndex(text)
+        leaf.unf = False
+        leaf.traced = None
+        return leaf
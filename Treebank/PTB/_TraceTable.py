@@ -0,0 +1,60 @@
+from _TracedNode import TracedNode
+
+
+class TraceTable(object):
+    """
+    The coindexation of one sentence: each trace, or gapped node, paired
+    with the node it is coindexed with. Lookups go either way
+    """
+    def __init__(self):
+        self._pairs = []
+        self._antecedents = {}
+        self._traces = {}
+
+    def add(self, trace, antecedent):
+        self._pairs.append((trace, antecedent))
+        self._antecedents[trace] = antecedent
+        self._traces.setdefault(antecedent, []).append(trace)
+
+    def __len__(self):
+        return len(self._pairs)
+
+    def __iter__(self):
+        """
+        Generate (trace, antecedent) pairs
+        """
+        return iter(self._pairs)
+
+    def antecedent(self, trace):
+        """
+        The node a trace is coindexed with, or None
+        """
+        return self._antecedents.get(trace)
+
+    def traces(self, antecedent):
+        """
+        The traces coindexed with a node
+        """
+        return list(self._traces.get(antecedent, ()))
+
+    def view(self, trace):
+        """
+        A TracedNode standing for the trace's antecedent at the trace's
+        position, or None if the trace is unresolved. Gapped nodes aren't
+        traces, so they have no view
+        """
+        antecedent = self._antecedents.get(trace)
+        if antecedent is None or not trace.isLeaf():
+            return None
+        return TracedNode(trace=trace, target=antecedent)
+
+    @classmethod
+    def fromTree(cls, sentence):
+        """
+        Build the table from the traced links of a sentence's nodes
+        """
+        table = cls()
+        for node in sentence.depthList():
+            if node.traced is not None:
+                table.add(node, node.traced)
+        return table
@@ -3,24 +3,49 @@ from _PTBNode import PTBNode
 class TracedNode(PTBNode):
     """
     A node referred to by a trace, so that other elements can pretend
-    it's actually the original
-
-    TODO: Test!!!
+    it's actually the original. It takes the place of the trace's
+    constituent: it has that constituent's label, parent and position,
+    and the trace's target as its only child. It is a view, so neither
+    tree is changed
     """
+    __slots__ = ('trace', 'target', 'traceType')
+
     def __init__(self, **kwargs):
         """
         Store the target and the trace's constituent
         """
         self.trace = kwargs.pop('trace')
         self.target = kwargs.pop('target')
-        self.traceType = trace.text.split('-')[0]
+        self.traceType = self.trace.text.split('-')[0]
+        constituent = self.trace.parent()
+        # Filled in directly, as Node.__init__ would take a new globalID
+        self.globalID = self.trace.globalID
+        self.label = constituent.label
+        self.functionLabel = constituent.functionLabel
+        self.unf = constituent.unf
+        self.identifier = constituent.identifier
+        self.identified = None
+        self.start_time = constituent.start_time
+        self.end_time = constituent.end_time
+        self.traced = None
+        # The target is linked in one direction only, so it keeps its parent
+        self._children = [self.target]
         self._parent = None
-        self.globalID = trace.globalID
-        self.label = trace.parent().label
-        self.functionLabels = trace.parent().functionLabels
+        self._yield = None
+        self._yieldVersion = -1
+        self._treeIndex = None
+        self._edits = 0
 
-    def getWordID(self, worNum):
+    def parent(self):
+        return self.trace.parent().parent()
+
+    def getWordID(self, index):
         return self.trace.wordID
 
     def children(self):
         return [self.target]
+
+    def _words(self):
+        # The view is never edited itself, so its yield is the target's,
+        # which is kept current with the target's edits
+        return self.target._words()
@@ -2,8 +2,20 @@ from _PTBNode import PTBNode
 from _PTBSentence import PTBSentence
 from _PTBLeaf import PTBLeaf
 from _TracedNode import TracedNode
+from _TraceTable import TraceTable
+from _TerminalTable import TerminalTable
 from _PTBFile import PTBFile
 from _PTBFile import NXTFile
+from _PTBFile import readSentences
+from _PTBFile import iterSentences
+from _PTBFile import nxtSentences
 from _PennTreebank import PennTreebank
 from _PennTreebank import NXTSwitchboard
+from _SentenceStore import SentenceStore
+from _SentenceStore import LazyTextStore
+from _SentenceStore import FrozenSentence
+from _SentenceStore import StoreTable
+from _SentenceStore import sharedStores
+from _ParseCache import ParseCache
+from _MappedCorpus import MappedCorpus
 
@@ -1,7 +1,13 @@
 import unittest
 import os.path
 import os
+import multiprocessing
+import pickle
+import shutil
+import StringIO
+import tempfile
 
+import Treebank.Nodes
 import Treebank.PTB
 
 class TestPTB(unittest.TestCase):
@@ -13,6 +19,559 @@ class TestPTB(unittest.TestCase):
         self.assertEqual(41, len(asbestos.listWords()))
 
 
+class TestNodes(unittest.TestCase):
+    def test_cached_yield(self):
+        text = '( (S (NP-SBJ (PRP I)) (VP (VBD saw) (NP (PRP you))) (. .)) )'
+        sent = Treebank.PTB.PTBFile(path='test.mrg', string=text).child(0)
+        vp = sent.child(0).child(1)
+        self.assertEqual(vp.getWordID(-1), 2)
+        self.assertEqual(len(sent.listWords()), 4)
+        vp.child(1).prune()
+        self.assertEqual(vp.getWordID(-1), 1)
+        self.assertEqual([w.text for w in sent.listWords()], ['I', 'saw', '.'])
+
+    def test_slots(self):
+        text = '( (S (NP-SBJ-1 (PRP I)) (VP (VBD saw) (NP (NN^VB saw))) (. .)) )\n'
+        for frozen in (False, True):
+            file_ = Treebank.PTB.PTBFile(path='test.mrg', string=text * 2, frozen=frozen)
+            first, second = file_.children()
+            for node in [first] + first.depthList():
+                self.assertFalse(hasattr(node, '__dict__'))
+            # Labels and tags are interned, so equal ones are one string
+            for node, other in zip(first.depthList(), second.depthList()):
+                self.assertTrue(node.label is other.label)
+            self.assertEqual(first.listWords()[2].label, 'NN')
+        node = Treebank.PTB.PTBFile(path='test.mrg', string=text).child(0).child(0)
+        self.assertRaises(AttributeError, setattr, node, 'colour', 'red')
+        self.assertEqual(Treebank.PTB.PTBNode.parseLabel('NP-SBJ-1'), ('NP', 'SBJ', False, '1', None))
+        self.assertEqual(Treebank.PTB.PTBNode.parseLabel('NP-SBJ-UNF'), ('NP', 'SBJ', True, None, None))
+        self.assertEqual(Treebank.PTB.PTBNode.parseLabel('NP=2'), ('NP', None, False, None, '2'))
+        self.assertTrue(Treebank.PTB.PTBNode.parseLabel('NP-SBJ-1') is
+                        Treebank.PTB.PTBNode.parseLabel('NP-SBJ-1'))
+        self.assertEqual(Treebank.PTB.PTBLeaf.normaliseTag('NN^VB'), 'NN')
+
+    def test_tree_index(self):
+        text = '( (S (NP-SBJ (PRP I)) (VP (VBD saw) (NP (DT the) (NN dog))) (. .)) )'
+        for frozen in (True, False):
+            sent = Treebank.PTB.PTBFile(path='test.mrg', string=text, frozen=frozen).child(0)
+            clause = sent.child(0)
+            subject, vp, stop = clause.children()
+            the, dog = vp.child(1).listWords()
+            self.assertTrue(clause.dominates(dog))
+            self.assertTrue(vp.dominates(the))
+            self.assertFalse(subject.dominates(the))
+            self.assertFalse(vp.dominates(vp))
+            self.assertFalse(dog.dominates(vp))
+            self.assertTrue(the.commonAncestor(dog) is vp.child(1))
+            self.assertTrue(the.commonAncestor(stop) is clause)
+            self.assertTrue(vp.commonAncestor(the) is vp)
+            self.assertTrue(dog.isUnder('VP'))
+            self.assertTrue(dog.isUnder('NP'))
+            self.assertFalse(subject.child(0).isUnder('VP'))
+            self.assertFalse(vp.isUnder('VP'))
+        # The index of the editable tree is rebuilt once it is edited
+        index = sent.treeIndex()
+        self.assertTrue(sent.treeIndex() is index)
+        the.prune()
+        self.assertFalse(sent.treeIndex() is index)
+        self.assertFalse(vp.dominates(the))
+        self.assertTrue(dog.commonAncestor(vp.child(0)) is vp)
+
+    def test_word_features(self):
+        text = '( (S (EDITED (NP-SBJ (PRP I))) (, ,) (NP-SBJ (PRP I)) ' \
+            '(VP-UNF (VBD gue-) (NP (-NONE- *T*-1))) (. .)) )'
+        for frozen in (False, True):
+            sent = Treebank.PTB.PTBFile(path='test.mrg', string=text, frozen=frozen).child(0)
+            features = sent.wordFeatures()
+            self.assertEqual(features, [(1, 4, 0), (0, 2, sent.IS_PUNCT), (0, 3, 0),
+                                        (8, 3, sent.IS_PARTIAL), (8, 4, sent.IS_TRACE),
+                                        (0, 2, sent.IS_PUNCT)])
+            # EDITED detection, as the conversion scripts do it, agrees
+            # with asking each word
+            edited = sent.wordFeatures(labels=('EDITED',))
+            self.assertEqual([bool(mask) for mask, depth, flags in edited],
+                             [w.isUnder('EDITED') for w in sent.listWords()])
+            nontrace = [mask for mask, depth, flags in edited if not flags & sent.IS_TRACE]
+            self.assertEqual([i for i, mask in enumerate(nontrace) if mask], [0])
+
+    def test_word_positions(self):
+        text = '( (S (NP-SBJ (PRP I)) (VP (VBD saw) (NP (PRP you))) (. .)) )'
+        sent = Treebank.PTB.PTBFile(path='test.mrg', string=text).child(0)
+        words = sent.listWords()
+        times = [(0.0, 0.5), (0.75, 1.0), (-1, -1), (None, None)]
+        for word, (start, end) in zip(words, times):
+            word.start_time, word.end_time = start, end
+        self.assertEqual([sent.wordPosition(w) for w in words], [0, 1, 2, 3])
+        self.assertTrue(words[1].nextWord() is words[2])
+        self.assertTrue(words[1].prevWord() is words[0])
+        self.assertEqual((words[0].prevWord(), words[3].nextWord()), (None, None))
+        self.assertEqual(sent.gaps(), [0.25, None, None, None])
+        self.assertEqual(sent.pauses(), [0.25, 0.0, 0.0, None])
+        self.assertEqual((words[0].gapAfter(), words[1].gapAfter()), (0.25, None))
+        # Positions follow edits
+        sent.child(0).child(1).child(1).prune()
+        self.assertEqual(sent.wordPosition(words[3]), 2)
+        self.assertTrue(words[1].nextWord() is words[3])
+        self.assertEqual(sent.gaps(), [0.25, None, None])
+
+    def test_sweep(self):
+        text = '( (S (NP-SBJ (-NONE- *)) (VP (VB go) (NP (-NONE- *T*-1)) (PP (IN to) ' \
+            '(NP (NN school)))) (. .)) )'
+        def parse():
+            return Treebank.PTB.PTBFile(path='test.mrg', string=text).child(0)
+        # Traces go, then the constituents they leave empty
+        sent = parse()
+        removed = sent.sweep(lambda n: n.label == '-NONE-' or
+                             (not n.isLeaf() and not n.length()))
+        self.assertEqual(len(removed), 4)
+        self.assertEqual([n.label for n in sent.depthList()],
+                         ['S', 'VP', 'VB', 'PP', 'IN', 'NP', 'NN', '.'])
+        self.assertEqual([w.text for w in sent.listWords()], ['go', 'to', 'school', '.'])
+        self.assertTrue(all(n.parent() is None for n in removed))
+        # Named nodes, spliced out so that their children take their place
+        sent = parse()
+        pp = sent.child(0).child(1).child(2)
+        self.assertEqual([w.text for w in pp.listWords()], ['to', 'school'])
+        removed = sent.sweep(nodes=[pp], splice=True)
+        self.assertEqual(removed, [pp])
+        self.assertEqual([n.label for n in sent.child(0).child(1).children()], ['VB', 'NP', 'IN', 'NP'])
+        self.assertTrue(sent.child(0).child(1).child(2).parent() is sent.child(0).child(1))
+        self.assertEqual(pp.length(), 0)
+        self.assertEqual((pp.listWords(), pp.getWord(0)), ([], None))
+        self.assertRaises(ValueError, sent.sweep, lambda n: True, nodes=[])
+        self.assertRaises(ValueError, sent.sweep)
+
+    def test_edit_counts(self):
+        text = '( (S (NP-SBJ (PRP I)) (VP (VBD saw) (NP (PRP you))) (. .)) )\n'
+        file_ = Treebank.PTB.PTBFile(path='test.mrg', string=text * 2)
+        first, second = file_.child(0), file_.child(1)
+        cached = second._words()
+        index = second.treeIndex()
+        walk = second.depthFirst()
+        next(walk)
+        # Edits to one sentence leave the other's caches and walks alone
+        first.child(0).child(1).child(1).prune()
+        self.assertTrue(second._words() is cached)
+        self.assertTrue(second.treeIndex() is index)
+        self.assertEqual(len(list(walk)), 7)
+        self.assertEqual(len(first.listWords()), 3)
+        walk = file_.depthFirst()
+        next(walk)
+        first.child(0).child(0).prune()
+        self.assertRaises(RuntimeError, list, walk)
+
+    def test_walk_modes(self):
+        text = '( (S (NP-SBJ (PRP I)) (VP (VBD saw) (NP (PRP you))) (. .)) )'
+        def walk(order, mode):
+            # Prune the VP when the subject is reached
+            clause = Treebank.PTB.PTBFile(path='test.mrg', string=text).child(0).child(0)
+            labels = []
+            for node in getattr(clause, order)(mode):
+                labels.append(node.label)
+                if node.functionLabel == 'SBJ':
+                    clause.child(1).prune()
+            return labels
+        for order in ('depthFirst', 'postOrder', 'breadthFirst'):
+            self.assertRaises(RuntimeError, walk, order, 'lazy')
+            self.assertEqual(len(walk(order, 'snapshot')), 7)
+            self.assertRaises(ValueError, getattr(Treebank.Nodes.Node('X'), order), 'eager')
+        self.assertEqual(walk('depthFirst', 'tombstone'), ['NP', 'PRP', '.'])
+        self.assertEqual(walk('postOrder', 'tombstone'), ['PRP', 'NP', '.'])
+        self.assertEqual(walk('breadthFirst', 'tombstone'), ['NP', '.', 'PRP'])
+
+    def test_dispose(self):
+        text = '( (S (NP-SBJ (PRP I)) (VP (VBD saw) (NP (PRP you))) (. .)) )'
+        Treebank.Nodes.Node.weakParents = True
+        try:
+            file_ = Treebank.PTB.PTBFile(path='test.mrg', string=text)
+        finally:
+            Treebank.Nodes.Node.weakParents = False
+        sent = file_.child(0)
+        word = sent.listWords()[1]
+        self.assertEqual(word.parent().label, 'VP')
+        file_.dispose()
+        self.assertEqual(file_.length(), 0)
+        self.assertEqual(sent.length(), 0)
+        self.assertEqual(word.parent(), None)
+
+    def test_file_cache(self):
+        text = '( (S (NP-SBJ (PRP I)) (VP (VBD saw) (NP (PRP you))) (. .)) )'
+        files = [Treebank.PTB.PTBFile(path='%d.mrg' % i, string=text) for i in range(3)]
+        cache = Treebank.Nodes.FileCache(files[0].nbytes() * 2)
+        cache.put('0', files[0])
+        cache.put('1', files[1])
+        self.assertTrue(cache.get('0') is files[0])
+        cache.put('2', files[2])
+        self.assertEqual(cache.get('1'), None)
+        self.assertTrue(cache.get('2') is files[2])
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (2, 1, 1))
+
+    def test_manifest(self):
+        directory = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(directory, 'wsj', '00'))
+            os.makedirs(os.path.join(directory, 'wsj', '01'))
+            for name in ('00/wsj_0001.mrg', '00/wsj_0002.mrg', '01/wsj_0101.mrg'):
+                open(os.path.join(directory, 'wsj', name), 'w').write('( (INTJ (UH uh)) )\n')
+            root = os.path.join(directory, 'wsj')
+            manifestPath = os.path.join(directory, 'wsj.manifest')
+            first = Treebank.PTB.PennTreebank(path=root, manifestPath=manifestPath)
+            self.assertEqual(len(first._children), 3)
+            self.assertEqual([f.filename for f in first.section(1)], ['wsj_0101.mrg'])
+            second = Treebank.PTB.PennTreebank(path=root, manifestPath=manifestPath)
+            self.assertEqual(second._children, first._children)
+            self.assertEqual(second.manifest.entries[2].number, 101)
+            open(os.path.join(root, '01', 'wsj_0102.mrg'), 'w').write('( (INTJ (UH uh)) )\n')
+            third = Treebank.PTB.PennTreebank(path=root, manifestPath=manifestPath)
+            self.assertEqual(len(third._children), 4)
+            # A manifest written for another kind of corpus over the same
+            # root isn't picked up
+            os.makedirs(os.path.join(root, 'xml', 'syntax'))
+            open(os.path.join(root, 'xml', 'syntax', 'sw2005.A.syntax.xml'), 'w').write('')
+            Treebank.PTB.PennTreebank(path=root, manifestPath=manifestPath)
+            nxt = Treebank.PTB.NXTSwitchboard(path=root, manifestPath=manifestPath)
+            self.assertEqual(nxt._children, ['sw2005'])
+            fourth = Treebank.PTB.PennTreebank(path=root, manifestPath=manifestPath)
+            self.assertEqual(fourth._children, third._children)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_sentence_index(self):
+        directory = tempfile.mkdtemp()
+        try:
+            text = '( (CODE (SYM SpeakerB1) (. .)) )\n' \
+                   '( (S (EDITED (NP-SBJ (PRP I))) (NP-SBJ (PRP I)) (VP (VBD left))) )\n'
+            root = os.path.join(directory, 'corpus')
+            os.mkdir(root)
+            open(os.path.join(root, 'sw2001.mrg'), 'w').write(text)
+            indexPath = os.path.join(directory, 'sentences.idx')
+            corpus = Treebank.PTB.PennTreebank(path=root, sentenceIndexPath=indexPath)
+            index = corpus.sentenceIndex()
+            entry = index.entry('sw2001.mrg~0002')
+            self.assertEqual((entry.nWords, entry.speaker, entry.edited), (3, 'B', True))
+            sent = corpus.sentence('sw2001.mrg~0002')
+            self.assertEqual(str(sent), str(corpus.child(0).child(1)))
+            reopened = Treebank.PTB.PennTreebank(path=root).sentenceIndex(indexPath)
+            self.assertEqual(reopened.entries, index.entries)
+            self.assertEqual(sorted(os.listdir(directory)), ['corpus', 'sentences.idx'])
+            # A rewrite of the same size is caught from its mtime's fraction
+            path = os.path.join(root, 'sw2001.mrg')
+            mtime = os.stat(path).st_mtime
+            open(path, 'w').write(text.replace('SpeakerB1', 'SpeakerA1'))
+            os.utime(path, (mtime, int(mtime) + (0.25 if mtime % 1 > 0.5 else 0.75)))
+            reopened = Treebank.PTB.PennTreebank(path=root).sentenceIndex(indexPath)
+            self.assertEqual(reopened.entry('sw2001.mrg~0002').speaker, 'A')
+            open(path, 'w').write(text)
+            sample = corpus.sample(5, seed=0, filter=lambda entry: entry.edited)
+            self.assertEqual([s.globalID for s in sample], ['sw2001.mrg~0002'])
+            # Without a path the index is only kept in memory, and nothing
+            # is written into the corpus
+            inMemory = Treebank.PTB.PennTreebank(path=root).sentenceIndex()
+            self.assertEqual(inMemory.entries, index.entries)
+            self.assertEqual(os.listdir(root), ['sw2001.mrg'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_map(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for i in range(3):
+                text = '( (INTJ (UH uh-huh)) )\n' * (i + 1) + \
+                    '( (S (NP-SBJ (PRP I)) (VP (VBD left))) )\n'
+                open(os.path.join(directory, 'sw200%d.mrg' % (i + 1)), 'w').write(text)
+            corpus = Treebank.PTB.PennTreebank(path=directory)
+            serial = list(corpus.map(_summarise, workers=1))
+            self.assertEqual([r[:3] for r in serial], [('sw2001.mrg', 2, 1), ('sw2002.mrg', 3, 1),
+                                                       ('sw2003.mrg', 4, 1)])
+            # workers=1 runs in this process, with globalIDs from its counter
+            self.assertEqual(set(r[3:] for r in serial), set([(os.getpid(), 0)]))
+            for workers in (2, 0):
+                pooled = list(corpus.map(_summarise, workers=workers))
+                self.assertEqual([r[:3] for r in pooled], [r[:3] for r in serial])
+                # Each worker numbers its nodes in a range of its own
+                for r in pooled:
+                    self.assertNotEqual(r[3], os.getpid())
+                    self.assertEqual(r[4], r[3])
+            unordered = corpus.map(_summarise, workers=2, ordered=False)
+            self.assertEqual(sorted(r[:3] for r in unordered), [r[:3] for r in serial])
+            some = corpus.map(_summarise, workers=2, indices=[2, 0], chunksize=2)
+            self.assertEqual([r[0] for r in some], ['sw2003.mrg', 'sw2001.mrg'])
+            for workers in (1, 2):
+                try:
+                    list(corpus.map(_failOnSecond, workers=workers))
+                except Treebank.Nodes.FileError, error:
+                    self.assertEqual(os.path.basename(error.path), 'sw2002.mrg')
+                    self.assertTrue('second file' in error.details)
+                else:
+                    self.fail('FileError not raised')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_parse_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'sw2001.mrg')
+            open(path, 'w').write('( (S (NP-SBJ-1 (PRP I)) (VP (VBD saw) (NP (-NONE- *ICH*-1)))) )\n')
+            cache = Treebank.PTB.ParseCache(os.path.join(directory, 'cache'))
+            parsed = Treebank.PTB.PTBFile(path=path, parseCache=cache)
+            loaded = Treebank.PTB.PTBFile(path=path, parseCache=cache)
+            frozen = Treebank.PTB.PTBFile(path=path, parseCache=cache, frozen=True)
+            self.assertEqual((cache.hits, cache.misses), (2, 1))
+            self.assertEqual(str(loaded.child(0)), str(parsed.child(0)))
+            self.assertEqual(str(frozen.child(0)), str(parsed.child(0)))
+            self.assertEqual(loaded.child(0).listWords()[2].traced.label, 'NP')
+            open(path, 'a').write('( (INTJ (UH uh-huh)) )\n')
+            self.assertEqual(Treebank.PTB.PTBFile(path=path, parseCache=cache).length(), 2)
+            self.assertEqual(cache.misses, 2)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_visitors(self):
+        text = '( (S (NP-SBJ (-NONE- *)) (VP (VB go) (NP (-NONE- *T*-1)))) )\n'
+        file_ = Treebank.PTB.PTBFile(path='test.mrg', string=text * 2)
+        pruner = PruneEmpty()
+        file_.performOperation(pruner)
+        self.assertEqual([w.text for w in file_.child(0).listWords()], ['go'])
+        self.assertEqual([n.label for n in file_.child(1).depthList()], ['S', 'VP', 'VB'])
+        self.assertEqual((pruner.timings.runs, pruner.timings.walks), (1, 1))
+        self.assertEqual(pruner.timings.regions, 6)
+        directory = tempfile.mkdtemp()
+        try:
+            open(os.path.join(directory, 'sw2001.mrg'), 'w').write(text)
+            corpus = Treebank.PTB.PennTreebank(path=directory)
+            self.assertRaises(ValueError, corpus.performOperation, pruner, workers=1)
+            # Files aren't kept, so a corpus can't be walked again
+            changer = ChangeFiles()
+            self.assertRaises(ValueError, corpus.performOperation, changer)
+            self.assertEqual(changer.walked, ['sw2001.mrg'])
+            self.assertEqual(changer.worklist, [])
+            again = PruneEmpty()
+            again.moreChanges = True
+            self.assertRaises(ValueError, corpus.performOperation, again)
+            self.assertEqual(again.timings.nodes, 0)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_read_sentences(self):
+        header = '*x*  Copyright (C) 1995 University of Pennsylvania  *x*\n\n'
+        text = header + '( (S (NP-SBJ (PRP I))\n    (VP (VBD saw) (NP (PRP you)))))\n' + \
+            '( (INTJ (UH uh-huh)) )\n'
+        # Small chunks, so that sentences straddle them
+        read = list(Treebank.PTB.readSentences(StringIO.StringIO(text * 2), chunkSize=7))
+        self.assertEqual(len(read), 4)
+        offset, sentText = read[2]
+        self.assertEqual((text * 2)[offset:offset + len(sentText)], sentText)
+        self.assertEqual(sentText, read[0][1])
+        self.assertTrue(sentText.startswith('( (S') and sentText.endswith('))))'))
+        sents = list(Treebank.PTB.iterSentences(StringIO.StringIO(text * 2), 'all.mrg'))
+        self.assertEqual([s.globalID for s in sents[2:]], ['all.mrg~0003', 'all.mrg~0004'])
+        self.assertEqual([w.text for w in sents[3].listWords()], ['uh-huh'])
+        self.assertEqual(Treebank.PTB.PTBFile(path='test.mrg', string=text).length(), 2)
+        # A sentence left open at the end is an error, not dropped
+        truncated = text + '( (S (NP-SBJ (PRP I)) (VP (VBD left))'
+        try:
+            list(Treebank.PTB.readSentences(StringIO.StringIO(truncated), chunkSize=7))
+        except ValueError, error:
+            self.assertTrue('offset %d' % len(text) in str(error))
+        else:
+            self.fail('ValueError not raised')
+        self.assertRaises(ValueError, Treebank.PTB.PTBFile, path='test.mrg', string=truncated)
+
+    def test_parse_string(self):
+        def parse(text):
+            sent = Treebank.PTB.PTBFile(path='test.mrg', string=text).child(0)
+            return sent, ' '.join(str(sent).split())
+        # Layout doesn't matter; -UNF becomes a flag
+        sent, tree = parse('(\n  (S-UNF (NP-SBJ-1   (PRP I))\n    (VP (VBD saw) (NP-1 (PRP you)) '
+                           '(NP (-NONE- *T*-1)) (ADVP (-NONE- *T*-3))))\n)')
+        self.assertEqual(tree, '(S (S-UNF (NP-SBJ (PRP I)) (VP (VBD saw) (NP (PRP you)) '
+                               '(NP (-NONE- *T*-1)) (ADVP (-NONE- *T*-3)))))')
+        self.assertTrue(sent.child(0).unf)
+        self.assertEqual([w.wordID for w in sent.listWords()], range(5))
+        # A repeated identifier traces to the last node with it in
+        # pre-order; an unknown one to nothing
+        words = sent.listWords()
+        vp = sent.child(0).child(1)
+        self.assertTrue(words[3].traced is vp.child(1))
+        self.assertEqual(words[4].traced, None)
+        self.assertEqual([(t.text, a.label) for t, a in sent.traces()],
+                         [('*T*-1', 'NP')])
+        # Gapping, with =
+        sent, tree = parse('( (S (S-1 (NP (PRP I))) (CC and) (S (NP=1 (PRP you)))) )')
+        self.assertTrue(sent.child(0).child(2).child(0).traced is sent.child(0).child(0))
+        # The top node is left out, so nothing traces to it
+        sent, tree = parse('( (S-1 (NP-SBJ (PRP I)) (VP (VBD said) (SBAR (-NONE- 0) '
+                           '(S (-NONE- *EXP*-1))))) )')
+        self.assertEqual(sent.listWords()[-1].traced, None)
+        self.assertEqual(len(sent.traces()), 0)
+        # A lone word as the top constituent
+        sent, tree = parse('( (. .) )')
+        self.assertEqual(tree, '(S (. .))')
+        self.assertTrue(sent.child(0).isLeaf())
+
+    def test_traces(self):
+        text = '( (SBARQ (WHNP-1 (WP what)) (SQ (VBP do) (NP-SBJ (PRP you)) ' \
+            '(VP (VB think) (NP (-NONE- *T*-1)))) (. ?)) )'
+        for frozen in (False, True):
+            sent = Treebank.PTB.PTBFile(path='test.mrg', string=text, frozen=frozen).child(0)
+            trace = sent.listWords()[4]
+            whnp = sent.child(0).child(0)
+            table = sent.traces()
+            self.assertEqual(len(table), 1)
+            self.assertTrue(table.antecedent(trace) is whnp)
+            self.assertEqual(table.traces(whnp), [trace])
+            view = table.view(trace)
+            self.assertEqual((view.label, view.traceType), ('NP', '*T*'))
+            self.assertEqual(view.parent().label, 'VP')
+            self.assertEqual([w.text for w in view.listWords()], ['what'])
+            self.assertTrue(whnp.parent() is sent.child(0))
+            if not frozen:
+                # The view's yield follows edits to the target
+                sent.listWords()[2].reattach(whnp)
+                self.assertEqual([w.text for w in view.listWords()], ['what', 'you'])
+        # The top node can't be traced to, frozen or not
+        text = '( (S-1 (NP-SBJ (PRP I)) (VP (VBD said) (SBAR (-NONE- 0) (S (-NONE- *EXP*-1))))) )'
+        for frozen in (False, True):
+            sent = Treebank.PTB.PTBFile(path='test.mrg', string=text, frozen=frozen).child(0)
+            self.assertEqual(sent.listWords()[-1].traced, None)
+            self.assertEqual(len(sent.traces()), 0)
+
+
+def _summarise(file_):
+    # Module-level, so that Corpus.map can send it to its workers
+    node = file_.child(0).child(0)
+    return (file_.filename, file_.length(), len(file_.child(0).listWords()),
+            os.getpid(), node.globalID >> 32)
+
+
+def _failOnSecond(file_):
+    if file_.filename == 'sw2002.mrg':
+        raise ValueError('second file')
+    return file_.filename
+
+
+class ChangeFiles(Treebank.Nodes.Visitor):
+    """
+    Ask for each file to be walked again
+    """
+    def __init__(self):
+        Treebank.Nodes.Visitor.__init__(self)
+        self.walked = []
+
+    def actOn(self, node):
+        if isinstance(node, Treebank.Nodes.File):
+            self.walked.append(node.filename)
+            self.changed(node)
+
+
+class PruneEmpty(Treebank.Nodes.Visitor):
+    """
+    Remove traces, and the constituents left empty
+    """
+    def actOn(self, node):
+        if isinstance(node, (Treebank.Nodes.Sentence, Treebank.Nodes.File)):
+            return
+        if node.label == '-NONE-' or (not node.isLeaf() and not node._children):
+            parent = node.parent()
+            node.prune()
+            self.changed(parent)
+
+
+class TestFrozen(unittest.TestCase):
+    def test_frozen_file(self):
+        text = '( (S (NP-SBJ-1 (PRP I)) (VP (VBD saw) (NP (-NONE- *ICH*-1))) (. .)) )'
+        ptb = Treebank.PTB.PTBFile(path='test.mrg', string=text)
+        frozen = Treebank.PTB.PTBFile(path='test.mrg', string=text, frozen=True)
+        sent = ptb.child(0)
+        frozen_sent = frozen.child(0)
+        self.assertEqual(str(sent), str(frozen_sent))
+        self.assertEqual([w.text for w in sent.listWords()],
+                         [w.text for w in frozen_sent.listWords()])
+        self.assertEqual([n.label for n in sent.depthList()],
+                         [n.label for n in frozen_sent.depthList()])
+        trace = frozen_sent.listWords()[2]
+        self.assertEqual(trace.traced.label, 'NP')
+        self.assertRaises(AttributeError, trace.prune)
+
+    def test_several_tops(self):
+        # Only the last top-level constituent is kept, and it doesn't trace
+        # into the ones dropped
+        text = '( (INTJ-1 (UH uh)) (S (NP-SBJ (-NONE- *-1)) (. .)) )'
+        sent = Treebank.PTB.PTBFile(path='test.mrg', string=text).child(0)
+        frozen = Treebank.PTB.PTBFile(path='test.mrg', string=text, frozen=True).child(0)
+        thawed = frozen.thaw()
+        for other in (frozen, thawed):
+            self.assertEqual(str(other), str(sent))
+            self.assertEqual([(w.text, w.wordID) for w in other.listWords()],
+                             [('*-1', 1), ('.', 2)])
+            self.assertEqual(other.listWords()[0].traced, None)
+            self.assertEqual(len(other.traces()), 0)
+        self.assertEqual(len(sent.traces()), 0)
+
+    def test_shared_file(self):
+        text = '( (INTJ (UH uh-huh) (. .)) )\n( (INTJ (UH uh-huh) (. .)) )\n( (INTJ (UH yeah) (. .)) )'
+        table = Treebank.PTB.sharedStores
+        table.clear()
+        file_ = Treebank.PTB.PTBFile(path='test.mrg', string=text, shared=True)
+        first, second, third = file_.children()
+        self.assertTrue(first._store is second._store)
+        self.assertFalse(first._store is third._store)
+        self.assertEqual(str(second), str(first))
+        self.assertEqual((table.lookups, table.hits, len(table)), (3, 1, 2))
+
+    def test_pickle_frozen(self):
+        text = '( (S (NP-SBJ-1 (PRP I)) (VP (VBD saw) (NP (-NONE- *ICH*-1))) (. .)) )'
+        sent = Treebank.PTB.PTBFile(path='test.mrg', string=text, frozen=True).child(0)
+        copy = pickle.loads(pickle.dumps(sent, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(str(copy), str(sent))
+        self.assertEqual(copy.globalID, sent.globalID)
+        self.assertEqual(copy.listWords()[2].traced.label, 'NP')
+
+    def test_lazy_text(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'sw2001.mrg')
+            open(path, 'w').write('( (S (NP-SBJ-1 (PRP I)) (VP (VBD saw) (NP (-NONE- *ICH*-1)))) )\n'
+                                  '( (INTJ (UH uh-huh)) )\n')
+            lazy = Treebank.PTB.PTBFile(path=path, lazyText=True)
+            parsed = Treebank.PTB.PTBFile(path=path)
+            self.assertEqual([str(s) for s in lazy.children()], [str(s) for s in parsed.children()])
+            sent = lazy.child(0)
+            self.assertTrue(isinstance(sent._store, Treebank.PTB.LazyTextStore))
+            self.assertEqual([w.text for w in sent.listWords()], ['I', 'saw', '*ICH*-1'])
+            self.assertEqual(sent.listWords()[2].traced.label, 'NP')
+            # Texts end with their token, not at the next close bracket
+            store = Treebank.PTB.LazyTextStore.fromBuffer('( (NN dog) )', 1, 11)
+            store.source = '( (NN dog ) '
+            self.assertEqual(store.text(store.words[0]), 'dog')
+            copy = pickle.loads(pickle.dumps(sent, 2))
+            self.assertEqual(type(copy._store), Treebank.PTB.SentenceStore)
+            self.assertEqual(str(copy), str(sent))
+            self.assertRaises(ValueError, Treebank.PTB.PTBFile, path=path, lazyText=True,
+                              shared=True)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_mapped_corpus(self):
+        directory = tempfile.mkdtemp()
+        try:
+            open(os.path.join(directory, 'sw2001.mrg'), 'w').write(
+                '( (S (NP-SBJ-1 (PRP I)) (VP (VBD saw) (NP (-NONE- *ICH*-1)))) )\n'
+                '( (INTJ (UH uh-huh)) )\n')
+            corpus = Treebank.PTB.PennTreebank(path=directory)
+            path = os.path.join(directory, 'corpus.cols')
+            Treebank.PTB.MappedCorpus.write(corpus, path)
+            mapped = Treebank.PTB.MappedCorpus(path)
+            sents = list(mapped.sentences())
+            self.assertEqual([str(s) for s in sents], [str(s) for s in corpus.sentences()])
+            self.assertEqual(sents[0].listWords()[2].traced.label, 'NP')
+            self.assertEqual(str(mapped.sentence('sw2001.mrg~0002')), str(sents[1]))
+            self.assertEqual(str(pickle.loads(pickle.dumps(sents[0], 2))), str(sents[0]))
+            self.assertEqual(str(sents[0].thaw()), str(sents[0]))
+        finally:
+            shutil.rmtree(directory)
+
+
 class TestNXT(unittest.TestCase):
     def test_file(self):
         path = '/usr/local/data/NXT-Switchboard/'
@@ -23,5 +582,121 @@ class TestNXT(unittest.TestCase):
                 continue
             print node.duration(), node.gap_after(), ' '.join(w.text for w in node.listWords())
 
+    def test_streaming(self):
+        root = '<nite:root xmlns:nite="http://nite.sourceforge.net/">%s</nite:root>'
+        terminals = Treebank.PTB.TerminalTable()
+        terminals.readFile(StringIO.StringIO(root % (
+            '<word nite:id="s1_1" nite:start="0.5" nite:end="0.7" pos="UH" orth="yeah"/>'
+            '<sil nite:id="s1_2"/><punc nite:id="s1_3">.</punc>')), 'A',
+            document='sw2005.A.terminals.xml')
+        self.assertEqual(len(terminals), 3)
+        row = terminals.row('sw2005.A.terminals.xml#id(s1_3)')
+        self.assertEqual((terminals.wordIDs[row], terminals.xmlID(row)), (2, 's1_3'))
+        self.assertEqual(terminals.row('../terminals/sw2005.A.terminals.xml#id(s1_1)'), 0)
+        leaf = terminals.leaf(0)
+        self.assertEqual((leaf.text, leaf.label, leaf.start_time), ('yeah', 'UH', 0.5))
+        link = '<nite:child href="sw2005.A.terminals.xml#id(%s)"/>'
+        parse = '<parse nite:id="s1"><nt nite:id="s1_500" cat="INTJ">%s</nt></parse>' % (
+            link % 's1_1' + link % 's1_2' + link % 's1_3')
+        sents = list(Treebank.PTB.nxtSentences(StringIO.StringIO(root % parse), 'sw2005',
+                                               terminals))
+        self.assertEqual([s.globalID for s in sents], ['sw2005~0001'])
+        self.assertEqual([w.text for w in sents[0].listWords()], ['yeah', '.'])
+
+    def test_terminal_table(self):
+        root = '<nite:root xmlns:nite="http://nite.sourceforge.net/">%s</nite:root>'
+        tables = []
+        for speaker, orth in (('A', 'yeah'), ('B', 'right')):
+            table = Treebank.PTB.TerminalTable()
+            table.readFile(StringIO.StringIO(root % (
+                '<word nite:id="s1_1" nite:start="0.5" nite:end="n/a" pos="UH" orth="%s"/>'
+                % orth)), speaker, document='sw2005.%s.terminals.xml' % speaker)
+            # As returned from a parsePool's process
+            tables.append(pickle.loads(pickle.dumps(table, 2)))
+        terminals = tables[0]
+        terminals.extend(tables[1])
+        leaf = terminals.leaf(terminals.row('sw2005.B.terminals.xml#id(s1_1)'))
+        self.assertEqual((leaf.text, leaf.start_time, leaf.end_time), ('right', 0.5, None))
+        self.assertEqual(terminals.speakers.tostring(), 'AB')
+        self.assertEqual(terminals.startStrings, None)
+        # The time attributes as written, for add_swbd_timings
+        table = Treebank.PTB.TerminalTable(keepTimeStrings=True)
+        table.readFile(StringIO.StringIO(root % (
+            '<word nite:id="s1_1" nite:start="0.5" nite:end="?" pos="UH" orth="yeah"/>'
+            '<punc nite:id="s1_2">.</punc>')), 'A', document='sw2005.A.terminals.xml')
+        table = pickle.loads(pickle.dumps(table, 2))
+        self.assertEqual((table.startStrings, table.endStrings), (['0.5', None], ['?', None]))
+        self.assertEqual(table.endTimes[0], -1)
+
+    def test_order(self):
+        root = '<nite:root xmlns:nite="http://nite.sourceforge.net/">%s</nite:root>'
+        words = root % ''.join('<word nite:id="s1_%d" pos="NN" orth="w%d"/>' % (i, i)
+                               for i in range(1, 12))
+        link = '<nite:child href="sw2005.A.terminals.xml#id(s1_%d)"/>'
+        # A is discontinuous. Sorting by each child's first word in
+        # nite:id order put s1_11 first in A, and so B before A
+        parse = root % ('<parse nite:id="s1"><nt nite:id="s1_500" cat="S">'
+                        '<nt nite:id="s1_501" cat="A">%s</nt><nt nite:id="s1_502" cat="B">%s</nt>'
+                        '</nt></parse>' % (link % 9 + link % 11, link % 10))
+        def build(verifyOrder):
+            terminals = Treebank.PTB.TerminalTable()
+            terminals.readFile(StringIO.StringIO(words), 'A', document='sw2005.A.terminals.xml')
+            return list(Treebank.PTB.nxtSentences(StringIO.StringIO(parse), 'sw2005', terminals,
+                                                  verifyOrder=verifyOrder))[0]
+        self.assertEqual([w.text for w in build(False).listWords()], ['w9', 'w11', 'w10'])
+        self.assertRaises(ValueError, build, True)
+
+    def test_fetch(self):
+        directory = tempfile.mkdtemp()
+        try:
+            root = '<nite:root xmlns:nite="http://nite.sourceforge.net/">%s</nite:root>'
+            files = {}
+            for speaker, offset in (('A', 0.0), ('B', 0.25)):
+                words = []
+                parses = []
+                for sentence in (1, 2):
+                    link = '<nite:child href="sw2005.%s.terminals.xml#id(s%d_%%d)"/>' % (
+                        speaker, sentence)
+                    for word in (1, 2, 3):
+                        start = offset + sentence * 2 + word * 0.5
+                        words.append('<word nite:id="s%d_%d" nite:start="%f" nite:end="%f" '
+                                     'pos="NN" orth="%s%d%d"/>' % (sentence, word, start,
+                                                                  start + 0.25, speaker,
+                                                                  sentence, word))
+                    words.append('<punc nite:id="s%d_4">.</punc>' % sentence)
+                    parses.append('<parse nite:id="s%d"><nt nite:id="s%d_500" cat="S">'
+                                  '<nt nite:id="s%d_501" cat="NP">%s</nt>%s</nt></parse>' % (
+                                      sentence, sentence, sentence, link % 2 + link % 1,
+                                      link % 3 + link % 4))
+                files['terminals', speaker] = root % ''.join(words)
+                files['syntax', speaker] = root % ''.join(parses)
+                files['turns', speaker] = root % (
+                    '<turn nite:id="t1"><nite:child href="sw2005.%s.syntax.xml#id(s1)..id(s2)"/>'
+                    '</turn>' % speaker)
+            for (kind, speaker), text in files.items():
+                if not os.path.exists(os.path.join(directory, 'xml', kind)):
+                    os.makedirs(os.path.join(directory, 'xml', kind))
+                open(os.path.join(directory, 'xml', kind, 'sw2005.%s.%s.xml' % (
+                    speaker, kind)), 'w').write(text)
+            def read(**options):
+                file_ = Treebank.PTB.NXTFile(path=directory, filename='sw2005', **options)
+                return [(s.globalID, s.speaker, s.turnID, str(s),
+                         [(w.text, w.wordID, w.start_time, w.end_time) for w in s.listWords()])
+                        for s in file_.children()]
+            serial = read()
+            self.assertEqual(len(serial), 4)
+            self.assertEqual(serial[0][1:3], ('A', 't1'))
+            self.assertEqual(serial[0][4][0], ('A11', 0, 2.5, 2.75))
+            pool = multiprocessing.Pool(2)
+            try:
+                self.assertEqual(read(fetchThreads=4), serial)
+                self.assertEqual(read(parsePool=pool), serial)
+                self.assertEqual(read(fetchThreads=4, parsePool=pool), serial)
+            finally:
+                pool.terminate()
+                pool.join()
+        finally:
+            shutil.rmtree(directory)
+
 if __name__ == '__main__':
     unittest.main()
@@ -6,25 +6,17 @@ import os.path
 import os
 import plac
 
+from Treebank.PTB import TerminalTable
 
-class Token(object):
-    def __init__(self, node):
-        id_ = node.get('{http://nite.sourceforge.net/}id')
-        self.sent_id = int(id_[1:].split('_')[0])
-        self.word_id = int(id_.split('_')[1])
-        self.id = id_
-        self.start = node.get('{http://nite.sourceforge.net/}start')
-        self.end = node.get('{http://nite.sourceforge.net/}end')
-        self.pos = node.get('pos')
-        self.orth = node.get('orth')
-        self.pause = None
-        self.is_partial = self.pos == 'XX' or self.orth.endswith('-')
-
-    def __str__(self):
-        return '%s\t%s\t%s\t%s' % (self.orth.lower(), self.pos, self.start, self.end)
 
-    def __cmp__(self, other):
-        return cmp((self.sent_id, self.word_id), (other.sent_id, other.word_id))
+def format_token(tokens, row):
+    # Times are copied out as the terminals files give them
+    return '%s\t%s\t%s\t%s' % (tokens.text(row).lower(), tokens.label(row),
+                               tokens.startStrings[row], tokens.endStrings[row])
+
+
+def is_partial(tokens, row):
+    return tokens.label(row) == 'XX' or tokens.text(row).endswith('-')
 
 
 class Sentence(object):
@@ -33,31 +25,23 @@ class Sentence(object):
         self.id = int(node.get('{http://nite.sourceforge.net/}id')[1:])
         self.terminals = []
         for terminal in node.iter('{http://nite.sourceforge.net/}child'):
-            self.terminals.append(terminal.get('href').split('#')[1][3:-1])
+            self.terminals.append(terminal.get('href'))
 
     def __cmp__(self, other):
         return cmp(self.id, other.id)
 
 
-def read_tokens(loc):
-    tree = etree.parse(open(loc))
-    tokens = {} 
-    last_token = None
-    for node in tree.iter('word'):
-        token = Token(node)
-        tokens[token.id] = token
-        if last_token is not None:
-            if token.start in ('n/a', 'non-aligned') or last_token.end in ('n/a', 'non-aligned'):
-                last_token.pause = 0.0
-            else:
-                last_token.pause = float(token.start) - float(last_token.end)
-        last_token = token
-    for node in list(tree.iter('punc')) + list(tree.iter('sil')) + list(tree.iter('trace')):
-        id_ = node.get('{http://nite.sourceforge.net/}id')
-        tokens[id_] = None
-
+def read_tokens(locs):
+    """
+    The terminals of a conversation's terminals files, such as
+    sw2005.A.terminals.xml, in one TerminalTable
+    """
+    tokens = TerminalTable(keepTimeStrings=True)
+    for loc in locs:
+        tokens.readFile(loc, os.path.basename(loc).split('.')[1])
     return tokens
 
+
 def read_syntax(loc):
     tree = etree.parse(open(loc))
     sents = []
@@ -67,16 +51,14 @@ def read_syntax(loc):
 
 
 def do_file(terms_a, terms_b, syntax_a, syntax_b):
-    tokens = read_tokens(terms_a)
-    tokens.update(read_tokens(terms_b))
+    tokens = read_tokens([terms_a, terms_b])
     sentences = read_syntax(syntax_a) + read_syntax(syntax_b)
     lines = []
     for sent in sorted(sentences):
-        for t in sent.terminals:
-            #if t not in tokens:
-            #    lines.append(str(sent.filename) + t)
-            if t in tokens and tokens[t] and not tokens[t].is_partial:
-                lines.append(str(tokens[t]))
+        for href in sent.terminals:
+            row = tokens.row(href)
+            if row is not None and tokens.isWord(row) and not is_partial(tokens, row):
+                lines.append(format_token(tokens, row))
         lines.append('')
     return lines
 
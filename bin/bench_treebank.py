@@ -0,0 +1,476 @@
+"""Benchmarks for the Treebank loaders. Each benchmark prints a short report
+to stdout, so that numbers can be compared before and after a change.
+
+    python bench_treebank.py memory /usr/local/data/Penn3/parsed/mrg/swbd/2
+"""
+import gc
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+import plac
+
+import Treebank.Nodes
+import Treebank.PTB
+
+
+def rss_mb():
+    """Current resident set size, in megabytes"""
+    pages = int(open('/proc/self/statm').read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+
+
+def private_mb():
+    """Resident memory not shared with other processes, in megabytes"""
+    fields = open('/proc/self/statm').read().split()
+    return (int(fields[1]) - int(fields[2])) * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+
+
+def count_nodes(files):
+    nodes = 0
+    words = 0
+    for file_ in files:
+        for sent in file_.children():
+            nodes += len(sent.depthList()) + 1
+            words += len(sent.listWords())
+    return nodes, words
+
+
+def memory(loc, frozen=False):
+    """Load every file below loc and keep it resident. Reports the node
+    count and the RSS growth."""
+    before = rss_mb()
+    start = time.time()
+    corpus = Treebank.PTB.PennTreebank(path=loc, frozen=frozen)
+    files = list(corpus.children())
+    elapsed = time.time() - start
+    after = rss_mb()
+    nodes, words = count_nodes(files)
+    print '%d files, %d nodes, %d words' % (len(files), nodes, words)
+    print 'Load time: %.2fs' % elapsed
+    print 'RSS: %.1fMB -> %.1fMB (+%.1fMB, %.0f bytes/node)' % (
+        before, after, after - before, (after - before) * 1024 * 1024 / nodes)
+
+
+def memory_pass(loc, frozen=False, dispose=False, weakParents=False, freezeGC=False):
+    """Walk every sentence below loc once, without keeping anything.
+    Reports RSS after each file, and how much garbage was left in cycles
+    for the collector."""
+    gc.collect()
+    corpus = Treebank.PTB.PennTreebank(path=loc, frozen=frozen, dispose=dispose,
+                                       weakParents=weakParents, freezeGC=freezeGC)
+    start = time.time()
+    samples = []
+    nSents = 0
+    for file_ in corpus.children():
+        for sent in file_.children():
+            sent.listWords()
+            nSents += 1
+        samples.append(rss_mb())
+    elapsed = time.time() - start
+    cyclic = gc.collect()
+    print '%d files, %d sentences in %.2fs' % (len(samples), nSents, elapsed)
+    print 'RSS first/max/last: %.1fMB / %.1fMB / %.1fMB' % (samples[0], max(samples),
+                                                           samples[-1])
+    print 'Unreachable cycles left at the end: %d objects' % cyclic
+
+
+def sharing(loc, frozen=False):
+    """Load every file below loc in the shared mode, and report how many
+    sentences were deduplicated, and the memory that saved."""
+    table = Treebank.PTB.sharedStores
+    table.clear()
+    before = rss_mb()
+    start = time.time()
+    corpus = Treebank.PTB.PennTreebank(path=loc, shared=True)
+    files = list(corpus.children())
+    elapsed = time.time() - start
+    after = rss_mb()
+    print '%d files, %d sentences, %d distinct stores' % (len(files), table.lookups,
+                                                         len(table))
+    print 'Load time: %.2fs' % elapsed
+    print 'Dedup ratio: %.2f sentences/store (%.1f%% shared)' % (
+        table.ratio(), 100.0 * table.hits / max(table.lookups, 1))
+    print 'Store bytes saved: %.1fMB' % (table.bytesSaved / (1024.0 * 1024.0))
+    print 'RSS: %.1fMB -> %.1fMB (+%.1fMB)' % (before, after, after - before)
+
+
+def revisits(loc, frozen=False, cacheMB=0, lookups=500):
+    """Look up random sentences, mostly from a few files, the way the
+    interactive tools do. Reports the time taken and the file cache stats."""
+    corpus = Treebank.PTB.PennTreebank(path=loc, frozen=frozen,
+                                       cacheBytes=int(cacheMB * 1024 * 1024))
+    rng = random.Random(0)
+    nFiles = corpus.length()
+    start = time.time()
+    for i in xrange(lookups):
+        # Heavy-tailed choice of file, so that a few are revisited often
+        index = min(int(rng.paretovariate(1.0)) - 1, nFiles - 1)
+        file_ = corpus.child(index)
+        file_.child(rng.randrange(file_.length()))
+    elapsed = time.time() - start
+    print '%d lookups over %d files in %.2fs (%.1fms/lookup)' % (
+        lookups, nFiles, elapsed, 1000 * elapsed / lookups)
+    if corpus.fileCache() is not None:
+        stats = corpus.fileCache().stats()
+        print 'Cache: %(hits)d hits, %(misses)d misses (%(hitRate).2f), ' \
+              '%(evictions)d evictions, %(files)d files held' % stats
+        print 'Cache size: %.1fMB of %.1fMB' % (stats['bytes'] / (1024.0 * 1024.0),
+                                                cacheMB)
+
+
+def sampling(loc, frozen=False, n=100):
+    """Draw a random sample of sentences through the sentence index, and
+    compare with parsing the whole corpus to draw it."""
+    corpus = Treebank.PTB.PennTreebank(path=loc, frozen=frozen)
+    start = time.time()
+    index = corpus.sentenceIndex()
+    opened = time.time() - start
+    start = time.time()
+    sample = corpus.sample(n, seed=0)
+    sampled = time.time() - start
+    start = time.time()
+    sents = list(corpus.sentences())
+    random.Random(0).sample(sents, n)
+    parsed = time.time() - start
+    print '%d sentences indexed; index opened in %.2fs' % (len(index), opened)
+    print 'Sample of %d through the index: %.3fs' % (len(sample), sampled)
+    print 'Sample of %d by parsing everything: %.2fs' % (n, parsed)
+
+
+def _countWords(file_):
+    return sum(len(sent.listWords()) for sent in file_.children())
+
+
+def parallel(loc, frozen=False, workers=0):
+    """Count the words of every file, serially and with Corpus.map."""
+    corpus = Treebank.PTB.PennTreebank(path=loc, frozen=frozen)
+    start = time.time()
+    serial = list(corpus.map(_countWords, workers=1))
+    serialTime = time.time() - start
+    start = time.time()
+    pooled = list(corpus.map(_countWords, workers=workers))
+    pooledTime = time.time() - start
+    assert pooled == serial
+    print '%d files, %d words, %d CPUs' % (len(serial), sum(serial),
+                                           multiprocessing.cpu_count())
+    print 'Serial: %.2fs' % serialTime
+    print 'Pool of %d: %.2fs (%.1fx)' % (workers or multiprocessing.cpu_count(),
+                                         pooledTime, serialTime / pooledTime)
+
+
+def _loadAll(loc, frozen, parseCacheDir):
+    start = time.time()
+    corpus = Treebank.PTB.PennTreebank(path=loc, frozen=frozen, parseCacheDir=parseCacheDir)
+    nSents = sum(len(file_) for file_ in corpus.children())
+    return nSents, time.time() - start
+
+
+def parse_cache(loc, frozen=False):
+    """Load every file below loc without the parse cache, then through an
+    empty cache (cold) and a filled one (warm)."""
+    cacheDir = tempfile.mkdtemp()
+    try:
+        nSents, uncached = _loadAll(loc, frozen, None)
+        nSents, cold = _loadAll(loc, frozen, cacheDir)
+        nSents, warm = _loadAll(loc, frozen, cacheDir)
+        size = sum(os.path.getsize(os.path.join(cacheDir, name))
+                   for name in os.listdir(cacheDir))
+    finally:
+        shutil.rmtree(cacheDir)
+    print '%d sentences, cache size %.1fMB' % (nSents, size / (1024.0 * 1024.0))
+    print 'No cache: %.2fs' % uncached
+    print 'Cold:     %.2fs' % cold
+    print 'Warm:     %.2fs (%.1fx faster than parsing)' % (warm, uncached / warm)
+
+
+def _holdAll(task):
+    """Open a corpus and keep every sentence, reporting the time taken
+    and the process's private memory"""
+    kind, path = task
+    before = private_mb()
+    start = time.time()
+    if kind == 'mapped':
+        corpus = Treebank.PTB.MappedCorpus(path)
+    else:
+        corpus = Treebank.PTB.PennTreebank(path=path, frozen=True)
+    opened = time.time() - start
+    sentences = list(corpus.sentences())
+    words = sum(len(sent.listWords()) for sent in sentences)
+    return words, opened, time.time() - start, private_mb() - before
+
+
+def mapped(loc, frozen=True, workers=4):
+    """Hold every sentence below loc in several processes at once, parsed
+    in each (frozen) and read from one MappedCorpus file."""
+    colsDir = tempfile.mkdtemp()
+    path = os.path.join(colsDir, 'corpus.cols')
+    try:
+        # Start the workers before anything is loaded, so they share nothing
+        pool = multiprocessing.Pool(workers)
+        start = time.time()
+        Treebank.PTB.MappedCorpus.write(Treebank.PTB.PennTreebank(path=loc), path)
+        print 'Written in %.2fs, %.1fMB' % (time.time() - start,
+                                            os.path.getsize(path) / (1024.0 * 1024.0))
+        for kind, source in [('parsed', loc), ('mapped', path)]:
+            results = pool.map(_holdAll, [(kind, source)] * workers, 1)
+            assert len(set(result[0] for result in results)) == 1
+            print '%s: open %.3fs, all sentences %.2fs, %.1fMB private per process' % (
+                kind, max(r[1] for r in results), max(r[2] for r in results),
+                sum(r[3] for r in results) / workers)
+        pool.close()
+        pool.join()
+    finally:
+        shutil.rmtree(colsDir)
+
+
+class _PruneEmpty(Treebank.Nodes.Visitor):
+    """Remove traces and the constituents left empty, revisiting only the
+    parents of pruned nodes"""
+    def actOn(self, node):
+        if isinstance(node, (Treebank.Nodes.Sentence, Treebank.Nodes.File)):
+            return
+        if node.label == '-NONE-' or (not node.isLeaf() and not node._children):
+            parent = node.parent()
+            node.prune()
+            self.changed(parent)
+
+
+class _PruneEmptyRewalk(_PruneEmpty):
+    """The same, walking the whole file again after any change"""
+    def actOn(self, node):
+        if isinstance(node, Treebank.Nodes.File):
+            self.moreChanges = False
+        else:
+            _PruneEmpty.actOn(self, node)
+
+    def changed(self, node):
+        self.moreChanges = True
+
+
+class _CountLabels(Treebank.Nodes.Visitor):
+    """Count the constituent labels of a file"""
+    readOnly = True
+
+    def newStructure(self):
+        self.counts = {}
+
+    def actOn(self, node):
+        if not isinstance(node, (Treebank.Nodes.Sentence, Treebank.Nodes.File)):
+            self.counts[node.label] = self.counts.get(node.label, 0) + 1
+
+    def result(self):
+        return self.counts
+
+    def reduce(self, results):
+        counts = {}
+        for result in results:
+            for label, count in result.items():
+                counts[label] = counts.get(label, 0) + count
+        return counts
+
+
+def visitors(loc, frozen=False, workers=0):
+    """Prune empty constituents with a worklist and with full re-walks, then
+    count labels serially and fanned out over worker processes."""
+    corpus = Treebank.PTB.PennTreebank(path=loc)
+    pruned = {}
+    for visitor in [_PruneEmptyRewalk(), _PruneEmpty()]:
+        trees = []
+        for file_ in corpus.children():
+            file_.performOperation(visitor)
+            trees.extend(str(sent) for sent in file_.children())
+        pruned[type(visitor)] = trees
+        print '%s: %r' % (type(visitor).__name__, visitor.timings)
+    assert pruned[_PruneEmpty] == pruned[_PruneEmptyRewalk]
+    corpus = Treebank.PTB.PennTreebank(path=loc, frozen=frozen)
+    for n in [1, workers or multiprocessing.cpu_count()]:
+        counter = _CountLabels()
+        start = time.time()
+        counts = corpus.performOperation(counter, workers=n)
+        print 'Count labels, %d workers: %.2fs, %d labels, %r' % (
+            n, time.time() - start, len(counts), counter.timings)
+
+
+def parse(loc, frozen=False, repeats=3):
+    """Parse every sentence below loc from text already in memory, and
+    report sentences per second. The best of several runs is kept."""
+    corpus = Treebank.PTB.PennTreebank(path=loc)
+    texts = []
+    for path in corpus._children:
+        text = open(path).read()
+        texts.extend(text[start + 1:end - 1]
+                     for start, end in Treebank.PTB._PTBFile.sentenceSpans(text))
+    best = None
+    for i in xrange(repeats):
+        start = time.time()
+        if frozen:
+            for text in texts:
+                Treebank.PTB.SentenceStore.fromString(text)
+        else:
+            for text in texts:
+                Treebank.PTB.PTBSentence(string=text, globalID=None, localID=None)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print '%d sentences: %.2fs, %.0f sentences/sec' % (len(texts), best, len(texts) / best)
+
+
+def _scanText(task):
+    """Load and hold every file, then search the words' text"""
+    loc, lazyText = task
+    before = rss_mb()
+    start = time.time()
+    corpus = Treebank.PTB.PennTreebank(path=loc, frozen=True, lazyText=lazyText)
+    files = list(corpus.children())
+    loaded = time.time() - start
+    start = time.time()
+    matches = 0
+    chars = 0
+    for file_ in files:
+        for sent in file_.children():
+            for word in sent.listWords():
+                chars += len(word.text)
+                if word.text.startswith('uh'):
+                    matches += 1
+    return (matches, chars, loaded, time.time() - start, rss_mb() - before,
+            len(Treebank.PTB._SentenceStore.strings))
+
+
+def lazy_text(loc, frozen=True):
+    """Hold every file below loc frozen, with interned word text and with
+    text left in the mapped files, and search the words. Each mode runs in
+    a fresh process, so that both start with an empty string table."""
+    results = []
+    for lazyText in (False, True):
+        pool = multiprocessing.Pool(1)
+        results.append(pool.apply(_scanText, ((loc, lazyText),)))
+        pool.close()
+        pool.join()
+    assert results[0][:2] == results[1][:2]
+    print '%d matches in %d characters' % results[0][:2]
+    for name, result in zip(('Interned', 'Lazy'), results):
+        print '%s: load %.2fs, scan %.2fs, +%.1fMB, %d strings' % ((name,) + result[2:])
+
+
+def startup(loc, frozen=False, repeats=20):
+    """Open the corpus at loc by listing its directories, and through a
+    manifest, cold and then warm."""
+    manifestDir = tempfile.mkdtemp()
+    manifestPath = os.path.join(manifestDir, 'corpus.manifest')
+    try:
+        start = time.time()
+        for i in xrange(repeats):
+            corpus = Treebank.PTB.PennTreebank(path=loc)
+        listed = (time.time() - start) / repeats
+        start = time.time()
+        Treebank.PTB.PennTreebank(path=loc, manifestPath=manifestPath)
+        cold = time.time() - start
+        start = time.time()
+        for i in xrange(repeats):
+            Treebank.PTB.PennTreebank(path=loc, manifestPath=manifestPath)
+        warm = (time.time() - start) / repeats
+    finally:
+        shutil.rmtree(manifestDir)
+    print '%d files, %d directories, scandir %s' % (
+        len(corpus._children), len(corpus.manifest.directories),
+        'available' if Treebank.Nodes._Manifest.scandir else 'unavailable')
+    print 'Listed:        %.1fms' % (listed * 1000)
+    print 'Manifest cold: %.1fms' % (cold * 1000)
+    print 'Manifest warm: %.1fms' % (warm * 1000)
+
+
+def _loadConversation(task):
+    loc, filename, frozen = task
+    start = time.time()
+    file_ = Treebank.PTB.NXTFile(path=loc, filename=filename, frozen=frozen)
+    seconds = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return len(file_._children), seconds, peak
+
+
+def nxt_load(loc, frozen=False):
+    """Load each NXT conversation below loc in a fresh process, and report
+    the time taken and the process's peak RSS."""
+    corpus = Treebank.PTB.NXTSwitchboard(path=loc)
+    sentences = seconds = peak = 0
+    for filename in corpus._children:
+        pool = multiprocessing.Pool(1)
+        result = pool.apply(_loadConversation, ((loc, filename, frozen),))
+        pool.close()
+        pool.join()
+        sentences += result[0]
+        seconds += result[1]
+        peak = max(peak, result[2])
+    n = len(corpus._children)
+    print '%d conversations, %d sentences' % (n, sentences)
+    print 'Load: %.1fms per conversation' % (seconds * 1000 / n)
+    print 'Peak RSS: %.1fMB' % peak
+
+
+def nxt_open(loc, frozen=False, workers=2, repeats=5):
+    """Open the first NXT conversation below loc with its files read one
+    after another, fetched on a thread pool, and fetched with the terminals
+    parsed in a process pool. Run after dropping the page cache to see the
+    cost of cold reads."""
+    filename = Treebank.PTB.NXTSwitchboard(path=loc)._children[0]
+    pool = multiprocessing.Pool(workers or None)
+    modes = (('Sequential', {}), ('Threads', {'fetchThreads': 6}),
+             ('Threads+processes', {'fetchThreads': 6, 'parsePool': pool}))
+    try:
+        for name, options in modes:
+            times = []
+            for i in xrange(repeats):
+                start = time.time()
+                Treebank.PTB.NXTFile(path=loc, filename=filename, frozen=frozen, **options)
+                times.append(time.time() - start)
+            print '%s: first %.1fms, best %.1fms' % (name, times[0] * 1000,
+                                                     min(times) * 1000)
+    finally:
+        pool.close()
+        pool.join()
+
+
+BENCHMARKS = {'memory': memory, 'memory_pass': memory_pass, 'sharing': sharing,
+              'revisits': revisits, 'sampling': sampling, 'parallel': parallel,
+              'parse_cache': parse_cache, 'mapped': mapped,
+              'visitors': visitors, 'parse': parse,
+              'lazy_text': lazy_text, 'startup': startup,
+              'nxt_load': nxt_load, 'nxt_open': nxt_open}
+
+
+@plac.annotations(
+    benchmark=("One of: %s" % ', '.join(sorted(BENCHMARKS))),
+    loc=("Corpus or section location"),
+    frozen=("Load read-only FrozenSentence objects", "flag", "f"),
+    dispose=("memory_pass: dispose of each file once it is read", "flag", "d"),
+    weak=("memory_pass: use weak parent links", "flag", "w"),
+    freezeGC=("memory_pass: disable the collector while files are parsed", "flag", "g"),
+    cache_mb=("revisits: file cache budget in MB", "option", "c", float),
+    workers=("parallel, mapped, visitors, nxt_open: worker processes, 0 for one per CPU",
+             "option", "n", int),
+)
+def main(benchmark, loc, frozen=False, dispose=False, weak=False, freezeGC=False,
+         cache_mb=0.0, workers=0):
+    if benchmark == 'memory_pass':
+        memory_pass(loc, frozen=frozen, dispose=dispose, weakParents=weak,
+                    freezeGC=freezeGC)
+    elif benchmark == 'revisits':
+        revisits(loc, frozen=frozen, cacheMB=cache_mb)
+    elif benchmark == 'parallel':
+        parallel(loc, frozen=frozen, workers=workers)
+    elif benchmark == 'visitors':
+        visitors(loc, frozen=frozen, workers=workers)
+    elif benchmark == 'nxt_open':
+        nxt_open(loc, frozen=frozen, workers=workers)
+    elif benchmark == 'mapped':
+        mapped(loc, workers=workers or multiprocessing.cpu_count())
+    else:
+        BENCHMARKS[benchmark](loc, frozen=frozen)
+
+
+if __name__ == '__main__':
+    plac.call(main)
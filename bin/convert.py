@@ -219,14 +219,12 @@ def get_edited_yields(mrg_str):
     edits = []
     for sent in ptb_file.children():
         under_edit = set([])
-        words = [w for w in sent.listWords() if not w.isTrace()]
-        word_id = dict((w.wordID, i) for i, w in enumerate(words))
-        for node in sent.breadthList():
-            if node.label != 'EDITED':
-                continue
-            for word in node.listWords():
-                if not word.isTrace():
-                    under_edit.add(word_id[word.wordID])
+        # Number the non-trace words, noting those under an EDITED node
+        features = sent.wordFeatures(labels=('EDITED',))
+        nontrace = [mask for mask, depth, flags in features if not flags & sent.IS_TRACE]
+        for i, mask in enumerate(nontrace):
+            if mask:
+                under_edit.add(i)
         edits.append(under_edit)
     return edits
 
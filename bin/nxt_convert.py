@@ -9,54 +9,41 @@ import fabric.api
 import Treebank.PTB
 
 
-def get_dfl(word, sent):
+def get_dfl(word, sent, is_edited):
     turn = '%s%s' % (sent.speaker, sent.turnID[1:])
-    dfl = [turn, '1' if word.isEdited() else '0', str(word.start_time), str(word.end_time)]
+    dfl = [turn, '1' if is_edited else '0', str(word.start_time), str(word.end_time)]
     return '|'.join(dfl)
 
 
 def speechify(sent):
+    def is_unspoken(node):
+        return node.isLeaf() and (node.text == '?' or node.isPunct() or node.isTrace() or
+                                  node.isPartial())
     for word in sent.listWords():
-        if word.parent() is None or word.parent().parent() is None:
-            continue
-        if word.text == '?':
-            word.prune()
-        if word.isPunct() or word.isTrace() or word.isPartial():
-            word.prune()
         word.text = word.text.lower()
+    sent.sweep(is_unspoken)
 
 
 def remove_repairs(sent):
-    for node in sent.depthList():
-        if node.label == 'EDITED':
-            node.prune()
+    sent.sweep(lambda node: node.label == 'EDITED')
 
 
 def remove_fillers(sent):
-    for word in sent.listWords():
-        if word.label == 'UH':
-            word.prune()
-
+    sent.sweep(lambda node: node.isLeaf() and node.label == 'UH')
 
 
 def remove_prn(sent):
-    for node in sent.depthList():
+    def is_aside(node):
         if node.label != 'PRN':
-            continue
+            return False
         words = [w.text for w in node.listWords()]
-        if words == ['you', 'know'] or words == ['i', 'mean']:
-            node.prune()
+        return words == ['you', 'know'] or words == ['i', 'mean']
+    sent.sweep(is_aside)
 
 
 def prune_empty(sent):
-    for node in sent.depthList():
-        if not node.listWords():
-            try:
-                node.prune()
-            except:
-                print node
-                print sent
-                raise
+    # Bottom-up, so constituents emptied by the sweep are caught too
+    sent.sweep(lambda node: not node.isLeaf() and not node.length())
 
 
 def convert_to_conll(sents, name):
@@ -114,8 +101,9 @@ def do_section(ptb_files, out_dir, name):
         orig_words = []
         for sent in file_.children():
             speechify(sent)
-            orig_words.append([(w.wordID, w.text, w.label, get_dfl(w, sent))
-                              for w in sent.listWords()])
+            features = sent.wordFeatures(labels=('EDITED',))
+            orig_words.append([(w.wordID, w.text, w.label, get_dfl(w, sent, bool(feats[0])))
+                              for w, feats in zip(sent.listWords(), features)])
             remove_repairs(sent)
             remove_fillers(sent)
             remove_prn(sent)
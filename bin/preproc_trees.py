@@ -22,13 +22,11 @@ def add_edits(deps, ptb_sents):
     new_sents = []
     for dep_sent, ptb_sent in zip(dep_sents, ptb_sents):
         edits = set()
-        nontrace = [w for w in ptb_sent.listWords() if not w.isTrace()]
-        ids = dict((word, i) for i, word in enumerate(nontrace))
-        for node in ptb_sent.depthList():
-            if node.label == 'EDITED':
-                for word in node.listWords():
-                    if word.isTrace(): continue
-                    edits.add(ids[word])
+        features = ptb_sent.wordFeatures(labels=('EDITED',))
+        nontrace = [mask for mask, depth, flags in features if not flags & ptb_sent.IS_TRACE]
+        for i, mask in enumerate(nontrace):
+            if mask:
+                edits.add(i)
         new_sent = []
         for i, word in enumerate(dep_sent.split('\n')):
             if i in edits: